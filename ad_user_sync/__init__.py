@@ -1,5 +1,60 @@
-from .active_directory import *
-from .model import *
-from .import_users import import_users
-from .interactive_import import interactive_import
-from .export_users import export_users
+from importlib import import_module
+
+# Submodules are imported on first access, so the command line only loads what the chosen subcommand needs.
+# Only the names listed here are exported, anything else raises AttributeError without importing a submodule.
+_lazy_attributes = {
+    "CachedActiveDirectory": ".active_directory",
+    "CatchableADExceptions": ".active_directory",
+    "DirectoryLookupError": ".active_directory",
+    "import_users": ".import_users",
+    "interactive_import": ".interactive_import",
+    "export_users": ".export_users",
+    **dict.fromkeys(
+        [
+            "ExportConfig",
+            "ImportConfig",
+            "InteractiveImportConfig",
+            "ImportResult",
+            "ImportSummary",
+            "ObjectRecord",
+            "Action",
+            "NameAction",
+            "EnableAction",
+            "JoinAction",
+            "ResolutionList",
+            "Resolution",
+            "NameResolution",
+            "EnableResolution",
+            "JoinResolution",
+            "ResolutionParser",
+            "BulkResolution",
+            "ResolutionSelector",
+            "ServeConfig",
+            "DirectoryMetadata",
+            "GroupMetadata",
+            "DomainMetadata",
+            "ThrottleConfig",
+            "ThrottleStats",
+            "CacheConfig",
+            "CacheStats",
+            "NameIndexConfig",
+            "UserRecord",
+            "InvalidUserRecord",
+            "validate_user_records",
+        ],
+        ".model",
+    ),
+}
+
+__all__ = list(_lazy_attributes)
+
+
+def __getattr__(name: str):
+    module = _lazy_attributes.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(import_module(module, __name__), name)
+
+
+def __dir__():
+    return sorted([*globals(), *__all__])
@@ -1,18 +1,36 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import sys
 import importlib.metadata
+from typing import Callable
 
-from ad_user_sync.util import document_model
-from ad_user_sync.interactive_import import interactive_import, InteractiveImportConfig, import_users
-from ad_user_sync.export_users import export_users
-from ad_user_sync.model import ImportConfig, ResolutionList, ExportConfig
-from ad_user_sync.user_file import UserFile
+# Keep module level imports to a minimum. Subcommands import what they need when they run,
+# so `--version` and short scheduled runs don't pay for pyad, bottle, jinja2, pyminizip, ...
 from ad_user_sync.logger import Logger
-from ad_user_sync.embedded_config import EmbeddedConfig
 
-arg_parser = argparse.ArgumentParser(
+
+class ArgumentParser(argparse.ArgumentParser):
+    # The epilog documenting the config file is generated from the pydantic model schema.
+    # That is expensive, so it is only built when help is actually printed.
+    def __init__(self, *args, epilog_factory: Callable[[], str] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.epilog_factory = epilog_factory
+
+    def format_help(self) -> str:
+        if self.epilog_factory is not None:
+            self.epilog = self.epilog_factory()
+            self.epilog_factory = None
+        return super().format_help()
+
+
+def document_config(model_name: str) -> str:
+    from ad_user_sync import model
+    from ad_user_sync.util import document_model
+
+    return f"The CONFIG_FILE should contain a JSON object with the following values:\n\n{document_model(getattr(model, model_name))}"
+
+
+arg_parser = ArgumentParser(
     prog="ad-user-sync.exe",
     description="Import/Export Windows ActiveDirectory user accounts",
     add_help=True,
@@ -25,17 +43,40 @@ arg_parser.add_argument("--version",
 
 subparsers = arg_parser.add_subparsers(dest="command", help="Available commands")
 
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        metavar="DIR",
+        default=None,
+        help="Write the duration of every phase of the run to DIR/<command>-summary.json, e.g. to diagnose slow runs.",
+    )
+    parser.add_argument(
+        "--profile-cpu",
+        action="store_true",
+        help="With --profile, also write a cProfile statistics file (.pstats) for every phase.",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="With --profile, also trace memory allocations and report the peak and top allocations of every phase.",
+    )
+
+
 import_arg_parser = subparsers.add_parser(
     name="import",
     help="Import Users",
-    epilog=f"The CONFIG_FILE should contain a JSON object with the following values:\n\n{document_model(InteractiveImportConfig)}",
+    epilog_factory=lambda: document_config("InteractiveImportConfig"),
     formatter_class=argparse.RawTextHelpFormatter,
 )
 import_arg_parser.add_argument(
     "--config",
-    dest="config_file",
+    dest="config_files",
+    metavar="CONFIG_FILE",
+    action="append",
     default=None,
-    help="Configuration file to use.",
+    help="Configuration file to use. Repeat to import the same input into several target domains concurrently.",
 )
 import_arg_parser.add_argument(
     "--interactive",
@@ -44,12 +85,73 @@ import_arg_parser.add_argument(
 )
 
 import_arg_parser.add_argument("--hmac", dest="hmac", help="Verify HMAC on the input file using a shared key")
+import_arg_parser.add_argument(
+    "--output",
+    dest="output",
+    choices=["full", "summary", "events"],
+    default="full",
+    help=(
+        "What to write to stdout: the full result as JSON once the import finished (default), only the counts "
+        "of the changes, or every change as one line of JSON (NDJSON) while the import runs, followed by the counts."
+    ),
+)
+add_profile_arguments(import_arg_parser)
+
 
+def add_trace_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--record",
+        dest="record",
+        metavar="TRACE_FILE",
+        default=None,
+        help="Write every directory operation with its result and latency to TRACE_FILE. Passwords are left out.",
+    )
+    parser.add_argument(
+        "--replay",
+        dest="replay",
+        metavar="TRACE_FILE",
+        default=None,
+        help="Serve directory operations from a TRACE_FILE written by --record instead of a directory.",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        dest="replay_latency",
+        metavar="FACTOR",
+        type=float,
+        default=1.0,
+        help="With --replay, multiply the recorded latency of every operation by FACTOR (default: 1.0).",
+    )
+    parser.add_argument(
+        "--replay-busy-rate",
+        dest="replay_busy_rate",
+        metavar="RATE",
+        type=float,
+        default=0.0,
+        help="With --replay, fail this fraction of operations with a busy error (default: 0.0).",
+    )
+    parser.add_argument(
+        "--replay-timeout-rate",
+        dest="replay_timeout_rate",
+        metavar="RATE",
+        type=float,
+        default=0.0,
+        help="With --replay, fail this fraction of reads with a timeout after their latency (default: 0.0).",
+    )
+    parser.add_argument(
+        "--replay-seed",
+        dest="replay_seed",
+        type=int,
+        default=0,
+        help="With --replay, seed of the injected errors (default: 0).",
+    )
+
+
+add_trace_arguments(import_arg_parser)
 
 export_arg_parser = subparsers.add_parser(
     name="export",
     help="Export Users",
-    epilog=f"The CONFIG_FILE should contain a JSON object with the following values:\n\n{document_model(ExportConfig)}",
+    epilog_factory=lambda: document_config("ExportConfig"),
     formatter_class=argparse.RawTextHelpFormatter,
 )
 export_arg_parser.add_argument(
@@ -60,6 +162,54 @@ export_arg_parser.add_argument(
 )
 
 export_arg_parser.add_argument("--hmac", dest="hmac", help="Add HMAC to output file using a shared key")
+add_profile_arguments(export_arg_parser)
+add_trace_arguments(export_arg_parser)
+
+serve_arg_parser = subparsers.add_parser(
+    name="serve",
+    help="Keep running and import every new user file dropped into a directory",
+    epilog_factory=lambda: document_config("ServeConfig"),
+    formatter_class=argparse.RawTextHelpFormatter,
+)
+serve_arg_parser.add_argument(
+    "--config",
+    dest="config_file",
+    default="serve_config.json",
+    help="Configuration file to use.",
+)
+
+serve_arg_parser.add_argument("--hmac", dest="hmac", help="Verify HMAC on the input files using a shared key")
+
+embed_arg_parser = subparsers.add_parser(
+    name="embed",
+    help="Embed configs into an executable, which then uses them when started without --config",
+)
+embed_arg_parser.add_argument(
+    "executable",
+    metavar="EXECUTABLE",
+    help="Executable to embed the configs into, e.g. dist/ad-user-sync.exe as built by `poetry build`.",
+)
+embed_arg_parser.add_argument(
+    "--export-config",
+    dest="export_config",
+    metavar="CONFIG_FILE",
+    default=None,
+    help="Export configuration file to embed.",
+)
+embed_arg_parser.add_argument(
+    "--import-config",
+    dest="import_config",
+    metavar="CONFIG_FILE",
+    default=None,
+    help="Import configuration file to embed. Used by both `import` and `import --interactive`.",
+)
+embed_arg_parser.add_argument(
+    "--output",
+    dest="output",
+    metavar="FILE",
+    default=None,
+    help="Write the executable with the embedded configs to FILE instead of changing EXECUTABLE.",
+)
 
 def get_version():
     try:
@@ -67,45 +217,125 @@ def get_version():
     except importlib.metadata.PackageNotFoundError:
         return "(unknown)"
 
-if __name__ == "__main__":
-    args = arg_parser.parse_args()
-    Logger.init(args.command)
+
+def create_profiler(args: argparse.Namespace):
+    from pathlib import Path
+    from ad_user_sync.profiler import Profiler
+
+    if args.profile is None:
+        if args.profile_cpu or args.profile_memory:
+            arg_parser.error("--profile-cpu and --profile-memory require --profile")
+        return Profiler()  # only timings, nothing is written
+    return Profiler(Path(args.profile), args.command, cpu=args.profile_cpu, memory=args.profile_memory)
+
+
+def close_profiler(profiler) -> None:
+    path = profiler.close()
+    if path is not None:
+        Logger.get().info("Profile written to %s", path)
+
+
+def open_directory(args: argparse.Namespace, throttle, create_directory: Callable[[], object]):
+    # A recording or replayed directory session if requested, otherwise None and the command opens its own session.
+    from pathlib import Path
+
+    if args.record is not None and args.replay is not None:
+        arg_parser.error("--record and --replay can not be used together")
+    if args.replay is not None:
+        from ad_user_sync.active_directory import ReplayDirectory
+
+        return ReplayDirectory(
+            Path(args.replay),
+            Logger.get(),
+            throttle=throttle,
+            latency_multiplier=args.replay_latency,
+            busy_rate=args.replay_busy_rate,
+            timeout_rate=args.replay_timeout_rate,
+            seed=args.replay_seed,
+        )
+    if args.record is not None:
+        from ad_user_sync.active_directory import RecordingDirectory
+
+        Logger.get().info("Recording directory operations to %s", args.record)
+        return RecordingDirectory(create_directory(), Path(args.record))
+    return None
+
+
+def close_directory(directory) -> None:
+    if directory is not None:
+        directory.close()
+
+
+def run_import(args: argparse.Namespace) -> None:
+    if args.config_files is not None and len(args.config_files) > 1:
+        run_fan_out_import(args)
+        return
+
+    from ad_user_sync.util import JsonLinesWriter
+
+    write_event = JsonLinesWriter(sys.stdout) if args.output == "events" else None
+
+    from ad_user_sync.embedded_config import EmbeddedConfig
 
     embedded_config = EmbeddedConfig(Logger.get())
 
-    if args.version:
-        print(f"AD User Sync version: {get_version()}")
+    args.config_file = args.config_files[0] if args.config_files is not None else None
+    config_file = args.config_file or "import_config.json"
+    if args.interactive:
+        from ad_user_sync.model import InteractiveImportConfig
+        from ad_user_sync.interactive_import import interactive_import
 
-    elif args.command == "import":
-        config_file = args.config_file or "import_config.json"
-        if args.interactive:
-            if embedded_config.import_config is None or args.config_file is not None:
-                Logger.get().info("Using config: %s", config_file)
-                config = InteractiveImportConfig.load(file=config_file, logger=Logger.get(), fallback_default=False, exit_on_fail=True)
-            else:
-                Logger.get().info("Using embedded config")
-                config = embedded_config.import_config
-
-            config.hmac = args.hmac or config.hmac
-
-            Logger.set_config(config)
-            Logger.get().info(f"Starting AD User Sync version: {get_version()}")
-            result = interactive_import(
-                config=config,
-                logger=Logger.get(),
-            )
+        if args.output == "events":
+            arg_parser.error("--output events can not be used with --interactive")
+        if args.profile is not None:
+            arg_parser.error("--profile can not be used with --interactive")
+        if args.record is not None or args.replay is not None:
+            arg_parser.error("--record and --replay can not be used with --interactive")
 
+        if embedded_config.import_config is None or args.config_file is not None:
+            Logger.get().info("Using config: %s", config_file)
+            config = InteractiveImportConfig.load(file=config_file, logger=Logger.get(), fallback_default=False, exit_on_fail=True)
         else:
-            if embedded_config.import_config is None or args.config_file is not None:
-                Logger.get().info("Using config: %s", config_file)
-                config = ImportConfig.load(config_file, logger=Logger.get(), fallback_default=False, exit_on_fail=True)
-            else:
-                Logger.get().info("Using embedded config")
-                config = embedded_config.import_config
-
-            config.hmac = args.hmac or config.hmac
-            Logger.set_config(config)
-            Logger.get().info(f"Starting AD User Sync version: {get_version()}")
+            Logger.get().info("Using embedded config")
+            config = embedded_config.import_config
+
+        config.hmac = args.hmac or config.hmac
+
+        Logger.set_config(config)
+        Logger.get().info(f"Starting AD User Sync version: {get_version()}")
+        result = interactive_import(
+            config=config,
+            logger=Logger.get(),
+        )
+
+    else:
+        from ad_user_sync.model import ImportConfig, ResolutionList
+        from ad_user_sync.import_users import import_users
+        from ad_user_sync.active_directory import CachedActiveDirectory
+
+        if embedded_config.import_config is None or args.config_file is not None:
+            Logger.get().info("Using config: %s", config_file)
+            config = ImportConfig.load(config_file, logger=Logger.get(), fallback_default=False, exit_on_fail=True)
+        else:
+            Logger.get().info("Using embedded config")
+            config = embedded_config.import_config
+
+        config.hmac = args.hmac or config.hmac
+        Logger.set_config(config)
+        Logger.get().info(f"Starting AD User Sync version: {get_version()}")
+        profiler = create_profiler(args)
+        active_directory = open_directory(
+            args,
+            config.throttle,
+            lambda: CachedActiveDirectory(
+                Logger.get(),
+                ldap_server=config.ldap_server,
+                throttle=config.throttle,
+                cache=config.cache,
+                name_index=config.name_index,
+            ),
+        )
+        try:
             result = import_users(
                 config=config,
                 logger=Logger.get(),
@@ -115,28 +345,172 @@ if __name__ == "__main__":
                     save_default=True,
                     exit_on_fail=True,
                 ),
+                active_directory=active_directory,
+                on_event=write_event,
+                profiler=profiler,
             )
+        finally:
+            close_directory(active_directory)
+            close_profiler(profiler)
 
-        # write the result to stdout
+    # write the result to stdout
+    if args.output == "full":
         print(result.model_dump_json(indent=4))
-    elif args.command == "export":
-        config_file = args.config_file or "export_config.json"
-        if embedded_config.export_config is None or args.config_file is not None:
-            Logger.get().info("Using config: %s", config_file)
-            config = ExportConfig.load(config_file, logger=Logger.get(), fallback_default=False, exit_on_fail=True)
-        else:
-            Logger.get().info("Using embedded config")
-            config = embedded_config.export_config
+    elif args.output == "summary":
+        print(result.get_summary().model_dump_json(indent=4))
+    else:
+        write_event(dict(event="summary", **result.get_summary().model_dump(mode="json")))
+
+
+def run_fan_out_import(args: argparse.Namespace) -> None:
+    import json
+
+    from ad_user_sync.model import ImportConfig
+    from ad_user_sync.fan_out import fan_out_import
+    from ad_user_sync.util import JsonLinesWriter
 
+    if args.interactive:
+        arg_parser.error("--interactive can only be used with a single --config")
+    if args.profile is not None:
+        arg_parser.error("--profile can only be used with a single --config")
+    if args.record is not None or args.replay is not None:
+        arg_parser.error("--record and --replay can only be used with a single --config")
 
+    targets = {}
+    for config_file in args.config_files:
+        Logger.get().info("Using config: %s", config_file)
+        config = ImportConfig.load(config_file, logger=Logger.get(), fallback_default=False, exit_on_fail=True)
         config.hmac = args.hmac or config.hmac
+        targets[config_file] = config
+
+    # logging is set up once, by the first config
+    Logger.set_config(next(iter(targets.values())))
+    Logger.get().info(f"Starting AD User Sync version: {get_version()}")
+    write_event = JsonLinesWriter(sys.stdout) if args.output == "events" else None
+    results = fan_out_import(targets=targets, logger=Logger.get(), on_event=write_event)
+
+    # write the results to stdout
+    if args.output == "full":
+        print(json.dumps([result.model_dump(mode="json") for result in results], indent=4))
+        return
+
+    summaries = [
+        dict(
+            target=result.target,
+            duration=result.duration,
+            error=result.error,
+            **(result.result.get_summary().model_dump(mode="json") if result.result is not None else {}),
+        )
+        for result in results
+    ]
+    if args.output == "summary":
+        print(json.dumps(summaries, indent=4))
+    else:
+        for summary in summaries:
+            write_event(dict(event="summary", **summary))
+
+
+def run_export(args: argparse.Namespace) -> None:
+    import json
+
+    from ad_user_sync.embedded_config import EmbeddedConfig
+    from ad_user_sync.model import ExportConfig
+    from ad_user_sync.export_users import export_users
+    from ad_user_sync.active_directory import CachedActiveDirectory
+    from ad_user_sync.user_file import UserFile
 
-        users = export_users(config=config, logger=Logger.get())
+    embedded_config = EmbeddedConfig(Logger.get())
+
+    config_file = args.config_file or "export_config.json"
+    if embedded_config.export_config is None or args.config_file is not None:
+        Logger.get().info("Using config: %s", config_file)
+        config = ExportConfig.load(config_file, logger=Logger.get(), fallback_default=False, exit_on_fail=True)
+    else:
+        Logger.get().info("Using embedded config")
+        config = embedded_config.export_config
+
+
+    config.hmac = args.hmac or config.hmac
+
+    profiler = create_profiler(args)
+    active_directory = open_directory(
+        args, config.throttle, lambda: CachedActiveDirectory(Logger.get(), throttle=config.throttle)
+    )
+    try:
+        users = export_users(
+            config=config, logger=Logger.get(), profiler=profiler, active_directory=active_directory
+        )
+        profiler.phase("write")
         if config.export_file:
             UserFile(path=config.export_file, hmac=config.hmac).write(users)
         else:
             print(json.dumps(users, ensure_ascii=False, indent=4))
+    finally:
+        close_directory(active_directory)
+        close_profiler(profiler)
+
+
+def run_serve(args: argparse.Namespace) -> None:
+    from ad_user_sync.model import ServeConfig
+    from ad_user_sync.serve import serve
+
+    Logger.get().info("Using config: %s", args.config_file)
+    config = ServeConfig.load(args.config_file, logger=Logger.get(), fallback_default=False, exit_on_fail=True)
+    config.hmac = args.hmac or config.hmac
+
+    Logger.set_config(config)
+    Logger.get().info(f"Starting AD User Sync version: {get_version()}")
+    serve(config=config, logger=Logger.get())
+
+
+def run_embed(args: argparse.Namespace) -> None:
+    import shutil
+    from pathlib import Path
+
+    from ad_user_sync.embedded_config import EmbeddedConfig
+    from ad_user_sync.model import ExportConfig, InteractiveImportConfig
 
+    if args.export_config is None and args.import_config is None:
+        arg_parser.error("embed requires --export-config, --import-config or both")
+
+    executable = Path(args.executable)
+    if not executable.is_file():
+        arg_parser.error(f"Executable {executable} does not exist")
+    if EmbeddedConfig.read_sections(executable) != (None, None):
+        arg_parser.error(f"Executable {executable} already contains embedded configs, use a fresh build")
+
+    # The files are embedded as they are, but only if they are valid configs. An invalid embedded config is
+    # otherwise only noticed when the executable starts on the target machine.
+    def read_config(config_file: str | None, model) -> str | None:
+        if config_file is None:
+            return None
+        model.load(config_file, logger=Logger.get(), fallback_default=False, exit_on_fail=True)
+        return Path(config_file).read_text(encoding="utf-8")
+
+    export_config = read_config(args.export_config, ExportConfig)
+    import_config = read_config(args.import_config, InteractiveImportConfig)
+
+    output = Path(args.output) if args.output is not None else executable
+    if output != executable:
+        shutil.copyfile(executable, output)
+    EmbeddedConfig.embed(output, export_config=export_config, import_config=import_config)
+    Logger.get().info("Embedded configs into %s", output)
+
+
+if __name__ == "__main__":
+    args = arg_parser.parse_args()
+    Logger.init(args.command)
+
+    if args.version:
+        print(f"AD User Sync version: {get_version()}")
+    elif args.command == "import":
+        run_import(args)
+    elif args.command == "export":
+        run_export(args)
+    elif args.command == "serve":
+        run_serve(args)
+    elif args.command == "embed":
+        run_embed(args)
     else:
         arg_parser.print_help()
 
@@ -1,21 +1,78 @@
-from functools import lru_cache
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from itertools import batched
 from logging import Logger
-from typing import List, Dict, Any, Iterable, Set
+from typing import List, Dict, Any, Iterable, Set, Iterator, FrozenSet, Callable, Tuple
+
+try:
+    import pywintypes  # noqa: F401
+    from pyad import ADContainer, ADDomain, ADGroup, ADQuery, ADUser, pyadutils
+except ImportError:
+    # pyad only works on Windows (with pywin32), elsewhere only replayed sessions (see ReplayDirectory) are possible
+    pass
+
+from .CatchableADExceptions import CatchableADExceptions, DirectoryLookupError
+from .DirectoryThrottle import DirectoryThrottle
+from .NameIndex import NameIndex, NameEntry
+from .SessionCache import SessionCache, session_cached, MISSING
+from ..model import DirectoryMetadata, GroupMetadata, DomainMetadata, ThrottleConfig, CacheConfig, NameIndexConfig
+from ..util import escape_ldap_filter_value, split_dn
 
-from pyad import ADContainer, ADGroup, ADQuery, ADUser
+# Matching rule evaluating group membership transitively (through nested groups) on the domain controller.
+LDAP_MATCHING_RULE_IN_CHAIN = "1.2.840.113556.1.4.1941"
+
+# Number of users fetched by a single query when users are looked up by DN.
+DN_BATCH_SIZE = 100
 
 
 class CachedActiveDirectory:
-    def __init__(self, logger: Logger):
+    metadata: DirectoryMetadata
+
+    def __init__(
+        self,
+        logger: Logger,
+        ldap_server: str | None = None,
+        throttle: ThrottleConfig | None = None,
+        cache: CacheConfig | None = None,
+        name_index: NameIndexConfig | None = None,
+    ):
         self.logger = logger
+        # lookups are cached per session, changes made through this session are written through to the cache
+        self.cache = SessionCache(cache or CacheConfig())
+        # all directory operations of this session are rate limited and retried on transient errors by the throttle
+        self.throttle = DirectoryThrottle(throttle or ThrottleConfig(), logger)
+        # pyad options of all objects and queries of this session, empty to connect to the domain of each dn
+        self.options: Dict[str, Any] = {"server": ldap_server} if ldap_server is not None else {}
+        self.metadata = DirectoryMetadata()
+        self._validated_domains: Set[str] = set()
+        self.name_index_config = name_index or NameIndexConfig()
+        self.name_indexes: Dict[str, NameIndex] = {}  # by lower case domain dn
 
-    @lru_cache(maxsize=None)
+    def _query(self) -> ADQuery:
+        query = ADQuery()
+        # ADQuery ignores its constructor options, the server is applied like pyad applies defaults to objects
+        query._set_defaults(self.options)
+        return query
+
+    def _execute(self, query: ADQuery, **kwargs) -> None:
+        self.throttle.call("read", f"Query {kwargs.get('where_clause')}", lambda: query.execute_query(**kwargs))
+
+    def read[T](self, description: str, operation: Callable[[], T]) -> T:
+        return self.throttle.call("read", description, operation)
+
+    def write[T](self, description: str, operation: Callable[[], T]) -> T:
+        return self.throttle.call("write", description, operation)
+
+    @session_cached
     def find_single_user(self, parent: ADContainer | None, where: str) -> ADUser | None:
         self.logger.debug(
             "Finding existing user account for %s in %s...", where, parent.dn if parent else "(entire domain)"
         )
-        query = ADQuery()
-        query.execute_query(
+        query = self._query()
+        self._execute(
+            query,
             attributes=["distinguishedName"],
             where_clause=f"objectClass = 'user' AND {where}",
             base_dn=parent.dn if parent else None,
@@ -27,42 +84,514 @@ class CachedActiveDirectory:
         dn = query.get_single_result()["distinguishedName"]
         self.logger.debug("... Found %s.", dn)
 
-        return ADUser.from_dn(dn)
+        return self.read(f"Reading {dn}", lambda: ADUser.from_dn(dn, options=self.options))
 
-    @lru_cache(maxsize=None)
-    def find_users(self, parent: ADContainer) -> Set[ADUser]:
-        return set(parent.get_children_iter(recursive=True, filter=[ADUser]))
+    @session_cached
+    def find_users(self, parent: ADContainer, recursive: bool = True) -> Set[ADUser]:
+        # users below the container, only the ones directly in it unless `recursive`
+        return self.read(
+            f"Listing users in {parent.dn}",
+            lambda: set(parent.get_children_iter(recursive=recursive, filter=[ADUser])),
+        )
 
-    @lru_cache(maxsize=None)
+    @session_cached
     def find_users_attributes(
         self,
         attributes: Iterable[str],
         base_dn: str,
         groups: Iterable[str] | None,
     ) -> List[Dict[str, Any]]:
-        where = "objectClass = 'user'"
-        if groups is not None:
-            groups = list(groups)
-            if len(groups) > 0:
-                group_dns = map(lambda g: f"memberOf='{g}'", groups)
-                where += f" AND ({' OR '.join(group_dns)})"
-        query = ADQuery()
-        query.execute_query(
-            attributes=list(attributes),
-            where_clause=where,
+        return list(self.iter_users_attributes(attributes, base_dn, groups))
+
+    def iter_users_attributes(
+        self,
+        attributes: Iterable[str],
+        base_dn: str,
+        groups: Iterable[str] | None,
+        nested: bool = False,
+        search_scope: str = "subtree",
+    ) -> Iterator[Dict[str, Any]]:
+        # Yields users while the result is paged in, so callers can process a page while the next one is fetched.
+        # With `nested`, members of the groups through nested groups are included as well.
+        query = self._query()
+        if nested:
+            self._execute(
+                query,
+                attributes=list(attributes),
+                where_clause=self._nested_members_filter(groups),
+                base_dn=base_dn,
+                search_scope=search_scope,
+                ldap_dialect=True,
+            )
+        else:
+            where = "objectClass = 'user'"
+            if groups is not None:
+                groups = list(groups)
+                if len(groups) > 0:
+                    group_dns = map(lambda g: f"memberOf='{g}'", groups)
+                    where += f" AND ({' OR '.join(group_dns)})"
+            self._execute(
+                query,
+                attributes=list(attributes),
+                where_clause=where,
+                base_dn=base_dn,
+                search_scope=search_scope,
+            )
+        if len(query) == 0:
+            return
+        yield from query.get_results()
+
+    def find_child_containers(self, base_dn: str, search_scope: str = "onelevel") -> List[str]:
+        # DNs of the organizational units and containers directly below `base_dn`, or on all levels below it with
+        # search_scope "subtree" (`base_dn` itself is never included)
+        query = self._query()
+        self._execute(
+            query,
+            attributes=["distinguishedName"],
+            where_clause="objectClass = 'organizationalUnit' OR objectClass = 'container'",
             base_dn=base_dn,
+            search_scope=search_scope,
         )
         if len(query) == 0:
             return []
-        return list(query.get_results())
+        return sorted(
+            row["distinguishedName"]
+            for row in query.get_results()
+            if row["distinguishedName"].lower() != base_dn.lower()
+        )
 
-    @lru_cache(maxsize=None)
-    def get_group(self, dn: str) -> ADGroup:
-        return self.get_group_uncached(dn)
+    @session_cached
+    def find_nested_group_members(self, group: str, base_dn: str) -> FrozenSet[str]:
+        # DNs of all users below `base_dn` that are direct or indirect members of the group.
+        # Evaluated by the domain controller, so the nesting is never walked client-side.
+        self.logger.debug("Finding nested members of %s...", group)
+        query = self._query()
+        self._execute(
+            query,
+            attributes=["distinguishedName"],
+            where_clause=self._nested_members_filter([group]),
+            base_dn=base_dn,
+            ldap_dialect=True,
+        )
+        members = frozenset(row["distinguishedName"] for row in query.get_results()) if len(query) > 0 else frozenset()
+        self.logger.debug("... Found %d member(s).", len(members))
+        return members
+
+    @session_cached
+    def get_group_members(self, group: str) -> FrozenSet[str]:
+        # DNs of the direct members of a group
+        members, ranges = self.read_ranged_attribute(group, "member")
+        self.logger.debug("Group %s has %d member(s), read in %d range(s)", group, len(members), ranges)
+        return frozenset(members)
+
+    def read_ranged_attribute(self, dn: str, attribute: str) -> Tuple[List[Any], int]:
+        # All values of a multi valued attribute and the number of requests needed. The domain controller returns at
+        # most MaxValRange values (of its query policy) per request, so the attribute is read range by range: each
+        # request asks for all remaining values and continues after the last one delivered, until the last range.
+        values: List[Any] = []
+        start = 0
+        requests = 0
+        while True:
+            range_values, upper = self._read_range(dn, attribute, start)
+            requests += 1
+            values.extend(range_values)
+            if upper is None:
+                return values, requests
+            start = upper + 1
+
+    def read_ranged_attributes(
+        self, dns: Iterable[str], attribute: str, base_dn: str
+    ) -> Tuple[Dict[str, List[Any]], int]:
+        # Like `read_ranged_attribute` for many objects, DN_BATCH_SIZE objects with the same next range are read per
+        # request. Returns the values by lower case dn and the number of requests needed.
+        values: Dict[str, List[Any]] = {dn.lower(): [] for dn in dns}
+        pending: Dict[str, int] = dict.fromkeys(values, 0)  # lower case dn -> first value of the next range
+        requests = 0
+        while len(pending) > 0:
+            dns_by_start: Dict[int, List[str]] = {}
+            for dn, start in sorted(pending.items()):
+                dns_by_start.setdefault(start, []).append(dn)
+            pending = {}
+            for start, start_dns in dns_by_start.items():
+                for batch in batched(start_dns, DN_BATCH_SIZE):
+                    dn_filters = "".join(map(lambda dn: f"(distinguishedName={escape_ldap_filter_value(dn)})", batch))
+                    query = self._query()
+                    requests += 1
+                    try:
+                        self._execute(
+                            query,
+                            attributes=["distinguishedName", f"{attribute};range={start}-*"],
+                            where_clause=f"(|{dn_filters})",
+                            base_dn=base_dn,
+                            ldap_dialect=True,
+                        )
+                        rows = list(query.get_results()) if len(query) > 0 else []
+                    except CatchableADExceptions:
+                        # the whole request failed, the objects are read one by one
+                        for dn in batch:
+                            values[dn], dn_requests = self.read_ranged_attribute(dn, attribute)
+                            requests += dn_requests
+                        continue
+                    for row in rows:
+                        range_values, upper = get_range_values(row, attribute)
+                        dn = row["distinguishedName"].lower()
+                        values[dn].extend(range_values)
+                        if upper is not None:
+                            pending[dn] = upper + 1
+        return values, requests
+
+    def _read_range(self, dn: str, attribute: str, start: int) -> Tuple[List[Any], int | None]:
+        query = self._query()
+        self._execute(
+            query,
+            attributes=[f"{attribute};range={start}-*"],
+            where_clause="(objectClass=*)",
+            base_dn=dn,
+            search_scope="base",
+            ldap_dialect=True,
+        )
+        if len(query) == 0:
+            return [], None
+        return get_range_values(query.get_single_result(), attribute)
+
+    def iter_users_by_dn(self, attributes: Iterable[str], dns: Iterable[str], base_dn: str) -> Iterator[Dict[str, Any]]:
+        # Fetches the attributes of the given users below `base_dn`, querying DN_BATCH_SIZE users at once.
+        # DNs that are not users (e.g. nested groups or contacts) are skipped.
+        attributes = list(attributes)
+        for batch in batched(sorted(dns), DN_BATCH_SIZE):
+            dn_filters = "".join(map(lambda dn: f"(distinguishedName={escape_ldap_filter_value(dn)})", batch))
+            query = self._query()
+            self._execute(
+                query,
+                attributes=attributes,
+                where_clause=f"(&(objectClass=user)(|{dn_filters}))",
+                base_dn=base_dn,
+                ldap_dialect=True,
+            )
+            if len(query) > 0:
+                yield from query.get_results()
+
+    @staticmethod
+    def _nested_members_filter(groups: Iterable[str] | None) -> str:
+        groups = list(groups) if groups is not None else []
+        if len(groups) == 0:
+            return "(objectClass=user)"
+        group_filters = "".join(
+            map(lambda g: f"(memberOf:{LDAP_MATCHING_RULE_IN_CHAIN}:={escape_ldap_filter_value(g)})", groups)
+        )
+        return f"(&(objectClass=user)(|{group_filters}))"
+
+    def invalidate_users(self) -> None:
+        # Forget cached user lookups, they are outdated after an import. Groups and containers stay cached.
+        # The name indexes are refreshed with the changes since the last import before they are used again.
+        for index in self.name_indexes.values():
+            index.stale = True
+        self.cache.invalidate_namespaces(
+            "find_single_user",
+            "find_users",
+            "find_users_attributes",
+            "find_nested_group_members",
+            "get_group_members",
+            "_get_user_members",
+        )
+
+    def resolve_groups(self, dns: Iterable[str]) -> Dict[str, GroupMetadata]:
+        # Resolve all given groups with a single query per domain. All missing or renamed groups are reported at once.
+        # Each domain is searched explicitly, pyad would search the domain of this computer otherwise.
+        dns = sorted(set(dns))
+        resolved: Dict[str, GroupMetadata] = {}
+        dns_by_domain: Dict[str, List[str]] = {}
+        for dn in dns:
+            dns_by_domain.setdefault(self._domain_dn(dn), []).append(dn)
+        for domain_dn, group_dns in sorted(dns_by_domain.items()):
+            dn_filters = "".join(map(lambda dn: f"(distinguishedName={escape_ldap_filter_value(dn)})", group_dns))
+            query = self._query()
+            self._execute(
+                query,
+                attributes=["distinguishedName", "cn", "objectGUID", "objectSid", "uSNChanged"],
+                where_clause=f"(&(objectClass=group)(|{dn_filters}))",
+                base_dn=domain_dn,
+                ldap_dialect=True,
+            )
+            # without any match (e.g. a single misspelled group) there are no rows to read
+            rows = query.get_results() if len(query) > 0 else []
+            for row in rows:
+                group = GroupMetadata(
+                    dn=row["distinguishedName"],
+                    cn=row["cn"],
+                    guid=str(pyadutils.convert_guid(row["objectGUID"])),
+                    sid=str(pyadutils.convert_sid(row["objectSid"])).removeprefix("PySID:"),
+                    usn_changed=pyadutils.convert_bigint(row["uSNChanged"]),
+                )
+                resolved[group.dn.lower()] = group
+
+        problems = []
+        for dn in dns:
+            group = resolved.get(dn.lower())
+            cached = self.metadata.groups.get(dn.lower())
+            if group is not None:
+                if cached is not None and cached.guid != group.guid:
+                    self.logger.warning(f"Group {dn} was deleted and recreated since the last run.")
+                elif cached is not None and cached.usn_changed != group.usn_changed:
+                    self.logger.debug("Group %s was changed since the last run.", dn)
+                self.metadata.groups[dn.lower()] = group
+            elif cached is not None and (renamed := self._find_group_by_guid(cached.guid)) is not None:
+                problems.append(f"Group {dn} was renamed or moved to {renamed.dn}.")
+            else:
+                problems.append(f"Group {dn} does not exist.")
+
+        if len(problems) > 0:
+            for problem in problems:
+                self.logger.error(problem)
+            raise DirectoryLookupError(" ".join(problems))
+
+        return {dn: self.metadata.groups[dn.lower()] for dn in dns}
+
+    def _find_group_by_guid(self, guid: str) -> ADGroup | None:
+        try:
+            return self.read(f"Reading group {guid}", lambda: ADGroup.from_guid(guid, options=self.options))
+        except CatchableADExceptions:
+            return None
 
-    def get_group_uncached(self, dn: str) -> ADGroup:
-        return ADGroup.from_dn(dn)
+    def get_default_upn(self, container: ADContainer) -> str:
+        # The UPN suffix of the domain is cached and only re-read if the domain object changed.
+        # It is revalidated once per session.
+        domain_dn = self._domain_dn(container.dn)
+        cached = self.metadata.domains.get(domain_dn.lower())
+        if cached is not None and domain_dn.lower() in self._validated_domains:
+            return cached.default_upn
 
-    @lru_cache(maxsize=None)
+        query = self._query()
+        self._execute(
+            query,
+            attributes=["distinguishedName", "uSNChanged"],
+            where_clause="objectClass = 'domainDNS'",
+            base_dn=domain_dn,
+        )
+        usn_changed = pyadutils.convert_bigint(query.get_single_result()["uSNChanged"])
+
+        if cached is None or cached.usn_changed != usn_changed:
+            self.logger.debug("Reading default UPN suffix of %s...", domain_dn)
+            cached = DomainMetadata(
+                dn=domain_dn,
+                default_upn=self.read(
+                    f"Reading default UPN suffix of {domain_dn}", lambda: container.get_domain().get_default_upn()
+                ),
+                usn_changed=usn_changed,
+            )
+            self.metadata.domains[domain_dn.lower()] = cached
+        self._validated_domains.add(domain_dn.lower())
+        return cached.default_upn
+
+    @staticmethod
+    def _domain_dn(dn: str) -> str:
+        return ",".join(filter(lambda rdn: rdn.strip().upper().startswith("DC="), dn.split(",")))
+
+    def get_name_index(self, container: ADContainer) -> NameIndex | None:
+        # Index of all names in the domain of the container, None if disabled. Built with a single query on first use,
+        # refreshed with the objects changed since (by uSNChanged) if it is stale and rebuilt once it is too old.
+        if not self.name_index_config.enabled:
+            return None
+        domain_dn = self._domain_dn(container.dn)
+        index = self.name_indexes.get(domain_dn.lower())
+        if index is None or index.age() > self.name_index_config.max_age:
+            start = time.perf_counter()
+            index = NameIndex(domain_dn)
+            self._read_names(index, "(sAMAccountName=*)")
+            self.name_indexes[domain_dn.lower()] = index
+            self.logger.info(
+                "Name index of %s built: %d name(s) in %.1fs", domain_dn, len(index), time.perf_counter() - start
+            )
+        elif index.stale:
+            changed = self._read_names(index, f"(&(sAMAccountName=*)(uSNChanged>={index.highest_usn + 1}))")
+            self.logger.debug("Name index of %s refreshed: %d changed name(s)", domain_dn, changed)
+        index.stale = False
+        return index
+
+    def _read_names(self, index: NameIndex, where: str) -> int:
+        # every object with an account name (users, computers, groups) shares the namespace of new users
+        query = self._query()
+        self._execute(
+            query,
+            attributes=["distinguishedName", "cn", "sAMAccountName", "userPrincipalName", "uSNChanged"],
+            where_clause=where,
+            base_dn=index.domain_dn,
+            type="GC" if self.name_index_config.global_catalog else "LDAP",
+            ldap_dialect=True,
+        )
+        if len(query) == 0:
+            return 0
+        count = 0
+        for row in query.get_results():
+            entry = NameEntry(
+                dn=row["distinguishedName"],
+                cn=row["cn"],
+                account_name=row.get("sAMAccountName"),
+                upn=row.get("userPrincipalName"),
+            )
+            index.add(entry, pyadutils.convert_bigint(row["uSNChanged"]))
+            count += 1
+        return count
+
+    @session_cached
+    def get_group(self, dn: str) -> ADGroup:
+        return self.read(f"Reading {dn}", lambda: ADGroup.from_dn(dn, options=self.options))
+
+    @session_cached
     def get_container(self, dn: str) -> ADContainer:
-        return ADContainer.from_dn(dn)
+        return self.read(f"Reading {dn}", lambda: ADContainer.from_dn(dn, options=self.options))
+
+    def bind_container(self, dn: str) -> ADContainer:
+        # Not cached: COM objects can only be used on the thread that bound them, e.g. by a partition of an import
+        # running on a worker thread.
+        return self.read(f"Reading {dn}", lambda: ADContainer.from_dn(dn, options=self.options))
+
+    @session_cached
+    def get_domain(self, container: ADContainer) -> ADDomain:
+        return self.read(f"Reading domain of {container.dn}", lambda: container.get_domain())
+
+    # Operations on users, groups and containers. Like all other operations they are rate limited and retried by the
+    # throttle.
+    # Their effect is written through to the cached lookups, so nothing needs to be re-read after a change.
+
+    def create_container(self, parent: ADContainer, name: str) -> ADContainer:
+        # creates an organizational unit, `name` is the (escaped) value of its relative name
+        dn = f"OU={name},{parent.dn}"
+
+        def create() -> ADContainer:
+            parent.create_container(name)
+            return ADContainer.from_dn(dn, options=self.options)
+
+        container = self.write(f"Creating organizational unit {dn}", create)
+        self.cache.put(("get_container", dn), container)
+        return container
+
+    def create_user(self, container: ADContainer, cn: str, attributes: Dict[str, Any]) -> ADUser:
+        user = self.write(
+            f"Creating user {cn}",
+            lambda: container.create_user(name=cn, enable=False, optional_attributes=attributes),
+        )
+        self._update_user_lookups(user, cn, attributes.get("sAMAccountName"))
+        if (index := self.name_indexes.get(self._domain_dn(user.dn).lower())) is not None:
+            index.add(NameEntry(user.dn, cn, attributes.get("sAMAccountName"), attributes.get("userPrincipalName")))
+        return user
+
+    def move_user(self, user: ADUser, container: ADContainer) -> None:
+        old_dn = user.dn
+        self.write(f"Moving {user.cn} to {container.dn}", lambda: user.move(container))
+        self._update_user_lookups(user, user.cn)
+        self._update_name_index(old_dn, user.dn, user.cn)
+
+    def rename_user(self, user: ADUser, cn: str, container: ADContainer) -> ADUser:
+        # `ADObject.rename()` keeps the old dn and fails reading it again, so the rename is done directly on the
+        # container and a new object is bound by the new dn.
+        def rename() -> ADUser:
+            container._ldap_adsi_obj.MoveHere(
+                pyadutils.generate_ads_path(user.dn, "LDAP", self.options.get("server"), None), f"CN={cn}"
+            )
+            return ADUser.from_dn(f"CN={cn},{container.dn}", options=self.options)
+
+        renamed = self.write(f"Renaming {user.cn} to {cn}", rename)
+        self._update_user_lookups(renamed, cn)
+        self._update_name_index(user.dn, renamed.dn, cn)
+        return renamed
+
+    def get_user_attributes(self, user: ADUser, keys: Iterable[str]) -> Dict[str, Any]:
+        return self.read(f"Reading attributes of {user.cn}", lambda: {k: user.get_attribute(k, False) for k in keys})
+
+    def update_user_attributes(self, user: ADUser, attributes: Dict[str, Any]) -> None:
+        self.write(f"Updating attributes of {user.cn}", lambda: user.update_attributes(attributes))
+
+    def set_expiration(self, user: ADUser, expiration_date: datetime) -> None:
+        self.write(f"Setting expiration date of {user.cn}", lambda: user.set_expiration(expiration_date))
+
+    def set_password(self, user: ADUser, password: str) -> None:
+        self.write(f"Setting password of {user.cn}", lambda: user.set_password(password))
+
+    def enable_user(self, user: ADUser) -> None:
+        self.write(f"Enabling {user.cn}", lambda: user.enable())
+
+    def disable_user(self, user: ADUser) -> None:
+        self.write(f"Disabling {user.cn}", lambda: user.disable())
+
+    def is_disabled(self, user: ADUser) -> bool:
+        return self.read(f"Reading account state of {user.cn}", lambda: user._ldap_adsi_obj.AccountDisabled)
+
+    def get_user_members(self, group: ADGroup) -> Set[str]:
+        # lower case dns of the user members, returns a copy, the cached set is kept up to date by add_members() and
+        # remove_members()
+        return set(self._get_user_members(group.dn))
+
+    @session_cached
+    def _get_user_members(self, group_dn: str) -> Set[str]:
+        group = self.get_group(group_dn)
+
+        def read_members() -> Set[str]:
+            # The property cache of a bound group is outdated after its members changed, reload it before reading.
+            group._ldap_adsi_obj.GetInfo()
+            return {user.dn.lower() for user in group.get_members(ignore_groups=True)}
+
+        return self.read(f"Reading members of {group.cn}", read_members)
+
+    # Members are added and removed by dn, so users do not have to be bound (possibly on another thread) for it.
+
+    def add_members(self, group: ADGroup, user_dns: Iterable[str]) -> None:
+        user_dns = list(user_dns)
+        self.write(
+            f"Adding {len(user_dns)} member(s) to {group.cn}", lambda: group.append_to_attribute("member", user_dns)
+        )
+        if (members := self.cache.peek(("_get_user_members", group.dn))) is not MISSING:
+            members.update(map(str.lower, user_dns))
+
+    def remove_members(self, group: ADGroup, user_dns: Iterable[str]) -> None:
+        user_dns = list(user_dns)
+        self.write(
+            f"Removing {len(user_dns)} member(s) from {group.cn}",
+            lambda: group.remove_from_attribute("member", user_dns),
+        )
+        if (members := self.cache.peek(("_get_user_members", group.dn))) is not MISSING:
+            members.difference_update(map(str.lower, user_dns))
+
+    def _update_user_lookups(self, user: ADUser, cn: str, account_name: str | None = None) -> None:
+        # Applies a created, moved or renamed user to the cached user lookups.
+        def contains(parent: ADContainer | None, recursive: bool = True) -> bool:
+            if parent is None:
+                return True
+            if not recursive:
+                return split_dn(user.dn)[1].lower() == parent.dn.lower()
+            return user.dn.lower().endswith("," + parent.dn.lower())
+
+        lookups = {f"cn = '{cn}'"} | ({f"sAMAccountName = '{account_name}'"} if account_name is not None else set())
+        for key in self.cache.keys("find_single_user"):
+            _, parent, where = key
+            if contains(parent) and where in lookups:
+                self.cache.put(key, user)
+            elif self.cache.peek(key) == user:
+                # found the user before, still does if the user stays within the parent and the lookup is not by cn
+                if contains(parent) and not where.startswith("cn = "):
+                    self.cache.put(key, user)
+                else:
+                    self.cache.invalidate(key)
+
+        for key in self.cache.keys("find_users"):
+            _, parent, recursive = key
+            if (users := self.cache.peek(key)) is not MISSING:
+                users.discard(user)
+                if contains(parent, recursive):
+                    users.add(user)
+
+    def _update_name_index(self, old_dn: str, new_dn: str, cn: str) -> None:
+        if (index := self.name_indexes.get(self._domain_dn(old_dn).lower())) is not None:
+            index.move(old_dn, new_dn, cn)
+
+
+def get_range_values(row: Dict[str, Any], attribute: str) -> Tuple[List[Any], int | None]:
+    # Values of a ranged attribute and the last value delivered, None if the range was the last one. The returned
+    # column is named after the range actually delivered (e.g. "member;range=0-999" or "member;range=1000-*"), which
+    # may be shorter than the requested one. An object without values in the requested range has no such column.
+    prefix = f"{attribute};range=".lower()
+    for key, values in row.items():
+        if key.lower().startswith(prefix):
+            upper = key[len(prefix) :].partition("-")[2]
+            return list(values) if values is not None else [], None if upper == "*" else int(upper)
+    return [], None
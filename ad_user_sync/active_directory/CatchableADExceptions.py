@@ -1,13 +1,31 @@
 from typing import Type, Tuple
 
-from pyad import win32Exception
+
+class DirectoryLookupError(LookupError):
+    # Objects referenced by the config are missing or were renamed in the directory.
+    pass
+
+
+class ReplayedDirectoryError(Exception):
+    # A failed directory operation served from a recorded trace (see `ReplayDirectory`) or injected by the replay.
+    # Like pyad's win32Exception it carries the error code (e.g. "0x8007200e") and message in `error_info`.
+    def __init__(self, message: str, error_code: str | None = None):
+        super().__init__(message)
+        self.error_info = dict(error_code=error_code, message=message)
+
 
 CatchableADExceptions: Tuple[Type[BaseException], ...]
 
+# Errors of failed operations like creating a user or setting a password, carrying an `error_info`
+OperationExceptions: Tuple[Type[BaseException], ...]
+
 try:
     from pywintypes import com_error
+    from pyad import win32Exception
 
-    CatchableADExceptions = (com_error, win32Exception)
+    CatchableADExceptions = (com_error, win32Exception, DirectoryLookupError, ReplayedDirectoryError)
+    OperationExceptions = (win32Exception, ReplayedDirectoryError)
 except ImportError:
-    # excepting this error makes development on linux possible
-    CatchableADExceptions = ()
+    # excepting this error makes development on linux possible (pyad is only imported on Windows)
+    CatchableADExceptions = (DirectoryLookupError, ReplayedDirectoryError)
+    OperationExceptions = (ReplayedDirectoryError,)
@@ -0,0 +1,180 @@
+import random
+import threading
+import time
+from logging import Logger
+from typing import Callable, Literal
+
+from .CatchableADExceptions import CatchableADExceptions
+from ..model import ThrottleConfig, ThrottleStats
+
+# HRESULTs of errors after which the domain controller did not apply a write, so it is safe to retry any operation
+WRITE_RETRY_ERROR_CODES = {
+    0x8007200E,  # ERROR_DS_BUSY
+    0x8007200F,  # ERROR_DS_UNAVAILABLE
+    0x8007203A,  # ERROR_DS_SERVER_DOWN
+}
+
+# HRESULTs of errors caused by an overloaded or briefly unreachable domain controller, retrying may succeed.
+# A write that timed out may still have been applied (retrying e.g. adding a member would fail), so only reads are
+# retried on all of these.
+TRANSIENT_ERROR_CODES = WRITE_RETRY_ERROR_CODES | {
+    0x80072022,  # ERROR_DS_TIMELIMIT_EXCEEDED
+    0x80072024,  # ERROR_DS_ADMIN_LIMIT_EXCEEDED
+    0x800705B4,  # ERROR_TIMEOUT
+    0x800706BA,  # RPC_S_SERVER_UNAVAILABLE
+}
+
+
+def get_error_code(e: BaseException) -> int | None:
+    # pyad reports errors as win32Exception with a hex string, pywin32 as com_error with the HRESULT in excepinfo
+    error_info = getattr(e, "error_info", None)
+    if isinstance(error_info, dict) and error_info.get("error_code") is not None:
+        try:
+            return int(error_info["error_code"], 16) & 0xFFFFFFFF
+        except (TypeError, ValueError):
+            return None
+    excepinfo = getattr(e, "excepinfo", None)
+    if excepinfo is not None and len(excepinfo) > 5 and excepinfo[5] is not None:
+        return excepinfo[5] & 0xFFFFFFFF
+    hresult = getattr(e, "hresult", None)
+    return hresult & 0xFFFFFFFF if isinstance(hresult, int) else None
+
+
+def is_transient_error(e: BaseException) -> bool:
+    return isinstance(e, CatchableADExceptions) and get_error_code(e) in TRANSIENT_ERROR_CODES
+
+
+def is_retryable_error(e: BaseException, kind: Literal["read", "write"]) -> bool:
+    if kind == "write":
+        return isinstance(e, CatchableADExceptions) and get_error_code(e) in WRITE_RETRY_ERROR_CODES
+    return is_transient_error(e)
+
+
+class TokenBucket:
+    # Allows `rate` operations per second on average and bursts of up to `rate` operations (at least one).
+    def __init__(self, rate: float | None):
+        self.rate = rate
+        self.capacity = max(1.0, rate) if rate is not None else 0.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        # blocks until a token is available, returns the time waited
+        if self.rate is None:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # take the token right away (possibly going negative), so concurrent callers queue up behind each other
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class ConcurrencyLimiter:
+    # AIMD (additive increase, multiplicative decrease) limit of concurrently running operations.
+    def __init__(self, max_concurrency: int, target_latency: float):
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.limit = float(max_concurrency)
+        self.decreases = 0
+        self.running = 0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> float:
+        # blocks until a slot is free, returns the time waited
+        start = time.monotonic()
+        with self.condition:
+            while self.running >= int(self.limit):
+                self.condition.wait()
+            self.running += 1
+        return time.monotonic() - start
+
+    def release(self, latency: float, overloaded: bool) -> None:
+        with self.condition:
+            self.running -= 1
+            if overloaded or latency > self.target_latency:
+                self.limit = max(1.0, self.limit / 2)
+                self.decreases += 1
+            else:
+                # grows by about one per `limit` fast operations
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class DirectoryThrottle:
+    # Rate limits, retries and limits the concurrency of all operations of a directory session.
+    def __init__(self, config: ThrottleConfig, logger: Logger):
+        self.config = config
+        self.logger = logger
+        self.buckets = {
+            "read": TokenBucket(config.reads_per_second),
+            "write": TokenBucket(config.writes_per_second),
+        }
+        self.limiter = ConcurrencyLimiter(config.max_concurrency, config.target_latency)
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        with self.stats_lock:
+            self.stats = ThrottleStats()
+            self.decreases_at_reset = self.limiter.decreases
+
+    def get_stats(self) -> ThrottleStats:
+        with self.stats_lock:
+            return self.stats.model_copy(
+                update=dict(
+                    concurrency_limit=self.limiter.limit,
+                    concurrency_decreases=self.limiter.decreases - self.decreases_at_reset,
+                )
+            )
+
+    def call[T](self, kind: Literal["read", "write"], description: str, operation: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            waited = self.buckets[kind].acquire() + self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                result = operation()
+            except Exception as e:
+                transient = is_transient_error(e)
+                self.limiter.release(time.monotonic() - start, overloaded=transient)
+                self._count(kind, waited)
+                if not is_retryable_error(e, kind) or attempt >= self.config.max_retries:
+                    with self.stats_lock:
+                        self.stats.failures += 1
+                    raise
+                attempt += 1
+                # exponential backoff with full jitter
+                backoff = min(self.config.retry_max_delay, self.config.retry_base_delay * 2 ** (attempt - 1))
+                delay = random.uniform(0, backoff)
+                self.logger.warning(
+                    "%s failed with transient error 0x%08X, retry %d/%d in %.1fs",
+                    description,
+                    get_error_code(e),
+                    attempt,
+                    self.config.max_retries,
+                    delay,
+                    extra=dict(operation=kind),
+                )
+                with self.stats_lock:
+                    self.stats.retries += 1
+                time.sleep(delay)
+                continue
+            duration = time.monotonic() - start
+            self.limiter.release(duration, overloaded=False)
+            self._count(kind, waited)
+            self.logger.debug("%s took %.3fs", description, duration, extra=dict(operation=kind, duration=duration))
+            return result
+
+    def _count(self, kind: str, waited: float) -> None:
+        with self.stats_lock:
+            if kind == "read":
+                self.stats.reads += 1
+            else:
+                self.stats.writes += 1
+            self.stats.throttled_seconds += waited
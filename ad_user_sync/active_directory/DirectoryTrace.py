@@ -0,0 +1,363 @@
+import base64
+import json
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator as IteratorABC, KeysView, ValuesView
+from datetime import datetime
+from functools import partial
+from logging import Logger
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Literal, NamedTuple, Tuple
+
+from pydantic import BaseModel
+
+from .CatchableADExceptions import DirectoryLookupError, ReplayedDirectoryError
+from .DirectoryThrottle import DirectoryThrottle, get_error_code
+from .NameIndex import NameIndex, NameEntry
+from .SessionCache import SessionCache
+from .. import model
+from ..model import CacheConfig, DirectoryMetadata, ThrottleConfig
+from ..util import JsonLinesWriter, split_dn
+
+# Operations of a directory session (see CachedActiveDirectory) that are recorded and replayed, by kind.
+OPERATIONS: Dict[str, Literal["read", "write"]] = {
+    "find_single_user": "read",
+    "find_users": "read",
+    "find_users_attributes": "read",
+    "iter_users_attributes": "read",
+    "find_child_containers": "read",
+    "find_nested_group_members": "read",
+    "get_group_members": "read",
+    "read_ranged_attribute": "read",
+    "read_ranged_attributes": "read",
+    "iter_users_by_dn": "read",
+    "resolve_groups": "read",
+    "get_default_upn": "read",
+    "get_name_index": "read",
+    "get_group": "read",
+    "get_container": "read",
+    "bind_container": "read",
+    "get_domain": "read",
+    "get_user_attributes": "read",
+    "is_disabled": "read",
+    "get_user_members": "read",
+    "read": "read",
+    "create_container": "write",
+    "create_user": "write",
+    "move_user": "write",
+    "rename_user": "write",
+    "update_user_attributes": "write",
+    "set_expiration": "write",
+    "set_password": "write",
+    "enable_user": "write",
+    "disable_user": "write",
+    "add_members": "write",
+    "remove_members": "write",
+    "write": "write",
+}
+
+# Values of these arguments (by operation and position) and attributes are never written to a trace.
+SECRET_ARGUMENTS: Dict[str, Tuple[int, ...]] = {"set_password": (1,)}
+SECRET_ATTRIBUTES = {"unicodepwd", "userpassword", "password"}
+REDACTED = "<redacted>"
+
+# Errors injected by the replay, both are retried by the throttle (timeouts only for reads, where they are injected)
+ERROR_DS_BUSY = "0x8007200e"
+ERROR_TIMEOUT = "0x800705b4"
+
+
+class TraceMismatchError(LookupError):
+    # A replayed session made an operation that was not recorded (e.g. after changing the calls an import makes).
+    pass
+
+
+class LargeInteger(NamedTuple):
+    # Replayed COM large integer (e.g. accountExpires), read like the COM object by split_ad_bigint().
+    HighPart: int
+    LowPart: int
+
+
+class ReplayObject:
+    # Stand-in for a pyad object (user, group, container, domain) of a replayed session. Only its names are known.
+    def __init__(self, type_name: str, dn: str, cn: str):
+        self.type_name = type_name
+        self.dn = dn
+        self.cn = cn
+
+    @property
+    def parent_container(self) -> "ReplayObject":
+        parent_dn = split_dn(self.dn)[1]
+        return ReplayObject("ADContainer", parent_dn, split_dn(parent_dn)[0].partition("=")[2])
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ReplayObject) and self.dn.lower() == other.dn.lower()
+
+    def __hash__(self) -> int:
+        return hash(self.dn.lower())
+
+    def __repr__(self) -> str:
+        return f"<{self.type_name} {self.dn}>"
+
+
+def encode(value: Any) -> Any:
+    # Converts arguments and results of operations to JSON. pyad objects are reduced to their names.
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"$bytes": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, BaseModel):
+        return {"$model": type(value).__name__, "data": value.model_dump(mode="json")}
+    if isinstance(value, NameIndex):
+        entries = [list(entry) for entry in value.entries.values()]
+        return {"$name_index": dict(domain_dn=value.domain_dn, highest_usn=value.highest_usn, entries=entries)}
+    if isinstance(value, dict):
+        return {str(k): encode(v) for k, v in value.items()}
+    if isinstance(value, (set, frozenset)):
+        items = sorted(map(encode, value), key=lambda v: json.dumps(v, sort_keys=True))
+        return {"$frozenset" if isinstance(value, frozenset) else "$set": items}
+    if isinstance(value, (list, KeysView, ValuesView)):
+        return [encode(v) for v in value]
+    if isinstance(value, LargeInteger):
+        return {"$bigint": list(value)}
+    if isinstance(value, tuple):
+        return {"$tuple": [encode(v) for v in value]}
+    if getattr(value, "dn", None) is not None:
+        return {"$object": getattr(value, "type_name", type(value).__name__), "dn": value.dn, "cn": value.cn}
+    if callable(value):
+        # e.g. the operation passed to `write()`, only its name is recorded
+        return {"$callable": getattr(getattr(value, "func", value), "__qualname__", type(value).__name__)}
+    if getattr(value, "HighPart", None) is not None:
+        return {"$bigint": [int(value.HighPart), int(value.LowPart)]}
+    return {"$repr": repr(value)}
+
+
+def decode(value: Any) -> Any:
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if "$object" in value:
+        return ReplayObject(value["$object"], value["dn"], value["cn"])
+    if "$model" in value:
+        return getattr(model, value["$model"]).model_validate(value["data"])
+    if "$name_index" in value:
+        data = value["$name_index"]
+        index = NameIndex(data["domain_dn"])
+        for entry in data["entries"]:
+            index.add(NameEntry(*entry))
+        index.highest_usn = data["highest_usn"]
+        return index
+    if "$set" in value:
+        return set(map(decode, value["$set"]))
+    if "$frozenset" in value:
+        return frozenset(map(decode, value["$frozenset"]))
+    if "$tuple" in value:
+        return tuple(map(decode, value["$tuple"]))
+    if "$datetime" in value:
+        return datetime.fromisoformat(value["$datetime"])
+    if "$bytes" in value:
+        return base64.b64decode(value["$bytes"])
+    if "$bigint" in value:
+        return LargeInteger(*value["$bigint"])
+    if "$callable" in value:
+        return value["$callable"]
+    if "$repr" in value:
+        return value["$repr"]
+    return {k: decode(v) for k, v in value.items()}
+
+
+def encode_arguments(operation: str, args: List[Any], kwargs: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+    arguments = [REDACTED if i in SECRET_ARGUMENTS.get(operation, ()) else encode(a) for i, a in enumerate(args)]
+    keywords = {k: encode(v) for k, v in sorted(kwargs.items())}
+    for value in (*arguments, *keywords.values()):
+        if isinstance(value, dict):
+            for key in value:
+                if key.lower() in SECRET_ATTRIBUTES:
+                    value[key] = REDACTED
+    return arguments, keywords
+
+
+def encode_error(e: Exception) -> Dict[str, Any]:
+    code = get_error_code(e)
+    return dict(type=type(e).__name__, code=f"0x{code:08x}" if code is not None else None, message=str(e).strip())
+
+
+def decode_error(error: Dict[str, Any]) -> Exception:
+    if error["type"] == "DirectoryLookupError":
+        return DirectoryLookupError(error["message"])
+    if error["type"] in ("win32Exception", "com_error", "ReplayedDirectoryError"):
+        return ReplayedDirectoryError(error["message"], error["code"])
+    return RuntimeError(f"{error['type']}: {error['message']}")
+
+
+def get_key(operation: str, arguments: List[Any], keywords: Dict[str, Any]) -> str:
+    # Operations are matched by their arguments, except for points in time (e.g. the expiration date set on users),
+    # which depend on when the import ran.
+    def ignore_time(value: Any) -> Any:
+        if isinstance(value, list):
+            return [ignore_time(v) for v in value]
+        if isinstance(value, dict):
+            return "$datetime" if "$datetime" in value else {k: ignore_time(v) for k, v in value.items()}
+        return value
+
+    return json.dumps([operation, ignore_time(arguments), ignore_time(keywords)], sort_keys=True)
+
+
+def materialize(args: Tuple[Any, ...]) -> List[Any]:
+    # iterators passed as arguments (e.g. `map` objects) can only be consumed once, but are needed for the key too
+    return [list(a) if isinstance(a, IteratorABC) else a for a in args]
+
+
+# Passes all operations through to a directory session and writes each one with its arguments, result (or error) and
+# latency as a line of JSON to a trace file, which ReplayDirectory serves without a directory. Passwords are redacted.
+# The latency is the time the session took, including the throttle's waits and retries.
+class RecordingDirectory:
+    def __init__(self, directory: Any, file: Path):
+        # set directly, other attributes are set on the session
+        object.__setattr__(self, "directory", directory)
+        object.__setattr__(self, "file", open(file, "w", encoding="utf-8"))
+        object.__setattr__(self, "writer", JsonLinesWriter(self.file))
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self.directory, name)
+        return partial(self._record, name, attribute) if name in OPERATIONS else attribute
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # e.g. `metadata`, which belongs to the session
+        setattr(self.directory, name, value)
+
+    def _record(self, name: str, operation: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        args = materialize(args)
+        arguments, keywords = encode_arguments(name, args, kwargs)
+        entry = dict(operation=name, arguments=arguments, keywords=keywords)
+        start = time.perf_counter()
+        try:
+            result = operation(*args, **kwargs)
+        except Exception as e:
+            self._write(entry, time.perf_counter() - start, error=encode_error(e))
+            raise
+        if isinstance(result, IteratorABC):
+            return self._record_rows(entry, result)
+        self._write(entry, time.perf_counter() - start, result=encode(result))
+        return result
+
+    def _record_rows(self, entry: Dict[str, Any], rows: Iterator[Any]) -> Iterator[Any]:
+        # results paged in while they are consumed, the latency is the time spent fetching them
+        latency = 0.0
+        recorded = []
+        error = None
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    error = encode_error(e)
+                    raise
+                finally:
+                    latency += time.perf_counter() - start
+                recorded.append(encode(row))
+                yield row
+        finally:
+            # also written if the consumer stops early, a replay serves what was consumed
+            if error is not None:
+                self._write(entry, latency, error=error)
+            else:
+                self._write(entry, latency, result=recorded, rows=True)
+
+    def _write(self, entry: Dict[str, Any], latency: float, **outcome: Any) -> None:
+        self.writer(dict(entry, latency=round(latency, 6), **outcome))
+
+    def close(self) -> None:
+        self.file.close()
+
+
+# Serves the operations of a trace written by RecordingDirectory, without a directory (and on any platform).
+# Every operation goes through a throttle like in a live session and takes its recorded latency times
+# `latency_multiplier`. Operations fail with busy or timeout errors at the given rates, so changes to concurrency
+# and retries can be measured reproducibly. Repeated operations get their recorded responses in order.
+class ReplayDirectory:
+    def __init__(
+        self,
+        file: Path,
+        logger: Logger,
+        throttle: ThrottleConfig | None = None,
+        latency_multiplier: float = 1.0,
+        busy_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        seed: int | None = None,
+    ):
+        self.logger = logger
+        self.throttle = DirectoryThrottle(throttle or ThrottleConfig(), logger)
+        self.cache = SessionCache(CacheConfig())  # nothing is cached, it only provides (empty) statistics
+        self.metadata = DirectoryMetadata()
+        self.latency_multiplier = latency_multiplier
+        self.busy_rate = busy_rate
+        self.timeout_rate = timeout_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.replayed = 0
+        self.injected_busy = 0
+        self.injected_timeouts = 0
+
+        self.responses: Dict[str, Deque[Dict[str, Any]]] = {}
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    key = get_key(entry["operation"], entry["arguments"], entry["keywords"])
+                    self.responses.setdefault(key, deque()).append(entry)
+        self.logger.info("Replaying %d recorded operation(s) from %s", sum(map(len, self.responses.values())), file)
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in OPERATIONS:
+            raise AttributeError(f"{type(self).__name__} has no attribute {name}")
+        return partial(self._replay, name)
+
+    def invalidate_users(self) -> None:
+        pass
+
+    def _replay(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        arguments, keywords = encode_arguments(name, materialize(args), kwargs)
+        key = get_key(name, arguments, keywords)
+        with self.lock:
+            responses = self.responses.get(key)
+            if responses is None:
+                raise TraceMismatchError(f"No recorded response for {key[:500]}")
+            # the last response is repeated if the operation is made more often than recorded
+            entry = responses.popleft() if len(responses) > 1 else responses[0]
+            self.replayed += 1
+        kind = OPERATIONS[name]
+        return self.throttle.call(kind, f"Replaying {name}", partial(self._respond, entry, kind))
+
+    def _respond(self, entry: Dict[str, Any], kind: str) -> Any:
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.busy_rate:
+            # an overloaded domain controller refuses right away
+            with self.lock:
+                self.injected_busy += 1
+            raise ReplayedDirectoryError("The server is busy.", ERROR_DS_BUSY)
+        time.sleep(entry["latency"] * self.latency_multiplier)
+        if kind == "read" and roll < self.busy_rate + self.timeout_rate:
+            with self.lock:
+                self.injected_timeouts += 1
+            raise ReplayedDirectoryError("This operation returned because the timeout period expired.", ERROR_TIMEOUT)
+        if "error" in entry:
+            raise decode_error(entry["error"])
+        result = decode(entry["result"])
+        return iter(result) if entry.get("rows") else result
+
+    def close(self) -> None:
+        self.logger.info(
+            "Replayed %d operation(s), injected %d busy and %d timeout error(s)",
+            self.replayed,
+            self.injected_busy,
+            self.injected_timeouts,
+        )
@@ -0,0 +1,65 @@
+import time
+from typing import Dict, NamedTuple
+
+
+class NameEntry(NamedTuple):
+    dn: str
+    cn: str
+    account_name: str | None
+    upn: str | None
+
+
+# All names of a domain that new accounts may conflict with: distinguished names (and with them the cn within a
+# container), account names (sAMAccountName) and user principal names. All lookups are case-insensitive, like AD.
+class NameIndex:
+    def __init__(self, domain_dn: str):
+        self.domain_dn = domain_dn
+        self.entries: Dict[str, NameEntry] = {}  # by lower case dn
+        self.by_account_name: Dict[str, str] = {}  # lower case account name -> lower case dn
+        self.by_upn: Dict[str, str] = {}  # lower case upn -> lower case dn
+        self.highest_usn = 0  # highest uSNChanged read, objects changed later are read by the next refresh
+        self.built = time.monotonic()
+        self.stale = False  # set after an import, the next one refreshes the index before using it
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def age(self) -> float:
+        return time.monotonic() - self.built
+
+    def add(self, entry: NameEntry, usn_changed: int | None = None) -> None:
+        self.remove(entry.dn)
+        key = entry.dn.lower()
+        self.entries[key] = entry
+        if entry.account_name:
+            self.by_account_name[entry.account_name.lower()] = key
+        if entry.upn:
+            self.by_upn[entry.upn.lower()] = key
+        if usn_changed is not None:
+            self.highest_usn = max(self.highest_usn, usn_changed)
+
+    def remove(self, dn: str) -> NameEntry | None:
+        entry = self.entries.pop(dn.lower(), None)
+        if entry is not None:
+            if entry.account_name and self.by_account_name.get(entry.account_name.lower()) == dn.lower():
+                del self.by_account_name[entry.account_name.lower()]
+            if entry.upn and self.by_upn.get(entry.upn.lower()) == dn.lower():
+                del self.by_upn[entry.upn.lower()]
+        return entry
+
+    def move(self, old_dn: str, new_dn: str, cn: str) -> None:
+        # applies a move or rename made by this session, the account names stay the same
+        entry = self.remove(old_dn)
+        if entry is not None:
+            self.add(entry._replace(dn=new_dn, cn=cn))
+
+    def get_by_dn(self, dn: str) -> NameEntry | None:
+        return self.entries.get(dn.lower())
+
+    def get_by_account_name(self, account_name: str) -> NameEntry | None:
+        key = self.by_account_name.get(account_name.lower())
+        return self.entries[key] if key is not None else None
+
+    def get_by_upn(self, upn: str) -> NameEntry | None:
+        key = self.by_upn.get(upn.lower())
+        return self.entries[key] if key is not None else None
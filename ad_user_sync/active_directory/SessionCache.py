@@ -0,0 +1,85 @@
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Hashable, List, Tuple
+
+from ..model import CacheConfig, CacheStats
+
+# returned by `get` and `peek` if there is no (valid) entry, `None` is a valid cached value (negative caching)
+MISSING = object()
+
+
+# Bounded LRU cache with expiring entries, owned by a single directory session.
+# Keys are tuples starting with a namespace (usually the name of the cached method), followed by its arguments.
+class SessionCache:
+    def __init__(self, config: CacheConfig):
+        self.config = config
+        self.entries: OrderedDict[Tuple[Hashable, ...], Tuple[float, Any]] = OrderedDict()  # key -> (expires, value)
+        self.lock = threading.RLock()
+        self.stats = CacheStats()
+
+    def get(self, key: Tuple[Hashable, ...]) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                self.stats.expirations += 1
+                entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[1]
+
+    def peek(self, key: Tuple[Hashable, ...]) -> Any:
+        # like `get`, but does not count or refresh the entry
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry[1] if entry is not None and entry[0] >= time.monotonic() else MISSING
+
+    def put(self, key: Tuple[Hashable, ...], value: Any) -> None:
+        ttl = self.config.negative_ttl if value is None else self.config.ttl
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.config.max_entries:
+                self.entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self, key: Tuple[Hashable, ...]) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_namespaces(self, *namespaces: str) -> None:
+        with self.lock:
+            for key in self.keys(*namespaces):
+                del self.entries[key]
+
+    def keys(self, *namespaces: str) -> List[Tuple[Hashable, ...]]:
+        with self.lock:
+            return [key for key in self.entries if key[0] in namespaces]
+
+    def get_stats(self) -> CacheStats:
+        with self.lock:
+            return self.stats.model_copy(update=dict(size=len(self.entries)))
+
+
+def session_cached(method: Callable) -> Callable:
+    # Caches the results of a method of a class with a `cache: SessionCache` attribute by its arguments.
+    signature = inspect.signature(method)
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        key = (method.__name__, *list(arguments.arguments.values())[1:])
+        value = self.cache.get(key)
+        if value is MISSING:
+            value = method(self, *args, **kwargs)
+            self.cache.put(key, value)
+        return value
+
+    return wrapper
@@ -1,2 +1,6 @@
-from .CatchableADExceptions import CatchableADExceptions
+from .CatchableADExceptions import CatchableADExceptions, DirectoryLookupError, ReplayedDirectoryError
+from .DirectoryThrottle import DirectoryThrottle, is_transient_error, get_error_code
+from .SessionCache import SessionCache
+from .NameIndex import NameIndex, NameEntry
 from .CachedActiveDirectory import CachedActiveDirectory
+from .DirectoryTrace import RecordingDirectory, ReplayDirectory, TraceMismatchError
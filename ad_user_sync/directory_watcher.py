@@ -0,0 +1,139 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+from logging import Logger
+from pathlib import Path
+from typing import Tuple, Dict
+
+
+# Blocks until the content of a directory changes or a timeout expires.
+# Uses the native change notification of the OS (Windows change notifications, Linux inotify) if available
+# and falls back to comparing directory snapshots every `poll_interval` seconds otherwise.
+# Spurious wakeups are possible, callers must check the directory content anyway.
+class DirectoryWatcher:
+    directory: Path
+    logger: Logger
+    poll_interval: float
+
+    def __init__(self, directory: Path, logger: Logger, poll_interval: float = 10):
+        self.directory = directory
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self._native = None
+        self._snapshot = self.snapshot()
+
+        for backend in (_WindowsChangeNotification, _Inotify):
+            try:
+                self._native = backend(directory)
+                self.logger.debug(f"Watching {directory} using {backend.__name__.strip('_')}")
+                break
+            except (ImportError, OSError, AttributeError):
+                continue
+        else:
+            self.logger.debug(f"Watching {directory} by polling every {poll_interval}s")
+
+    def snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout: float) -> bool:
+        # returns True if a change was detected before timeout
+        if self._native is not None:
+            return self._native.wait(timeout)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = self.snapshot()
+            if snapshot != self._snapshot:
+                self._snapshot = snapshot
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+
+    def close(self) -> None:
+        if self._native is not None:
+            self._native.close()
+            self._native = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _WindowsChangeNotification:
+    def __init__(self, directory: Path):
+        import win32con
+        import win32event
+        import win32file
+
+        self._win32event = win32event
+        self._win32file = win32file
+        self._handle = win32file.FindFirstChangeNotification(
+            str(directory),
+            False,
+            win32con.FILE_NOTIFY_CHANGE_FILE_NAME
+            | win32con.FILE_NOTIFY_CHANGE_LAST_WRITE
+            | win32con.FILE_NOTIFY_CHANGE_SIZE,
+        )
+
+    def wait(self, timeout: float) -> bool:
+        # wait in short slices, a single long wait can not be interrupted by ctrl-c
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            result = self._win32event.WaitForSingleObject(self._handle, int(min(remaining, 1.0) * 1000))
+            if result == self._win32event.WAIT_OBJECT_0:
+                self._win32file.FindNextChangeNotification(self._handle)
+                return True
+
+    def close(self) -> None:
+        self._win32file.FindCloseChangeNotification(self._handle)
+
+
+class _Inotify:
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0x00000800
+
+    def __init__(self, directory: Path):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(self.IN_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def wait(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+        # drain all pending events, their details are not needed
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self) -> None:
+        os.close(self._fd)
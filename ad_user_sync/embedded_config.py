@@ -1,4 +1,10 @@
+import mmap
+import os
+import struct
 import sys
+from functools import cached_property
+from pathlib import Path
+from typing import Tuple
 
 from ad_user_sync.logger import Logger
 from ad_user_sync.model.ExportConfig import ExportConfig
@@ -12,42 +18,87 @@ class EmbeddedConfig:
     HEADER_IMPORT_START = b"__EMBEDDED_IMPORT_CONFIG_START__"
     HEADER_IMPORT_END   = b"__EMBEDDED_IMPORT_CONFIG_END__"
 
+    # Fixed size trailer at the very end of the executable:
+    # magic, export config offset, export config length, import config offset, import config length.
+    # A length of 0 means the config is not embedded.
+    TRAILER_MAGIC = b"ADUSCFG1"
+    TRAILER = struct.Struct("<8sQQQQ")
+
 
     def __init__(self, logger : Logger):
-        self.export_config = None
-        self.import_config = None
+        # Nothing is read here. The executable is only opened when a config is actually requested.
+        self.logger = logger
 
-        if not getattr(sys, 'frozen', False):
+
+    @cached_property
+    def export_config(self) -> ExportConfig | None:
+        export_config_buffer, _ = self._sections
+        if export_config_buffer is None:
             return None
 
+        export_config = ExportConfig.deserialize(export_config_buffer)
+        if export_config is not None:
+            self.logger.info("Embedded export config found")
+        else:
+            self.logger.warning("Embedded export config not parsable.")
+        return export_config
 
-        exec_path = sys.executable
-        with open(exec_path, "rb") as f:
-            exec_buffer = f.read()
 
-            export_config_buffer = self.get_section(exec_buffer, self.HEADER_EXPORT_START, self.HEADER_EXPORT_END)
-            import_config_buffer = self.get_section(exec_buffer, self.HEADER_IMPORT_START, self.HEADER_IMPORT_END)
+    @cached_property
+    def import_config(self) -> ImportConfig | None:
+        _, import_config_buffer = self._sections
+        if import_config_buffer is None:
+            return None
+
+        import_config = InteractiveImportConfig.deserialize(import_config_buffer) or ImportConfig.deserialize(import_config_buffer)
+        if import_config is not None:
+            self.logger.info("Embedded import config found")
+        else:
+            self.logger.warning("Embedded import config not parsable.")
+        return import_config
 
 
-            if export_config_buffer is not None:
-                self.export_config = ExportConfig.deserialize(export_config_buffer)
-                if self.export_config is not None:
-                    logger.info("Embedded export config found")
-                else:
-                    logger.warning("Embedded export config not parsable.")
+    @cached_property
+    def _sections(self) -> Tuple[str | None, str | None]:
+        if not getattr(sys, 'frozen', False):
+            return None, None
+
+        sections = self.read_sections(Path(sys.executable))
+        if sections == (None, None):
+            self.logger.info("No Embedded config found")
+        return sections
 
-            if import_config_buffer is not None:
-                self.import_config = InteractiveImportConfig.deserialize(import_config_buffer) or ImportConfig.deserialize(import_config_buffer)
-                if self.import_config is not None:
-                    logger.info("Embedded import config found")
-                else:
-                    logger.warning("Embedded import config not parsable.")
 
-            if export_config_buffer is None and import_config_buffer is None:
-                logger.info("No Embedded config found")
+    @classmethod
+    def read_sections(cls, exec_path : Path) -> Tuple[str | None, str | None]:
+        with open(exec_path, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size < cls.TRAILER.size:
+                return None, None
+
+            # fast path: locate the configs through the trailer
+            f.seek(size - cls.TRAILER.size)
+            magic, export_offset, export_length, import_offset, import_length = cls.TRAILER.unpack(f.read(cls.TRAILER.size))
+            if magic == cls.TRAILER_MAGIC:
+                return cls.read_at(f, export_offset, export_length), cls.read_at(f, import_offset, import_length)
+
+            # fallback for binaries built without trailer: scan for the markers without loading the whole file
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as exec_buffer:
+                export_config_buffer = cls.get_section(exec_buffer, cls.HEADER_EXPORT_START, cls.HEADER_EXPORT_END)
+                import_config_buffer = cls.get_section(exec_buffer, cls.HEADER_IMPORT_START, cls.HEADER_IMPORT_END)
+                return export_config_buffer, import_config_buffer
+
+
+    @staticmethod
+    def read_at(f, offset : int, length : int) -> str | None:
+        if length == 0:
+            return None
+        f.seek(offset)
+        return f.read(length).decode("utf-8")
 
 
-    def get_section(self, buffer : bytes, start_mark : bytes, end_mark : bytes) -> str:
+    @staticmethod
+    def get_section(buffer : bytes | mmap.mmap, start_mark : bytes, end_mark : bytes) -> str | None:
         start_index = buffer.find(start_mark)
         if start_index < 0:
             return None
@@ -62,3 +113,24 @@ class EmbeddedConfig:
             return None
 
         return buffer[start_index : end_index].decode("utf-8")
+
+
+    @classmethod
+    def embed(cls, exec_path : Path, export_config : str | None = None, import_config : str | None = None) -> None:
+        # Appends the configs to an executable. The markers are kept so older versions can still find them.
+        with open(exec_path, "ab") as f:
+            export_offset, export_length = cls.append_section(f, export_config, cls.HEADER_EXPORT_START, cls.HEADER_EXPORT_END)
+            import_offset, import_length = cls.append_section(f, import_config, cls.HEADER_IMPORT_START, cls.HEADER_IMPORT_END)
+            f.write(cls.TRAILER.pack(cls.TRAILER_MAGIC, export_offset, export_length, import_offset, import_length))
+
+
+    @staticmethod
+    def append_section(f, content : str | None, start_mark : bytes, end_mark : bytes) -> Tuple[int, int]:
+        if content is None:
+            return 0, 0
+        data = content.encode("utf-8")
+        f.write(start_mark)
+        offset = f.tell()
+        f.write(data)
+        f.write(end_mark)
+        return offset, len(data)
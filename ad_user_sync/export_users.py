@@ -1,76 +1,333 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
 from functools import partial
-from typing import Any, Dict, Callable
+from itertools import batched
+from typing import Any, Dict, Callable, List, FrozenSet, Tuple, Iterable, Iterator
 
 from logging import Logger
-from . import CachedActiveDirectory
+from .active_directory import CachedActiveDirectory
+from .active_directory.CachedActiveDirectory import get_range_values
 from .model import ExportConfig
-from .util import convert_ad_datetime, full_path, sub_path
+from .profiler import Profiler
+from .util import convert_ad_datetime_column, split_ad_bigint, full_path, sub_path, split_dn, com_initialized
+
+# number of users converted at once, matches the page size of the directory query
+BATCH_SIZE = 1000
 
 
 class AttributeParser:
     target_key: str
     source_key: str
-    parse: Callable[[Any], Any]
+    prepare: Callable[[Any], Any] | None
+    parse_column: Callable[[List[Any]], List[Any]]
 
-    def __init__(self, key: str, source_key: str = None, parse: Callable[[Any], Any] = lambda value: value) -> None:
+    def __init__(
+        self,
+        key: str,
+        source_key: str = None,
+        parse: Callable[[Any], Any] = None,
+        parse_column: Callable[[List[Any]], List[Any]] = None,
+        prepare: Callable[[Any], Any] = None,
+    ) -> None:
         self.target_key = key
         self.source_key = source_key if source_key is not None else key
-        self.parse = parse
+        # `prepare` runs on the querying thread while fetching (e.g. to read COM objects),
+        # `parse_column` converts the prepared values of a whole batch at once on the converter thread.
+        self.prepare = prepare
+        if parse_column is not None:
+            self.parse_column = parse_column
+        elif parse is not None:
+            self.parse_column = lambda column: [parse(v) if v is not None else None for v in column]
+        else:
+            self.parse_column = lambda column: column
+
+    def extract_column(self, batch: List[Dict[str, Any]]) -> List[Any]:
+        return [row.get(self.source_key) for row in batch]
+
+
+# A part of the export queried on its own: the users in a search base, optionally restricted to some search groups.
+class Shard:
+    name: str
+    base_dn: str
+    search_scope: str
+    groups: List[str]
+
+    def __init__(self, name: str, base_dn: str, search_scope: str, groups: List[str]) -> None:
+        self.name = name
+        self.base_dn = base_dn
+        self.search_scope = search_scope
+        self.groups = groups
 
-    def apply(self, source: Dict[str, Any], target: Dict[str, Any]):
-        val = source.get(self.source_key)
-        target[self.target_key] = self.parse(source[self.source_key]) if val is not None else None
+    def contains(self, dn: str) -> bool:
+        if self.search_scope == "onelevel":
+            return split_dn(dn)[1].lower() == self.base_dn.lower()
+        return dn.lower().endswith("," + self.base_dn.lower())
 
 
-def export_users(config: ExportConfig, logger: Logger):
+def export_users(
+    config: ExportConfig,
+    logger: Logger,
+    profiler: Profiler | None = None,
+    active_directory: CachedActiveDirectory | None = None,
+):
+    profiler = profiler or Profiler()
     make_relative_group_path = partial(sub_path, config.group_path)
-    # make_relative_user_path  = partial(sub_path,  config.user_path)
     make_absolute_group_path = partial(full_path, config.group_path)
-    # make_absolute_user_path = partial(full_path, config.user_path)
 
     query_groups = set(map(make_absolute_group_path, config.search_groups))
 
-    # def parse_sub_path(v: str) -> str:
-    #     v = make_relative_user_path(v)  # Remove base path
-    #     pos = v.find(",")
-    #     return v[pos + 1 :] if pos >= 0 else ""  # Remove common name if present
+    # lookup table of the search groups, memberOf values not in here are dropped
+    relative_group_paths = {g: make_relative_group_path(g) for g in query_groups}
 
-    special_attribute_parsers: Dict[str, AttributeParser] = {
-        "disabled": AttributeParser("disabled", "userAccountControl", lambda v: (v & 0x02) != 0),
-        "accountExpires": AttributeParser("accountExpires", "accountExpires", convert_ad_datetime),
+    def parse_sub_path(dn: str) -> str:
+        # the containers between user_path and the user (without its cn), empty for users directly in user_path.
+        # The directory may spell user_path in a different case than the config.
+        parent = split_dn(dn)[1]
+        if parent.lower() == config.user_path.lower():
+            return ""
+        if parent.lower().endswith("," + config.user_path.lower()):
+            return parent[: -len(config.user_path) - 1]
+        return parent
+
+    # create a cached active directory instance for accessing AD, unless one is provided (e.g. a replayed session)
+    if active_directory is None:
+        active_directory = CachedActiveDirectory(logger, throttle=config.throttle)
+
+    # The query phase lasts until all users are converted, the conversion runs alongside it on a worker thread.
+    profiler.phase("query")
+
+    strategy, reason = choose_query_strategy(config, len(query_groups))
+    logger.info(f"Using '{strategy}' query strategy: {reason}")
+
+    # Members of each search group, read once per group. Not needed if the directory filters by memberOf.
+    group_members: Dict[str, FrozenSet[str]] | None = None
+    if config.nested_groups:
+        # Transitive members of each search group, resolved once per group by the domain controller.
+        group_members = {
+            g: active_directory.find_nested_group_members(g, config.user_path) for g in sorted(query_groups)
+        }
+    elif strategy == "members":
+        group_members = {g: active_directory.get_group_members(g) for g in sorted(query_groups)}
+
+    if group_members is not None:
+        member_dns = frozenset().union(*group_members.values())
+        logger.info(f"Read members of {len(group_members)} search group(s): {len(member_dns)} distinct member(s)")
+        # memberOf lists direct memberships only (and all of them), so it is computed from the member sets instead
+        member_of_parser = AttributeParser(
+            "memberOf",
+            "distinguishedName",
+            parse_column=lambda column: [
+                [relative_group_paths[g] for g, members in group_members.items() if dn in members] for dn in column
+            ],
+        )
+    else:
         # Include search groups memberships only, not all groups. Cut off the base path that all search results share.
-        "memberOf": AttributeParser(
+        member_of_parser = AttributeParser(
             "memberOf",
             "memberOf",
-            lambda v: list(map(make_relative_group_path, query_groups.intersection(v))),
+            parse_column=lambda column: [
+                [relative_group_paths[g] for g in v if g in relative_group_paths] if v is not None else None
+                for v in column
+            ],
+        )
+
+    special_attribute_parsers: Dict[str, AttributeParser] = {
+        "disabled": AttributeParser(
+            "disabled",
+            "userAccountControl",
+            parse_column=lambda column: [(v & 0x02) != 0 if v is not None else None for v in column],
+        ),
+        "accountExpires": AttributeParser(
+            "accountExpires",
+            "accountExpires",
+            prepare=split_ad_bigint,
+            parse_column=convert_ad_datetime_column,
         ),
-        # "subPath": AttributeParser("subPath", "distinguishedName", parse_sub_path),
+        "memberOf": member_of_parser,
+        "subPath": AttributeParser("subPath", "distinguishedName", parse_sub_path),
     }
+    exported_attributes = config.attributes | {"sAMAccountName", "cn", "disabled", "accountExpires", "memberOf"}
+    if config.sub_paths:
+        exported_attributes.add("subPath")
 
+    # sorted, so queries (and recorded traces) do not depend on the iteration order of a set
     attribute_parsers = list(
         map(
             lambda key: special_attribute_parsers.get(key, AttributeParser(key)),
-            config.attributes | {"sAMAccountName", "cn", "disabled", "accountExpires", "memberOf"},
+            sorted(exported_attributes),
         )
     )
+    target_keys = list(map(lambda p: p.target_key, attribute_parsers))
 
-    # create a cached active directory instance for accessing AD
-    active_directory = CachedActiveDirectory(logger)
+    def convert_batch(columns: List[List[Any]]) -> List[Dict[str, Any]]:
+        # convert column-wise, then assemble the users of the batch
+        with profiler.measure("convert"):
+            converted = [parser.parse_column(column) for parser, column in zip(attribute_parsers, columns)]
+            return [dict(zip(target_keys, values)) for values in zip(*converted)]
 
-    query_attributes = tuple(map(lambda p: p.source_key, attribute_parsers))
+    shards = build_shards(config, active_directory, query_groups)
 
-    users = []
+    query_attributes = tuple(dict.fromkeys(map(lambda p: p.source_key, attribute_parsers)))
+    if "distinguishedName" not in query_attributes:
+        # needed to merge shards and to read values of ranged attributes again
+        query_attributes += ("distinguishedName",)
 
-    users_attributes = active_directory.find_users_attributes(
-        attributes=query_attributes,
-        groups=tuple(query_groups),
-        base_dn=config.user_path,
-    )
+    # Attributes with more values than the domain controller returns at once come back truncated or empty.
+    # Truncated values are always read again, empty ones only for attributes expected to be ranged.
+    verify_empty = set(config.ranged_attributes) & set(query_attributes)
+    if group_members is None and len(query_groups) > 0:
+        # users found by a memberOf filter are members of a search group, an empty memberOf was not returned in full
+        verify_empty.add("memberOf")
+    ranged_counts: Dict[str, List[int]] = {}  # attribute -> [users, requests]
+    ranged_counts_lock = threading.Lock()
+
+    def is_incomplete(row: Dict[str, Any], attribute: str, has_ranges: bool) -> bool:
+        # the domain controller returns truncated values as a range (e.g. "member;range=0-1499") that is not the last
+        if has_ranges and get_range_values(row, attribute)[1] is not None:
+            return True
+        return attribute in verify_empty and not row.get(attribute)
+
+    def complete_ranged_values(rows: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        # reads incomplete values of a page of users again, range by range and batched over the affected users
+        for page in batched(rows, BATCH_SIZE):
+            # whether a row has range columns at all is checked once, not once per attribute
+            has_ranges = [any(";" in key for key in row) for row in page]
+            for attribute in query_attributes:
+                affected = [row for row, ranges in zip(page, has_ranges) if is_incomplete(row, attribute, ranges)]
+                if len(affected) == 0:
+                    continue
+                values, requests = active_directory.read_ranged_attributes(
+                    map(lambda row: row["distinguishedName"], affected), attribute, config.user_path
+                )
+                for row in affected:
+                    row[attribute] = tuple(values[row["distinguishedName"].lower()]) or row.get(attribute)
+                with ranged_counts_lock:
+                    counts = ranged_counts.setdefault(attribute, [0, 0])
+                    counts[0] += len(affected)
+                    counts[1] += requests
+            yield from page
+
+    scan = False
+    if (
+        strategy == "members"
+        and config.query_strategy == "auto"
+        and (len(member_dns) > config.query_strategy_max_members)
+    ):
+        # Fetching this many users in batches takes more round trips than reading all users and dropping the others.
+        logger.info(
+            f"Reading all users in {config.user_path}: {len(member_dns)} members exceed "
+            f"query_strategy_max_members ({config.query_strategy_max_members})"
+        )
+        scan = True
+
+    def query_shard(shard: Shard) -> Iterator[Dict[str, Any]]:
+        if strategy == "filter":
+            return active_directory.iter_users_attributes(
+                attributes=query_attributes,
+                groups=shard.groups,
+                base_dn=shard.base_dn,
+                nested=config.nested_groups,
+                search_scope=shard.search_scope,
+            )
+        shard_members = frozenset().union(*map(lambda g: group_members[g], shard.groups))
+        if scan:
+            return filter(
+                lambda user: user["distinguishedName"] in shard_members,
+                active_directory.iter_users_attributes(
+                    attributes=query_attributes,
+                    groups=None,
+                    base_dn=shard.base_dn,
+                    search_scope=shard.search_scope,
+                ),
+            )
+        return active_directory.iter_users_by_dn(
+            attributes=query_attributes,
+            dns=filter(shard.contains, shard_members),
+            base_dn=shard.base_dn,
+        )
+
+    prepared_attributes = [(p.source_key, p.prepare) for p in attribute_parsers if p.prepare is not None]
+
+    def prepare_rows(rows: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        # COM values must be read on the thread that queried them, they can not be passed to other threads
+        for row in rows:
+            for key, prepare in prepared_attributes:
+                row[key] = prepare(row.get(key))
+            yield row
 
-    for user_attributes in users_attributes:
-        user = {}
-        for parser in attribute_parsers:
-            parser.apply(user_attributes, user)
-        users.append(user)
+    def fetch_shard(shard: Shard) -> List[Dict[str, Any]]:
+        with com_initialized():
+            start = time.perf_counter()
+            rows = list(prepare_rows(complete_ranged_values(query_shard(shard))))
+            duration = time.perf_counter() - start
+            logger.info(
+                "Shard %s: %d user(s) in %.1fs",
+                shard.name,
+                len(rows),
+                duration,
+                extra=dict(phase="query", duration=duration),
+            )
+            return rows
 
+    if len(shards) == 1:
+        users_attributes = prepare_rows(complete_ranged_values(query_shard(shards[0])))
+    else:
+        logger.info(f"Querying {len(shards)} shard(s), {config.max_parallel_queries} at a time")
+        with ThreadPoolExecutor(max_workers=config.max_parallel_queries, thread_name_prefix="export-shard") as pool:
+            shard_rows = list(pool.map(fetch_shard, shards))
+        # users found by several shards are exported once, the order does not depend on which shard finished first
+        merged: Dict[str, Dict[str, Any]] = {}
+        for rows in shard_rows:
+            for row in rows:
+                merged.setdefault(row["distinguishedName"].lower(), row)
+        users_attributes = [merged[dn] for dn in sorted(merged)]
+        logger.info(f"Merged {sum(map(len, shard_rows))} user(s) of {len(shards)} shard(s) into {len(merged)}")
+
+    # Fetching (and reading COM values) of a single shard happens on this thread, converting on a worker thread.
+    # So a batch is converted while the next one is fetched.
+    batches: List[Future] = []
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="export-convert") as converter:
+        for batch in batched(users_attributes, BATCH_SIZE):
+            columns = [parser.extract_column(batch) for parser in attribute_parsers]
+            batches.append(converter.submit(convert_batch, columns))
+        logger.debug(f"Fetched {len(batches)} batch(es) of users, waiting for conversion...")
+        users = [user for batch in batches for user in batch.result()]
+    profiler.end()
+
+    for attribute, (affected, requests) in sorted(ranged_counts.items()):
+        logger.info("Read %s of %d user(s) again range by range: %d extra request(s)", attribute, affected, requests)
+    logger.info(f"Directory operations: {active_directory.throttle.get_stats().model_dump()}")
     return users
+
+
+def build_shards(
+    config: ExportConfig,
+    active_directory: CachedActiveDirectory,
+    query_groups: Iterable[str],
+) -> List[Shard]:
+    groups = sorted(query_groups)
+    if config.shard_by == "ou":
+        # users directly in user_path and one shard per child container (including all levels below it)
+        return [Shard(config.user_path, config.user_path, "onelevel", groups)] + [
+            Shard(dn, dn, "subtree", groups) for dn in active_directory.find_child_containers(config.user_path)
+        ]
+    if config.shard_by == "group" and len(groups) > 0:
+        return [Shard(g, config.user_path, "subtree", [g]) for g in groups]
+    return [Shard(config.user_path, config.user_path, "subtree", groups)]
+
+
+def choose_query_strategy(config: ExportConfig, group_count: int) -> Tuple[str, str]:
+    # returns the strategy and the reason for choosing it
+    if group_count == 0:
+        return "filter", "no search groups, all users in user_path are exported"
+    if config.query_strategy != "auto":
+        return config.query_strategy, "configured"
+    if group_count > config.query_strategy_group_threshold:
+        return "members", (
+            f"{group_count} search groups exceed query_strategy_group_threshold "
+            f"({config.query_strategy_group_threshold}), a memberOf filter over all of them is slow to evaluate"
+        )
+    return "filter", (
+        f"{group_count} search group(s) within query_strategy_group_threshold ({config.query_strategy_group_threshold})"
+    )
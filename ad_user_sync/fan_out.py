@@ -0,0 +1,72 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple, Annotated
+
+from pydantic import BaseModel, Field
+
+from .import_users import import_users
+from .model import ImportConfig, ImportResult, ResolutionList
+from .user_file import UserFile
+from .util import com_initialized
+
+
+class TargetResult(BaseModel):
+    target: str
+    duration: Annotated[float, Field(default=0)]
+    result: Annotated[ImportResult | None, Field(default=None)]
+    error: Annotated[str | None, Field(default=None)]
+
+
+def fan_out_import(
+    targets: Dict[str, ImportConfig],
+    logger: Logger,
+    on_event: Callable[[Dict[str, Any]], None] | None = None,
+) -> List[TargetResult]:
+    # Imports into several target domains at once, `targets` maps a name (e.g. the config file) to its config.
+    # Events passed to `on_event` are tagged with the name of their target.
+    # Every input file is read and verified once, no matter how many targets import it.
+    inputs: Dict[Tuple[Path, str | None], List[Dict[str, Any]] | Exception] = {}
+    for config in targets.values():
+        key = (config.input_file, config.hmac)
+        if key not in inputs:
+            logger.info(f"Reading users file from {config.input_file}")
+            try:
+                inputs[key] = UserFile(path=config.input_file, hmac=config.hmac).read()
+            except Exception as e:
+                # only the targets importing this file fail
+                logger.error(f"Reading users file {config.input_file} failed: {e}")
+                inputs[key] = e
+
+    def run_target(name: str, config: ImportConfig) -> TargetResult:
+        target_logger = logging.getLogger(f"{logger.name}.{name}")
+        target_result = TargetResult(target=name)
+        start = time.perf_counter()
+        try:
+            users_attributes = inputs[(config.input_file, config.hmac)]
+            if isinstance(users_attributes, Exception):
+                raise users_attributes
+            # each thread needs COM, import_users opens a directory session of its own (connections and caches)
+            resolutions = ResolutionList.load(file=config.resolutions_file, logger=target_logger, save_default=True)
+            with com_initialized():
+                target_result.result = import_users(
+                    config=config,
+                    logger=target_logger,
+                    resolutions=resolutions,
+                    users_attributes=users_attributes,  # not modified by the import, shared by all targets
+                    on_event=None if on_event is None else lambda event: on_event(dict(target=name, **event)),
+                )
+        except Exception as e:
+            # a failing target must not affect the others
+            target_logger.exception(f"Import into {name} failed")
+            target_result.error = str(e)
+        target_result.duration = time.perf_counter() - start
+        target_logger.info(f"Import into {name} finished in {target_result.duration:.1f}s")
+        return target_result
+
+    # one thread per target, so a slow target does not hold back the others
+    with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="import-target") as pool:
+        futures = [pool.submit(run_target, name, config) for name, config in targets.items()]
+        return [future.result() for future in futures]
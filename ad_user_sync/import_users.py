@@ -1,249 +1,353 @@
-from datetime import datetime
-from logging import Logger
-from typing import Dict, List, Any, Set
+from __future__ import annotations
 
-from pywintypes import com_error
-from pyad import ADGroup, ADUser, win32Exception, ADContainer
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial, cache
+from itertools import chain
+from logging import Logger, LoggerAdapter
+from typing import Dict, List, Any, Set, Callable, Iterable, Tuple, TYPE_CHECKING
 
 from .active_directory import CachedActiveDirectory
-from .model import ImportConfig, ResolutionList, NameAction, EnableAction, JoinAction, NameResolution, ImportResult
+from .active_directory.CatchableADExceptions import OperationExceptions
+from .model import (
+    ImportConfig,
+    ResolutionList,
+    NameAction,
+    EnableAction,
+    JoinAction,
+    NameResolution,
+    ImportResult,
+    DirectoryMetadata,
+    ObjectRecord,
+    UserRecord,
+    validate_user_records,
+)
 from .model.Action import DisableAction, LeaveAction
-from .util import full_path, not_none
+from .membership import MembershipMatrix
+from .profiler import Profiler
+from .util import full_path, not_none, split_dn, com_initialized
 from .user_file import UserFile
 
+if TYPE_CHECKING:
+    from pyad import ADUser, ADContainer
+
 
 def import_users(
     config: ImportConfig,
     logger: Logger,
     resolutions: ResolutionList = None,
+    active_directory: CachedActiveDirectory | None = None,
+    users_attributes: List[Dict[str, Any]] | None = None,
+    on_event: Callable[[Dict[str, Any]], None] | None = None,
+    profiler: Profiler | None = None,
 ) -> ImportResult:
     logger.debug("Starting import_users")
 
-    result = ImportResult()
+    result = ImportResult(on_event=on_event)
+    profiler = profiler or Profiler()
 
     # create an empty resolution list if none is provided
     resolutions = resolutions or ResolutionList()
-    logger.debug(f"{len(resolutions)} resolution(s) provided")
-
-    # create a cached active directory instance for accessing AD
-    active_directory = CachedActiveDirectory(logger)
-
-    # helper function to resolve groups from ad according to config
-    def get_group(g: str) -> ADGroup:
-        p = full_path(config.group_path, g)
-        logger.debug(f"Loading ad group {p}...")
-        group = active_directory.get_group(p)
-        logger.debug("...AD group loaded.")
-        return group
-
-    # resolve the config GroupMap form AD
-    logger.debug("Loading ad groups for group_map...")
-    group_map: Dict[str, Set[ADGroup]] = {}
+    logger.debug("%d resolution(s) provided", len(resolutions))
+
+    # create a cached active directory instance for accessing AD, unless a warm one is provided
+    if active_directory is None:
+        active_directory = CachedActiveDirectory(
+            logger,
+            ldap_server=config.ldap_server,
+            throttle=config.throttle,
+            cache=config.cache,
+            name_index=config.name_index,
+        )
+    else:
+        active_directory.invalidate_users()
+    active_directory.throttle.reset_stats()
+
+    if config.metadata_cache_file is not None:
+        active_directory.metadata = DirectoryMetadata.load(config.metadata_cache_file, logger=logger)
+
+    # resolve all groups of group_map and restricted_groups form AD in one query (fails listing all missing groups)
+    profiler.phase("groups")
+    logger.debug("Loading ad groups for group_map and restricted_groups...")
+    groups = active_directory.resolve_groups(
+        map(partial(full_path, config.group_path), chain(chain(*config.group_map.values()), config.restricted_groups))
+    )
+
+    # helper function to get the dn of a group as stored in AD
+    def get_group_dn(g: str) -> str:
+        return groups[full_path(config.group_path, g)].dn
+
+    # resolve the config GroupMap
+    group_map: Dict[str, Set[str]] = {}
     for source_group, target_groups in config.group_map.items():
-        group_map[source_group] = set(map(get_group, target_groups))
-    logger.debug(f"{len(group_map)} group mappings loaded")
+        group_map[source_group] = set(map(get_group_dn, target_groups))
+    logger.debug("%d group mappings loaded", len(group_map))
 
-    # resolve the config RestrictedGroups form AD
-    logger.debug("Loading ad groups for restricted_groups...")
-    restricted_groups = set(map(get_group, config.restricted_groups))
-    logger.debug(f"{len(restricted_groups)} restricted groups loaded.")
+    # resolve the config RestrictedGroups
+    restricted_groups = set(map(get_group_dn, config.restricted_groups))
+    logger.debug("%d restricted groups loaded.", len(restricted_groups))
 
     # The path where all managed users will be created. Defined by ManagedUserPath
     logger.debug("Loading ad container for managed_user_path...")
     user_container = active_directory.get_container(config.managed_user_path)
     logger.debug("managed_user_path container loaded.")
 
-    # Read users form input file
-    logger.debug(f"Reading users file from {config.input_file}")
-    users_attributes = UserFile(path=config.input_file, hmac=config.hmac).read()
-    logger.debug(f"Users file loaded: {len(users_attributes)} user(s)")
-
-    # All users imported during this run
-    current_users: Set[ADUser] = set()  # list of users that are present in the current import list
-
-    # User memberships for all managed groups are collected here
-    current_members_by_group: Dict[ADGroup, Set[ADUser]] = {k: set() for k in set().union(*group_map.values())}
+    # Read users form input file, unless they were read already
+    profiler.phase("read")
+    if users_attributes is None:
+        logger.debug("Reading users file from %s", config.input_file)
+        users_attributes = UserFile(path=config.input_file, hmac=config.hmac).read()
+        logger.debug("Users file loaded: %d user(s)", len(users_attributes))
+
+    # All users are validated before anything is changed. Invalid and duplicate records are skipped, the accounts
+    # they refer to are left as they are (they are neither updated nor treated as orphans).
+    records, invalid_records = validate_user_records(users_attributes)
+    for invalid_record in invalid_records:
+        logger.warning(
+            "Skipping user record %d (%s): %s",
+            invalid_record.index,
+            invalid_record.cn or "no cn",
+            invalid_record.error,
+            extra=dict(phase="read"),
+        )
+        result.add_invalid(invalid_record)
+    skipped_cns = {(config.prefix_common_names + r.cn).lower() for r in invalid_records if r.cn is not None}
+    logger.debug("%d valid user record(s), %d skipped", len(records), len(invalid_records))
 
     # expiration date to be set to enabled users
     user_expiration_date = datetime.now() + config.expiration_time
 
-    logger.debug(f"==== Syncing {len(users_attributes)} user(s) ====")
-    for user_attributes in users_attributes:
-        # Remove attributes that can not be applied using ADUser.update_attributes() function
-        cn: str = config.prefix_common_names + user_attributes.pop("cn")  # used as key and for user creation
-        account_name: str = user_attributes.pop("sAMAccountName")  # used for user creation
-        member_of: List[str] = user_attributes.pop("memberOf")  # will be mapped to "member" attribute of groups
-        _account_expires: str | None = user_attributes.pop("accountExpires", None)  # set via ADUser.set_expiration()
-        disable: bool = user_attributes.pop("disabled", False)  # We only disable via ADUser.disable(), never enable
-        user_attributes.pop("subPath", None)  # Currently not used, not a valid AD attribute.
-        user_attributes.pop("distinguishedName", None)  # domain specific, should not be exported in the first place
-
-        logger.debug(f"Syncing user '{cn}'...")
+    # Syncs a user into the container of its partition. Returns the user as a plain record (no COM object) with its
+    # memberOf, None if it was not imported. `root` is managed_user_path, both containers are bound on the calling
+    # thread.
+    def sync_user(
+        record: UserRecord, container: ADContainer, root: ADContainer
+    ) -> Tuple[ObjectRecord, Tuple[str, ...]] | None:
+        cn: str = config.prefix_common_names + record.cn  # used as key and for user creation
+        account_name: str = record.account_name  # used for user creation
+        member_of = record.member_of  # will be mapped to "member" attribute of groups
+        disable: bool = record.disabled  # We only disable via ADUser.disable(), never enable
+        user_attributes = record.attributes  # applied using ADUser.update_attributes()
+
+        # messages about this user carry it as structured field
+        user_logger = LoggerAdapter(logger, dict(user=cn, phase="users"), merge_extra=True)
+        user_logger.debug("Syncing user '%s'...", cn)
 
         # Retrieve existing user, if present
         name_resolution = resolutions.get_name(cn, account_name)
-        logger.debug("Look for existing user...")
+        user_logger.debug("Look for existing user...")
         # If the user selected to resolve a name conflict by taking over the existing account, we need to search for that
         if (name_resolution is not None) and name_resolution.is_accepted and name_resolution.take_over_account:
-            logger.debug(f"name_resolution says take over account {account_name}")
-            user = active_directory.find_single_user(user_container.get_domain(), f"sAMAccountName = '{account_name}'")
+            user_logger.debug("name_resolution says take over account %s", account_name)
+            user = active_directory.find_single_user(
+                active_directory.get_domain(root), f"sAMAccountName = '{account_name}'"
+            )
+        else:
+            # searched in all partitions, users moved to another sub path in the source are moved along
+            user = active_directory.find_single_user(root, f"cn = '{cn}'")
+        if user:
+            user_logger.debug("Existing user found: %s", user.cn)
         else:
-            user = active_directory.find_single_user(user_container, f"cn = '{cn}'")
-        logger.debug(f"Existing user found: {user.cn}" if user else "no existing user found")
+            user_logger.debug("no existing user found")
 
         # Handle disabled users
         if disable:
-            logger.debug("User is set as disabled in import file.")
+            user_logger.debug("User is set as disabled in import file.")
             if user is None:
-                logger.debug("User does not exist locally (manually deleted or never created), just ignore it.")
-                continue
+                user_logger.debug("User does not exist locally (manually deleted or never created), just ignore it.")
+                return None
             else:
-                handle_disabled_user(logger, resolutions, result, user, False)
+                handle_disabled_user(user_logger, active_directory, resolutions, result, user, False)
 
         # Create user or update user attributes
         if user is None:
-            logger.debug("Creating new user...")
+            user_logger.debug("Creating new user...")
             user = create_user(
                 cn=cn,
                 account_name=account_name,
                 user_attributes=user_attributes,
                 name_resolution=resolutions.get_name(cn, account_name),
                 active_directory=active_directory,
-                user_container=user_container,
-                logger=logger,
+                user_container=container,
+                logger=user_logger,
                 result=result,
             )
             if user is None:
                 # go to next user to import if creation failed
-                continue
+                return None
         else:
-            logger.debug("Updating user...")
-            if user.parent_container != user_container:
-                logger.debug(f"Move existing user from {user.parent_container.dn} to {user_container.dn}...")
-                user.move(user_container)
-                logger.info(f"{user.cn}: Moved from {user.parent_container.dn} to {user_container.dn}.")
-
-            if user.get_attribute("cn", False) != cn:
+            user_logger.debug("Updating user...")
+            # compared by dn, pyad splits the parent off at the first comma, also an escaped one ("CN=Doe\, John")
+            old_parent_dn = split_dn(user.dn)[1]
+            if old_parent_dn.lower() != container.dn.lower():
+                user_logger.debug("Move existing user from %s to %s...", old_parent_dn, container.dn)
+                active_directory.move_user(user, container)
+                user_logger.info("%s: Moved from %s to %s.", user.cn, old_parent_dn, container.dn)
+
+            if active_directory.get_user_attributes(user, ["cn"])["cn"] != cn:
                 old_cn = user.cn
-                try:
-                    logger.debug(f"Rename user from {old_cn} to {cn}...")
-                    user.rename(cn, False)
-                    logger.info(f"{old_cn}: Renamed to {cn}.")
-                except com_error as ex:
-                    # HACK: `ADObject.rename()` crashes out because `self.get_attribute("distinguishedName")` does
-                    # still return the old dn for unknown reasons... Catch it and update the user object manually.
-                    if (ex.excepinfo[5] & 0xFFFFFFFF) == 0x80072030:
-                        user = ADUser.from_dn("CN=" + cn + "," + user_container.dn)
-                        logger.info(f"{old_cn}: Renamed to {cn}.")
-                    else:
-                        raise
+                user_logger.debug("Rename user from %s to %s...", old_cn, cn)
+                user = active_directory.rename_user(user, cn, container)
+                user_logger.info("%s: Renamed to %s.", old_cn, cn)
 
             # update the attributes of existing user
-            logger.debug("Updating user attributes...")
-            old_attributes = {k: user.get_attribute(k, False) for k in user_attributes}
+            user_logger.debug("Updating user attributes...")
+            old_attributes = active_directory.get_user_attributes(user, user_attributes.keys())
             if user_attributes != old_attributes:
-                user.update_attributes(user_attributes)
+                active_directory.update_user_attributes(user, user_attributes)
                 result.add_updated(user)
-                logger.info(f"{user.cn}: Attributes were updated.")
+                user_logger.info("%s: Attributes were updated.", user.cn)
             else:
-                logger.debug(f"{user.cn}: Attributes unchanged.")
+                user_logger.debug("%s: Attributes unchanged.", user.cn)
 
-        # add the user to the list of users, present in the current import list
-        current_users.add(user)
+        # the user object is only used on this thread, the record is added to the memberships once all partitions
+        # are synced (see below)
+        imported_user = ObjectRecord.of(user)
 
         if not disable:
             # Extend expiration (disabled users in the import are left to expire)
-            logger.debug(f"Setting expiration date to {user_expiration_date}...")
-            user.set_expiration(user_expiration_date)
-            logger.info(f"{user.cn}: set expiration date to {user_expiration_date}.")
+            user_logger.debug("Setting expiration date to %s...", user_expiration_date)
+            active_directory.set_expiration(user, user_expiration_date)
+            user_logger.info("%s: set expiration date to %s.", user.cn, user_expiration_date)
 
             # Enable the User
-            if is_disabled(user):
-                logger.debug("Enabling disabled user...")
+            if active_directory.is_disabled(user):
+                user_logger.debug("Enabling disabled user...")
                 # enabling a disabled existing user requires a resolved interactive action
                 # we do not enable automatically
                 enable_resolution = resolutions.get_enable(user.cn)
                 if enable_resolution is None:
                     # no resolved action was found -> add interactive action
                     action = result.require_interaction(EnableAction(user=user.cn))
-                    logger.debug(f"Manual action required: {action}")
+                    user_logger.debug("Manual action required: %s", action)
                 elif enable_resolution.accept is True:
                     # resolved action was found and it got accepted
                     try:
-                        logger.debug("Setting password...")
-                        user.set_password(enable_resolution.password)
-                        logger.debug("Password was set. Update user password settings...")
-                        update_user_password_settings(user, config)
-                        logger.debug("User password settings updated. Enabling user...")
-                        user.enable()
+                        user_logger.debug("Setting password...")
+                        active_directory.set_password(user, enable_resolution.password)
+                        user_logger.debug("Password was set. Update user password settings...")
+                        active_directory.write(
+                            f"Updating password settings of {user.cn}",
+                            partial(update_user_password_settings, user, config),
+                        )
+                        user_logger.debug("User password settings updated. Enabling user...")
+                        active_directory.enable_user(user)
                         result.add_enabled(user)
-                        logger.info(f"{user.cn}: Was enabled (accepted manually).")
-                    except win32Exception as e:
+                        user_logger.info("%s: Was enabled (accepted manually).", user.cn)
+                    except OperationExceptions as e:
                         if e.error_info.get("error_code") != "0x800708c5":
                             raise
-                        logger.debug(f"{user.cn}: Manually provided password does not match requirements")
+                        user_logger.debug("%s: Manually provided password does not match requirements", user.cn)
                         action = result.require_interaction(
                             EnableAction(
                                 user=user.cn,
                                 error=e.error_info.get("message", "Password does not meet requirements"),
                             )
                         )
-                        logger.debug(f"Manual action required: {action}")
+                        user_logger.debug("Manual action required: %s", action)
 
                 else:
                     # resolved action was found and it got rejected
-                    logger.debug(f"{user.cn}: Stays disabled (rejected manually at {enable_resolution.timestamp})")
-
-        # Add user as a member to managed groups for later processing
-        # We can't set group membership for a user directly, instead we have to set user members for groups.
-        #   1. Add "*" to `member_of` of the user to also map the catch-all group.
-        #   2. Map all given groups to local AD groups according to group_map (unmapped groups will be None).
-        #   3. Filter out unmapped groups (`None` values).
-        #   4. Remove duplicates by collecting groups in a set.
-        # Then add the user as a member to every group.
-        for user_group in set().union(*filter(not_none, map(group_map.get, member_of + ["*"]))):
-            current_members_by_group[user_group].add(user)
+                    user_logger.debug(
+                        "%s: Stays disabled (rejected manually at %s)", user.cn, enable_resolution.timestamp
+                    )
 
+        return imported_user, member_of
+
+    # Users are synced by partition: every container below managed_user_path holds one (see `sub_paths`).
+    # Without sub paths, all users are placed directly into managed_user_path, which is the only partition.
+    # Partitions may run on worker threads. COM objects can only be used on the thread that bound them, so only dns
+    # and plain records are passed between threads, each partition binds its containers itself.
+    partitions: Dict[str, List[UserRecord]] = {}  # users by lower case dn of their container
+    if config.sub_paths:
+        profiler.phase("partitions")
+        paths: Dict[str, str] = {}
+        for record in records:
+            path = get_partition_path(user_container.dn, record.sub_path)
+            paths.setdefault(path.lower(), path)
+            partitions.setdefault(path.lower(), []).append(record)
+        containers = get_partition_containers(active_directory, user_container, paths.values(), logger)
+        logger.info("%d user(s) in %d partition(s) below %s", len(records), len(containers), user_container.dn)
+    else:
+        partitions[user_container.dn.lower()] = records
+        containers = {user_container.dn.lower(): user_container.dn}
+    root_dn = user_container.dn
+
+    def sync_partition(key: str) -> List[Tuple[ObjectRecord, Tuple[str, ...]]]:
+        container = active_directory.bind_container(containers[key])
+        root = container if key == root_dn.lower() else active_directory.bind_container(root_dn)
+        partition_users = partitions.get(key, [])
+        start = time.perf_counter()
+        imported = list(filter(not_none, (sync_user(record, container, root) for record in partition_users)))
+        if config.sub_paths:
+            duration = time.perf_counter() - start
+            logger.info(
+                "Partition %s: %d user(s) synced in %.1fs",
+                container.dn,
+                len(partition_users),
+                duration,
+                extra=dict(phase="users", duration=duration),
+            )
+        return imported
+
+    profiler.phase("users")
+    logger.debug("==== Syncing %d user(s) ====", len(records))
+    # All users imported during this run and their memberships in the managed groups are collected here.
+    # We can't set group membership for a user directly, instead we have to set user members for groups.
+    # `member_of` is mapped to the managed groups according to group_map, unmapped groups are ignored.
+    memberships = MembershipMatrix(group_map)
+    for imported in run_partitions(sync_partition, sorted(partitions), config.max_parallel_partitions):
+        for user, member_of in imported:
+            memberships.add(user, member_of)
+
+    profiler.phase("memberships")
     logger.debug("==== Updating group memberships ====")
 
-    # Update memberships of managed groups
-    for group, current_group_members in current_members_by_group.items():
-        logger.debug(f"Updating {group.cn} memberships...")
-        # for some reason get_members sometimes crashes after changes to group members are made before.
-        # so we need to reload the group. AD is a mess.
-        group = active_directory.get_group_uncached(group.dn)
-        old_members: Set[ADUser] = set(group.get_members(ignore_groups=True))
+    # Update memberships of managed groups. Memberships are compared as bitsets of the imported users,
+    # members of a group that are not in the import file have no bit and are never touched.
+    for group_index, group_dn in enumerate(memberships.groups):
+        group = active_directory.get_group(group_dn)
+        group_logger = LoggerAdapter(logger, dict(group=group.cn, phase="groups"), merge_extra=True)
+        group_logger.debug("Updating %s memberships...", group_dn)
+        old_members = memberships.get_bits(active_directory.get_user_members(group))  # by dn
+        current_group_members = memberships.get_desired(group_index)
 
         # remove users from group if the user is still in the import file, but no longer has the group membership
-        removed_members = (old_members - current_group_members) & current_users
-        logger.debug(f"{len(removed_members)} member(s) to remove")
+        removed_members = memberships.get_users(old_members & ~current_group_members)
+        group_logger.debug("%d member(s) to remove", len(removed_members))
         for user in removed_members:
-            logger.debug(f'Removing user {user.cn} from group "{group.cn}"...')
+            group_logger.debug('Removing user %s from group "%s"...', user.cn, group.cn, extra=dict(user=user.cn))
             leave_resolution = resolutions.get_leave(user=user.cn, group=group.cn)
             if leave_resolution is None:
                 action = result.require_interaction(LeaveAction(user=user.cn, group=group.cn))
-                logger.debug(f"Manual action required: {action}")
+                group_logger.debug("Manual action required: %s", action, extra=dict(user=user.cn))
             elif leave_resolution.accept is True:
-                group.remove_members([user])
+                active_directory.remove_members(group, [user.dn])
                 result.add_left(user, group)
-                logger.info(f'{user.cn}: Removed from group "{group.cn}" (membership not present in import list).')
+                group_logger.info(
+                    '%s: Removed from group "%s" (membership not present in import list).',
+                    user.cn,
+                    group.cn,
+                    extra=dict(user=user.cn),
+                )
 
         # add members to group that haven't been members before
-        if group not in restricted_groups:
+        if group_dn not in restricted_groups:
             # unrestricted groups can just be joined
-            approved_new_members = current_group_members - old_members
+            approved_new_members = memberships.get_users(current_group_members & ~old_members)
             if len(approved_new_members) > 0:
-                logger.debug(f"Group is unrestricted. Joining {len(approved_new_members)}...")
-                group.add_members(approved_new_members)
+                group_logger.debug("Group is unrestricted. Joining %d...", len(approved_new_members))
+                active_directory.add_members(group, [user.dn for user in approved_new_members])
                 for user in approved_new_members:
                     result.add_joined(user, group)
-                    logger.info(f'{user.cn}: Joined group "{group.cn}"')
+                    group_logger.info('%s: Joined group "%s"', user.cn, group.cn, extra=dict(user=user.cn))
             else:
-                logger.debug("No joining users for group.")
+                group_logger.debug("No joining users for group.")
         else:
             # joining a restricted group requires a resolved interactive action
-            join_candidates = current_group_members - old_members
-            logger.debug(f"Group is restricted. Processing {len(join_candidates)} candidate(s) to join...")
+            join_candidates = memberships.get_users(current_group_members & ~old_members)
+            group_logger.debug("Group is restricted. Processing %d candidate(s) to join...", len(join_candidates))
             approved_new_members = []
 
             # filter the users that are accepted in the restricted group
@@ -253,62 +357,146 @@ def import_users(
                 if join_resolution is None:
                     # no resolved action was found  -> add interactive action
                     action = result.require_interaction(JoinAction(user=user.cn, group=group.cn))
-                    logger.debug(f"Manual action required: {action}")
+                    group_logger.debug("Manual action required: %s", action, extra=dict(user=user.cn))
                 elif join_resolution.accept is True:
                     # resolved action was found and it was accepted
                     approved_new_members.append(user)
                 else:
                     # resolved action was found and it was rejected
-                    logger.debug(
-                        f'{user.cn}: Not joining restricted group "{group.cn}" '
-                        f"(rejected manually at {join_resolution.timestamp})"
+                    group_logger.debug(
+                        '%s: Not joining restricted group "%s" (rejected manually at %s)',
+                        user.cn,
+                        group.cn,
+                        join_resolution.timestamp,
+                        extra=dict(user=user.cn),
                     )
 
             # add the approved members to the group
             if len(approved_new_members) > 0:
-                logger.debug(f"Joining {len(approved_new_members)} approved user(s)...")
-                group.add_members(approved_new_members)
+                group_logger.debug("Joining %d approved user(s)...", len(approved_new_members))
+                active_directory.add_members(group, [user.dn for user in approved_new_members])
                 for user in approved_new_members:
                     result.add_joined(user, group)
-                    logger.info(f'{user.cn}: Joined restricted group "{group.cn}" (accepted manually).')
+                    group_logger.info(
+                        '%s: Joined restricted group "%s" (accepted manually).',
+                        user.cn,
+                        group.cn,
+                        extra=dict(user=user.cn),
+                    )
 
+    profiler.phase("orphans")
     logger.debug("==== Handling orphaned user accounts ====")
-    # Check of existing users that are not in the import file.
-    missing_users = active_directory.find_users(user_container) - current_users
-    logger.debug(f"Found {len(missing_users)} orphaned account(s).")
-    for user in missing_users:
-        logger.debug(f"{user.cn}: user account no longer in import.")
-        handle_disabled_user(logger, resolutions, result, user, True)
+
+    # Check of existing users that are not in the import file. Each partition only holds the users directly in its
+    # container, all containers below managed_user_path are checked (including ones no user is imported to anymore).
+    # Runs after all partitions are synced, so users moved between partitions are not taken for orphans.
+    def handle_orphans(key: str) -> None:
+        container = active_directory.bind_container(containers[key])
+        missing_users = [
+            user
+            for user in active_directory.find_users(container, recursive=not config.sub_paths)
+            if user.dn not in memberships and user.cn.lower() not in skipped_cns
+        ]
+        logger.debug("Found %d orphaned account(s) in %s.", len(missing_users), container.dn)
+        for user in missing_users:
+            user_logger = LoggerAdapter(logger, dict(user=user.cn, phase="orphans"), merge_extra=True)
+            user_logger.debug("%s: user account no longer in import.", user.cn)
+            handle_disabled_user(user_logger, active_directory, resolutions, result, user, True)
+
+    run_partitions(handle_orphans, sorted(containers), config.max_parallel_partitions)
+    profiler.end()
+
+    if config.metadata_cache_file is not None:
+        active_directory.metadata.save(config.metadata_cache_file)
+
+    result.directory_stats = active_directory.throttle.get_stats()
+    result.cache_stats = active_directory.cache.get_stats()
+    logger.debug("Directory operations: %s", result.directory_stats.model_dump())
+    logger.debug("Directory cache: %s", result.cache_stats.model_dump())
 
     return result
 
 
-def handle_disabled_user(
+def get_partition_path(managed_user_path: str, sub_path: str | None) -> str:
+    # The container of the users exported with the given subPath. Every level becomes an organizational unit, including
+    # containers ("CN=...") of the source domain.
+    names = []
+    while sub_path:
+        rdn, sub_path = split_dn(sub_path)
+        names.append("OU=" + rdn.split("=", 1)[-1].strip())
+    return full_path(managed_user_path, ",".join(names))
+
+
+def get_partition_containers(
+    active_directory: CachedActiveDirectory,
+    user_container: ADContainer,
+    paths: Iterable[str],
     logger: Logger,
+) -> Dict[str, str]:
+    # DNs of all containers below user_container and user_container itself by lower case dn. Containers in `paths`
+    # that do not exist are created, together with any missing level above them.
+    containers = {user_container.dn.lower(): user_container.dn}
+    for dn in active_directory.find_child_containers(user_container.dn, "subtree"):
+        containers[dn.lower()] = dn
+    created: Dict[str, ADContainer] = {user_container.dn.lower(): user_container}
+
+    def get_or_create(dn: str) -> ADContainer:
+        container = created.get(dn.lower())
+        if container is None:
+            if dn.lower() in containers:
+                container = active_directory.get_container(containers[dn.lower()])
+            else:
+                rdn, parent_dn = split_dn(dn)
+                container = active_directory.create_container(get_or_create(parent_dn), rdn.split("=", 1)[1])
+                logger.info("Created organizational unit %s", container.dn)
+                containers[dn.lower()] = container.dn
+            created[dn.lower()] = container
+        return container
+
+    for path in paths:
+        if path.lower() not in containers:
+            get_or_create(path)
+    return containers
+
+
+def run_partitions[T](function: Callable[[str], T], keys: List[str], max_parallel: int) -> List[T]:
+    # Calls the function for every partition, up to `max_parallel` at a time on worker threads, and returns the
+    # results in the order of `keys`. The first error of any partition is raised once the running ones are done.
+    # Results must not hold COM objects, COM is uninitialized when a worker is done.
+    if max_parallel == 1 or len(keys) <= 1:
+        return [function(key) for key in keys]
+
+    def run(key: str) -> T:
+        with com_initialized():
+            return function(key)
+
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="import-partition") as pool:
+        return list(pool.map(run, keys))
+
+
+def handle_disabled_user(
+    logger: Logger | LoggerAdapter,
+    active_directory: CachedActiveDirectory,
     resolutions: ResolutionList,
     result: ImportResult,
     user: ADUser,
     deleted: bool,
 ):
     # Don't disable user automatically, use interaction.
-    if not is_disabled(user):
+    if not active_directory.is_disabled(user):
         disable_resolution = resolutions.get_disable(user.cn)
-        logger.debug(f"{user.cn}: disabling...")
+        logger.debug("%s: disabling...", user.cn)
         if disable_resolution is None:
             # No resolution was found -> Add interactive action
             action = result.require_interaction(DisableAction(user=user.cn, deleted=deleted))
-            logger.debug(f"Manual action required: {action}")
+            logger.debug("Manual action required: %s", action)
         elif disable_resolution.accept is True:
             # Disable action was accepted -> Disable user
             result.add_disabled(user)
-            user.disable()
-            logger.info(f"{user.cn}: Was disabled (accepted manually).")
+            active_directory.disable_user(user)
+            logger.info("%s: Was disabled (accepted manually).", user.cn)
         else:
-            logger.debug(f"{user.cn}: Disabled user is left to expire.")
-
-
-def is_disabled(user: ADUser) -> bool:
-    return user._ldap_adsi_obj.AccountDisabled
+            logger.debug("%s: Disabled user is left to expire.", user.cn)
 
 
 def create_user(
@@ -318,115 +506,234 @@ def create_user(
     name_resolution: NameResolution | None,
     active_directory: CachedActiveDirectory,
     user_container: ADContainer,
-    logger: Logger,
+    logger: Logger | LoggerAdapter,
     result: ImportResult,
 ) -> ADUser | None:
     # check if there should be a renaming applied for this user
     if name_resolution is not None and name_resolution.is_accepted:
         new_account_name = name_resolution.new_name
-        logger.debug(f"Creating new user {new_account_name} (renamed from {account_name})...")
+        logger.debug("Creating new user %s (renamed from %s)...", new_account_name, account_name)
     else:
         new_account_name = account_name
-        logger.debug(f"Creating new user {account_name}...")
+        logger.debug("Creating new user %s...", account_name)
+
+    attrs: Dict[str, Any] = user_attributes | {"sAMAccountName": new_account_name}
+    derived_upn = "userPrincipalName" not in attrs
+    if derived_upn:
+        # Work around incorrect default UPN set by pyad, by always setting it explicitly.
+        attrs["userPrincipalName"] = f"{new_account_name}@{active_directory.get_default_upn(user_container)}"
+
+    def retry_with_original_name() -> ADUser | None:
+        return create_user(
+            cn=cn,
+            account_name=account_name,
+            user_attributes=user_attributes,
+            name_resolution=None,
+            active_directory=active_directory,
+            user_container=user_container,
+            logger=logger,
+            result=result,
+        )
+
+    # known conflicts are found in the name index, without a failing create or any further query
+    name_index = active_directory.get_name_index(user_container)
+    if name_index is not None:
+        existing = name_index.get_by_dn(f"CN={cn},{user_container.dn}")
+        if existing is not None:
+            logger.error("%s: Unmanaged object with same cn exists (%s).", cn, existing.dn)
+            return None
+
+        def is_name_taken(name: str) -> bool:
+            upn = f"{name}@{active_directory.get_default_upn(user_container)}"
+            return name_index.get_by_account_name(name) is not None or (
+                derived_upn and name_index.get_by_upn(upn) is not None
+            )
+
+        conflict = name_index.get_by_account_name(new_account_name)
+        if conflict is not None:
+            logger.debug('Account name "%s" is used by %s (name index)', new_account_name, conflict.dn)
+            return handle_name_conflict(
+                cn=cn,
+                account_name=account_name,
+                new_account_name=new_account_name,
+                user_attributes=user_attributes,
+                name_resolution=name_resolution,
+                conflict_cn=conflict.cn,
+                error=None,
+                is_name_taken=is_name_taken,
+                retry_with_original_name=retry_with_original_name,
+                logger=logger,
+                result=result,
+            )
+
+        conflict = name_index.get_by_upn(attrs["userPrincipalName"])
+        if conflict is not None:
+            logger.debug('User principal name "%s" is used by %s (name index)', attrs["userPrincipalName"], conflict.dn)
+            if not derived_upn:
+                # the user principal name is part of the import, a different account name does not help
+                logger.error("%s: User principal name %s is already in use.", cn, attrs["userPrincipalName"])
+                return None
+            return handle_name_conflict(
+                cn=cn,
+                account_name=account_name,
+                new_account_name=new_account_name,
+                user_attributes=user_attributes,
+                name_resolution=name_resolution,
+                conflict_cn=conflict.cn,
+                error=f"User principal name {attrs['userPrincipalName']} is already in use ({conflict.cn}).",
+                is_name_taken=is_name_taken,
+                retry_with_original_name=retry_with_original_name,
+                logger=logger,
+                result=result,
+            )
 
     # create a new user
     try:
-        attrs: Dict[str, Any] = user_attributes | {"sAMAccountName": new_account_name}
-        if "userPrincipalName" not in attrs:
-            # Work around incorrect default UPN set by pyad, by always setting it explicitly.
-            attrs["userPrincipalName"] = f"{new_account_name}@{user_container.get_domain().get_default_upn()}"
-
-        user = user_container.create_user(
-            name=cn,
-            enable=False,
-            optional_attributes=attrs,
-        )
+        user = active_directory.create_user(user_container, cn, attrs)
         result.add_created(user)
         if account_name == new_account_name:
-            logger.info(f"{user.cn}: User created.")
+            logger.info("%s: User created.", user.cn)
         else:
-            logger.info(f"{user.cn}: User created with renamed account name ({account_name} -> {new_account_name})")
+            logger.info(
+                "%s: User created with renamed account name (%s -> %s)", user.cn, account_name, new_account_name
+            )
 
         return user
 
-    except win32Exception as e:
+    except OperationExceptions as e:
         logger.debug(
-            f"Creating failed with exception: {str(e).strip()}. Let's see if there is a user with the same cn..."
+            "Creating failed with exception: %s. Let's see if there is a user with the same cn...", str(e).strip()
         )
-        conflict_user = active_directory.find_single_user(None, f"cn = '{cn}'")
+        # searched in the domain of the container, not the one of this computer (see `ldap_server`)
+        domain = active_directory.get_domain(user_container)
+        conflict_user = active_directory.find_single_user(domain, f"cn = '{cn}'")
         if conflict_user is not None:
-            logger.error(f"{cn}: Unmanaged user with same cn exists.")
+            logger.error("%s: Unmanaged user with same cn exists.", cn)
             return None
 
         # creation failed. check if it was because of a name conflict
-        logger.debug(f"...No user with cn '{cn}' exists. Let's see if there is a account name conflict...")
+        logger.debug("...No user with cn '%s' exists. Let's see if there is a account name conflict...", cn)
         conflict_user = active_directory.find_single_user(
-            parent=None,  # user_container.get_domain(),
+            parent=domain,
             where=f"sAMAccountName = '{new_account_name}'",
         )
 
         if conflict_user is not None:
-            # name conflict detected -> add required action
-            # the action should refer to the account_name from the import file, not a previous renaming
-            logger.debug(f'User with the same account name ("{new_account_name}") found: {conflict_user.dn}')
+            logger.debug('User with the same account name ("%s") found: %s', new_account_name, conflict_user.dn)
 
-            if account_name == new_account_name:
-                previous_error = None
-            else:
-                # edge case:
-                logger.debug("Check if original name is free in the meantime...")
-                old_name_conflict_user = active_directory.find_single_user(
-                    parent=user_container.get_domain(),
-                    where=f"sAMAccountName = '{account_name}'",
-                )
-
-                if old_name_conflict_user is None:
-                    # seems that the original account name is available in the meantime
-                    logger.debug(
-                        f"Account renaming applied for {cn} ({account_name} -> {new_account_name}) "
-                        f"which gave another name conflict. But the original account name seems to be "
-                        f"available in the meantime."
-                    )
-                    return create_user(
-                        cn=cn,
-                        account_name=account_name,
-                        user_attributes=user_attributes,
-                        name_resolution=None,
-                        active_directory=active_directory,
-                        user_container=user_container,
-                        logger=logger,
-                        result=result,
-                    )
-
-                logger.debug("No, that one is still taken.")
-                previous_error = f"Account name {new_account_name} is already in use too ({conflict_user.cn})."
-
-            if name_resolution is None or name_resolution.is_accepted:
-                action = result.require_interaction(
-                    NameAction(
-                        user=cn,
-                        attributes=user_attributes,
-                        name=account_name,
-                        input_name=new_account_name,
-                        conflict_user=conflict_user.cn,
-                        error=previous_error,
+            def is_name_taken_in_directory(name: str) -> bool:
+                return (
+                    active_directory.find_single_user(
+                        parent=active_directory.get_domain(user_container),
+                        where=f"sAMAccountName = '{name}'",
                     )
+                    is not None
                 )
-                logger.debug(f"Manual action required: {action}")
-            return None
+
+            return handle_name_conflict(
+                cn=cn,
+                account_name=account_name,
+                new_account_name=new_account_name,
+                user_attributes=user_attributes,
+                name_resolution=name_resolution,
+                conflict_cn=conflict_user.cn,
+                error=None,
+                is_name_taken=is_name_taken_in_directory,
+                retry_with_original_name=retry_with_original_name,
+                logger=logger,
+                result=result,
+            )
 
         # it was another problem. re-raise exception
         logger.debug("No name conflict. Can not handle this error. Re-raise exception.")
         raise
 
 
-def update_user_password_settings(user: ADUser, config: ImportConfig):
+def handle_name_conflict(
+    cn: str,
+    account_name: str,
+    new_account_name: str,
+    user_attributes: Dict[str, Any],
+    name_resolution: NameResolution | None,
+    conflict_cn: str,
+    error: str | None,
+    is_name_taken: Callable[[str], bool],
+    retry_with_original_name: Callable[[], ADUser | None],
+    logger: Logger | LoggerAdapter,
+    result: ImportResult,
+) -> ADUser | None:
+    # name conflict detected -> add required action
+    # the action should refer to the account_name from the import file, not a previous renaming
+    if account_name != new_account_name:
+        # edge case:
+        logger.debug("Check if original name is free in the meantime...")
+        if not is_name_taken(account_name):
+            # seems that the original account name is available in the meantime
+            logger.debug(
+                "Account renaming applied for %s (%s -> %s) which gave another name conflict. "
+                "But the original account name seems to be available in the meantime.",
+                cn,
+                account_name,
+                new_account_name,
+            )
+            return retry_with_original_name()
+
+        logger.debug("No, that one is still taken.")
+        error = error or f"Account name {new_account_name} is already in use too ({conflict_cn})."
+
+    if name_resolution is None or name_resolution.is_accepted:
+        action = result.require_interaction(
+            NameAction(
+                user=cn,
+                attributes=user_attributes,
+                name=account_name,
+                input_name=new_account_name,
+                conflict_user=conflict_cn,
+                error=error,
+            )
+        )
+        logger.debug("Manual action required: %s", action)
+    return None
+
+
+# userAccountControl flag allowing an empty password
+ADS_UF_PASSWD_NOTREQD = 0x20
+
+
+def update_user_password_settings(user: ADUser, config: ImportConfig) -> bool:
+    # All changes are collected in the property cache of the user and committed with a single SetInfo,
+    # attributes already in the desired state are not written. Returns whether anything was written.
+    ads_user = user._ldap_adsi_obj
+    # The throttle retries this function after a failed SetInfo, whose changes are still in the property cache.
+    # Reload it, so every attempt compares against the directory and commits everything not yet applied.
+    ads_user.GetInfo()
+    changed = False
+
     if config.users_must_change_password:
-        user.force_pwd_change_on_login()
+        ads_user.Put("pwdLastSet", 0)
+        changed = True
+
+    changed |= set_user_cant_change_password(user, config.users_can_not_change_password)
+
+    user_account_control = ads_user.Get("userAccountControl")
+    if user_account_control & ADS_UF_PASSWD_NOTREQD:
+        ads_user.Put("userAccountControl", user_account_control & ~ADS_UF_PASSWD_NOTREQD)
+        changed = True
+
+    if changed:
+        ads_user.SetInfo()
+    return changed
+
 
-    set_user_cant_change_password(user, config.users_can_not_change_password)
+# Names of well-known trustees (e.g. "NT AUTHORITY\SELF") as they appear in ACL entries. They depend on the
+# language of the system, but never change while running, so each is looked up once per process.
+@cache
+def get_trustee_name(sid: str) -> str:
+    import win32security
 
-    user.set_user_account_control_setting("PASSWD_NOTREQD", False)
+    name, domain, _ = win32security.LookupAccountSid(None, win32security.GetBinarySid(sid))
+    # Format the same way as ACL entries (<domain>\<name>)
+    return ("%s\\%s" % (domain, name)).strip("\\")
 
 
 # Based on https://blog.steamsprocket.org.uk/2011/07/04/user-cannot-change-password-using-python/
@@ -436,30 +743,33 @@ def update_user_password_settings(user: ADUser, config: ImportConfig):
 # (This means we could technically give permission to change this users password to other users.)
 # The relevant ACL entries is selected by GUID (ObjectType) and user (Trustee)
 # We change the permission entry for the user to which the ACL belongs (self) and the all users entry (everyone).
-def set_user_cant_change_password(user: ADUser, disallow_change_password: bool):
+# The changed security descriptor is only put into the property cache of the user (if any entry had to change),
+# the caller commits it.
+def set_user_cant_change_password(user: ADUser, disallow_change_password: bool) -> bool:
     import win32security
 
     GUID_CHANGE_PASSWORD = "{ab721a53-1e2f-11d0-9819-00aa0040529b}"
     SID_SELF = "S-1-5-10"  # The user to which this ACL is attached
     SID_EVERYONE = "S-1-1-0"  # Every user on the system
 
-    selfAccount = win32security.LookupAccountSid(None, win32security.GetBinarySid(SID_SELF))
-    everyoneAccount = win32security.LookupAccountSid(None, win32security.GetBinarySid(SID_EVERYONE))
-    # Format the same way as ACL entries (<domain>\<name>)
-    selfName = ("%s\\%s" % (selfAccount[1], selfAccount[0])).strip("\\")
-    everyoneName = ("%s\\%s" % (everyoneAccount[1], everyoneAccount[0])).strip("\\")
+    trustees = {get_trustee_name(SID_SELF), get_trustee_name(SID_EVERYONE)}
+    if disallow_change_password:
+        ace_type = win32security.ACCESS_DENIED_OBJECT_ACE_TYPE
+    else:
+        ace_type = win32security.ACCESS_ALLOWED_OBJECT_ACE_TYPE
 
     user_priv = user._ldap_adsi_obj
     security_descriptor = user_priv.ntSecurityDescriptor
     acl = security_descriptor.DiscretionaryAcl
 
+    changed = False
     for entry in acl:
-        if entry.ObjectType.lower() == GUID_CHANGE_PASSWORD:
-            if entry.Trustee == selfName or entry.Trustee == everyoneName:
-                if disallow_change_password:
-                    entry.AceType = win32security.ACCESS_DENIED_OBJECT_ACE_TYPE
-                else:
-                    entry.AceType = win32security.ACCESS_ALLOWED_OBJECT_ACE_TYPE
-
-    security_descriptor.DiscretionaryAcl = acl
-    user_priv.ntSecurityDescriptor = security_descriptor
+        if entry.ObjectType.lower() == GUID_CHANGE_PASSWORD and entry.Trustee in trustees:
+            if entry.AceType != ace_type:
+                entry.AceType = ace_type
+                changed = True
+
+    if changed:
+        security_descriptor.DiscretionaryAcl = acl
+        user_priv.Put("ntSecurityDescriptor", security_descriptor)
+    return changed
@@ -1,7 +1,9 @@
+import gzip
+import hashlib
 import json
+import math
 import os
 import sys
-import time
 import webbrowser
 
 import tempfile
@@ -10,17 +12,27 @@ import pyminizip
 from datetime import datetime, timedelta
 from logging import Logger
 from pathlib import Path
-from threading import Lock
-from typing import List, Tuple
+from threading import Lock, Condition
+from typing import List, Tuple, Dict, Any, Iterable
 
+from jinja2 import Environment, FileSystemLoader, Template
 from pydantic import ValidationError
-from bottle import jinja2_template
 import bottle
+from pyad import ADUser
 
 from .import_users import import_users
 from .active_directory import CatchableADExceptions
-from .model import ResolutionList, ResolutionParser, ImportResult, Resolution, EnableResolution, InteractiveImportConfig
-from .util import format_validation_error, random_string, KillableThread, find_free_port
+from .model import (
+    ResolutionList,
+    ResolutionParser,
+    ImportResult,
+    Resolution,
+    EnableResolution,
+    InteractiveImportConfig,
+    BulkResolution,
+    Action,
+)
+from .util import format_validation_error, random_string, ServerThread, find_free_port
 
 
 def resource_path(relative_path) -> Path:
@@ -29,7 +41,7 @@ def resource_path(relative_path) -> Path:
     return Path(os.path.join(os.path.abspath("."), "templates", relative_path))
 
 
-bottle.TEMPLATE_PATH.append(resource_path(""))
+template_environment = Environment(loader=FileSystemLoader(resource_path("")), auto_reload=False)
 static_file_path = resource_path("static")
 
 
@@ -39,9 +51,23 @@ def interactive_import(
 ) -> ImportResult:
     session = InteractiveSession(config=config, logger=logger)
 
+    @bottle.hook("before_request")
+    def begin_request():
+        session.begin_request()
+
+    @bottle.hook("after_request")
+    def end_request():
+        session.end_request()
+
     @bottle.get("/static/<filepath:path>")
     def static(filepath):
-        return bottle.static_file(filepath, root=static_file_path)
+        response = bottle.static_file(filepath, root=static_file_path)
+        response.set_header("Cache-Control", "private, max-age=86400")
+        return response
+
+    @bottle.get("/assets/password-generator.json")
+    def password_generator():
+        return session.password_generator.serve()
 
     @bottle.get("/")
     def get_root():
@@ -61,8 +87,23 @@ def interactive_import(
             except ValidationError as e:
                 session.error = format_validation_error(e, source="HTTP POST Form Data")
                 return session.render_import_result()
-            session.run_import(new_resolution=new_resolution)
-            return bottle.redirect(f"/?tag={session.tag}")
+            session.run_import(new_resolutions=[new_resolution])
+            # keep the current page and filters
+            return bottle.redirect(f"/?{bottle.request.query_string}")
+
+    @bottle.post("/bulk")
+    def post_bulk():
+        session.verify_tag()
+        with session:
+            try:
+                bulk = BulkResolution.model_validate(bottle.request.json or {})
+            except ValidationError as e:
+                bottle.response.status = 400
+                return dict(error=format_validation_error(e, source="HTTP POST JSON Data"), outcomes=[])
+            new_resolutions = bulk.expand(session.action_index.actions)
+            logger.debug(f"{len(new_resolutions)} new resolution(s) via bulk POST")
+            session.run_import(new_resolutions=new_resolutions)
+            return dict(error=session.error, outcomes=session.get_outcomes(new_resolutions))
 
     @bottle.post("/export-passwords")
     def export_passwords():
@@ -86,38 +127,130 @@ def interactive_import(
 
     @bottle.get("/heartbeat")
     def beat_heart():
+        # does not acquire the session, so heartbeats are answered while an import is running
         session.verify_tag()
-        with session:  # requesting session as resource sets last request to now
-            bottle.response.content_type = "application/json"
-            return json.dumps(
-                dict(
-                    # tell the browser tab to send the next heartbeat in half timeout (as milliseconds)
-                    timeout=config.heartbeat_interval * 1000 if config.heartbeat_interval > 0 else None,
-                    # update the message if passwords have been exported
-                    set_passwords=len(session.set_passwords),
-                    unexported_passwords=session.unexported_passwords,
-                    is_active_tab=bottle.request.query.get("tab") == session.last_tab_id,
-                )
+        bottle.response.content_type = "application/json"
+        return json.dumps(
+            dict(
+                # tell the browser tab to send the next heartbeat in half timeout (as milliseconds)
+                timeout=config.heartbeat_interval * 1000 if config.heartbeat_interval > 0 else None,
+                # update the message if passwords have been exported
+                set_passwords=len(session.set_passwords),
+                unexported_passwords=session.unexported_passwords,
+                is_active_tab=bottle.request.query.get("tab") == session.last_tab_id,
             )
+        )
 
     return session.start()
 
 
+class CachedAsset:
+    # static data that is rendered once and served with ETag and gzip support, so browsers only load it once
+    content_type: str
+    body: bytes
+    gzip_body: bytes
+    etag: str
+
+    def __init__(self, data: Any, content_type: str = "application/json"):
+        self.content_type = content_type
+        self.body = json.dumps(data).encode("utf-8")
+        self.gzip_body = gzip.compress(self.body)
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+    def serve(self) -> bytes | bottle.HTTPResponse:
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": "private, max-age=86400",
+            "Vary": "Accept-Encoding",
+        }
+        if bottle.request.headers.get("If-None-Match") == self.etag:
+            return bottle.HTTPResponse(status=304, headers=headers)
+
+        bottle.response.content_type = self.content_type
+        for k, v in headers.items():
+            bottle.response.set_header(k, v)
+        if "gzip" in bottle.request.headers.get("Accept-Encoding", ""):
+            bottle.response.set_header("Content-Encoding", "gzip")
+            return self.gzip_body
+        return self.body
+
+
+class ActionIndex:
+    # pending actions sorted by user once per import_users run with lookups for the filters of the action list
+    actions: List[Action]
+    by_type: Dict[str, List[Action]]
+    by_group: Dict[str, List[Action]]
+    bulk_options: List[Dict[str, Any]]
+
+    def __init__(self, actions: Iterable[Action] = ()):
+        self.actions = sorted(actions, key=lambda a: a.user)
+        self.by_type = {}
+        self.by_group = {}
+        for action in self.actions:
+            self.by_type.setdefault(action.type, []).append(action)
+            group = getattr(action, "group", None)
+            if group is not None:
+                self.by_group.setdefault(group, []).append(action)
+        self.bulk_options = self.get_bulk_options(self.actions)
+
+    @staticmethod
+    def get_bulk_options(actions: Iterable[Action]) -> List[Dict[str, Any]]:
+        # one bulk option per action type and group (join/leave) or deleted flag (disable)
+        options: Dict[Tuple, Dict[str, Any]] = {}
+        for action in actions:
+            selector = dict(
+                type=action.type,
+                group=getattr(action, "group", None),
+                deleted=getattr(action, "deleted", None),
+            )
+            option = options.setdefault(tuple(selector.values()), dict(selector=selector, count=0))
+            option["count"] += 1
+        return list(options.values())
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    @property
+    def types(self) -> List[str]:
+        return sorted(self.by_type.keys())
+
+    @property
+    def groups(self) -> List[str]:
+        return sorted(self.by_group.keys())
+
+    def filter(self, type: str | None = None, group: str | None = None, user: str | None = None) -> List[Action]:
+        # start with the smallest pre-indexed candidate list
+        candidates = self.actions
+        if type:
+            candidates = self.by_type.get(type, [])
+        if group:
+            by_group = self.by_group.get(group, [])
+            candidates = by_group if not type else [a for a in by_group if a.type == type]
+        if user:
+            user = user.lower()
+            candidates = [a for a in candidates if user in a.user.lower()]
+        return candidates
+
+
 class InteractiveSession:
     # general
     config: InteractiveImportConfig
     logger: Logger
     tag: str
-    mutex: Lock
+    mutex: Lock  # serializes imports and rendering
+    state_changed: Condition  # guards request tracking, notified whenever a request ends
     timeout: timedelta | None  # time after which this session detects tabs as closed
-    wordlist: List[str]
+    password_generator: CachedAsset
+    template: Template
 
     # last import_users result
     error: str | None
     result: ImportResult
+    action_index: ActionIndex
     set_passwords: List[Tuple[str, str]]
 
     # runtime state
+    pending_requests: int
     last_request: datetime | None
     last_tab_id: str | None
     current_result_rendered: bool
@@ -129,13 +262,16 @@ class InteractiveSession:
         self.logger = logger
         self.tag = random_string(6)
         self.mutex = Lock()
+        self.state_changed = Condition()
         self.timeout = None
         if self.config.heartbeat_interval > 0:
             self.timeout = timedelta(seconds=self.config.heartbeat_interval * 1.5)
 
         self.error = None
         self.result = ImportResult()
+        self.action_index = ActionIndex()
         self.set_passwords = []
+        self.pending_requests = 0
         self.last_request = None
         self.last_tab_id = None
         self.current_result_rendered = True
@@ -143,7 +279,15 @@ class InteractiveSession:
         self.port = find_free_port() if self.config.port is None else self.config.port
 
         with open(config.password_wordlist, "r") as f:
-            self.wordlist = list(filter(lambda w: len(w) > 0, map(str.strip, f.readlines())))
+            wordlist = list(filter(lambda w: len(w) > 0, map(str.strip, f.readlines())))
+        self.password_generator = CachedAsset(
+            dict(
+                wordlist=wordlist,
+                word_count=self.config.password_word_count or 5,
+                suffix=self.config.password_suffix or "",
+            )
+        )
+        self.template = template_environment.get_template("resolve.html.jinja")
 
     @property
     def unexported_passwords(self) -> int:
@@ -163,22 +307,45 @@ class InteractiveSession:
         return res
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.last_request = datetime.now()
         self.mutex.__exit__(exc_type, exc_value, traceback)
 
+    def begin_request(self) -> None:
+        with self.state_changed:
+            self.pending_requests += 1
+
+    def end_request(self) -> None:
+        with self.state_changed:
+            self.pending_requests -= 1
+            self.last_request = datetime.now()
+            self.state_changed.notify_all()
+
     def has_open_browser_tabs(self) -> bool:
-        if self.last_request is None or self.timeout is None:
-            return True
-        with self.mutex:
+        # a pending request (e.g. a long import) counts as an open tab, its page sends no heartbeats meanwhile
+        with self.state_changed:
+            if self.pending_requests > 0 or self.last_request is None or self.timeout is None:
+                return True
             return datetime.now() - self.last_request <= self.timeout
 
+    def wait_for_state_change(self, max_wait: float = 1.0) -> None:
+        # Wake up when a request ends or open tabs would time out.
+        # Waiting is capped, because a blocking wait can not be interrupted by ctrl-c on Windows.
+        with self.state_changed:
+            wait = max_wait
+            if self.pending_requests == 0 and self.last_request is not None and self.timeout is not None:
+                remaining = (self.last_request + self.timeout - datetime.now()).total_seconds()
+                if remaining >= 0:
+                    wait = min(remaining + 0.01, max_wait)
+            self.state_changed.wait(wait)
+
     def verify_tag(self):
         if bottle.request.query.get("tag") != self.tag:
             bottle.abort(401)
 
-    def run_import(self, new_resolution: Resolution | None = None) -> None:
+    def run_import(self, new_resolutions: Iterable[Resolution] = ()) -> None:
+        # all new resolutions are applied in a single import_users run and persisted at once
+        new_resolutions = list(new_resolutions)
         resolutions = ResolutionList.load(file=self.config.resolutions_file, logger=self.logger, save_default=True)
-        if new_resolution is not None:
+        for new_resolution in new_resolutions:
             resolutions.append(new_resolution)
         try:
             self.result.update(
@@ -188,6 +355,7 @@ class InteractiveSession:
                     logger=self.logger.getChild("import"),
                 )
             )
+            self.action_index = ActionIndex(self.result.required_interactions)
             self.error = None
             self.current_result_rendered = False
         except CatchableADExceptions as e:
@@ -196,73 +364,104 @@ class InteractiveSession:
             self.current_result_rendered = False
             return
 
-        # handle persistence of new_resolution
-        if new_resolution is not None:
-            if new_resolution.is_rejected:
-                # save rejections to file
-                if self.config.resolutions_file is not None:
-                    resolutions.get_rejected().save(self.config.resolutions_file)
-            elif isinstance(new_resolution, EnableResolution):
+        # save rejections to file
+        if any(map(lambda r: r.is_rejected, new_resolutions)) and self.config.resolutions_file is not None:
+            resolutions.get_rejected().save(self.config.resolutions_file)
+
+        for new_resolution in new_resolutions:
+            if isinstance(new_resolution, EnableResolution) and new_resolution.is_accepted:
                 # remember newly set password in state if it was actually set
-                enabled_user = next(filter(lambda u: u.cn == new_resolution.user, self.result.enabled), None)
-                if enabled_user is not None:
+                enabled_record = next(filter(lambda u: u.cn == new_resolution.user, self.result.enabled), None)
+                if enabled_record is not None:
+                    # results only keep the dn, the account name is read from the directory
+                    options = {"server": self.config.ldap_server} if self.config.ldap_server is not None else {}
+                    enabled_user = ADUser.from_dn(enabled_record.dn, options=options)
                     account_name_attributes = enabled_user.get_attribute("sAMAccountName")
                     account_name = enabled_user.cn if len(account_name_attributes) != 1 else account_name_attributes[0]
                     self.set_passwords.append((account_name, new_resolution.password))
 
+    def get_outcomes(self, resolutions: Iterable[Resolution]) -> List[Dict[str, Any]]:
+        # report per resolution whether it was applied by the last import_users run
+        outcomes = []
+        for resolution in resolutions:
+            pending: Action | None = next(filter(resolution.matches, self.action_index.actions), None)
+            outcome = dict(resolution=resolution.model_dump(mode="json", exclude={"timestamp"}), error=None)
+            if self.error is not None:
+                outcome.update(outcome="failed", error=self.error)
+            elif resolution.is_rejected:
+                outcome.update(outcome="rejected")
+            elif pending is not None:
+                outcome.update(outcome="pending", error=pending.error)
+            else:
+                outcome.update(outcome="applied")
+            outcomes.append(outcome)
+        return outcomes
+
     def render_import_result(self) -> str:
         self.last_tab_id = random_string(6)
         self.current_result_rendered = True
-        actions = self.result.required_interactions if self.result else []
-        actions.sort(key=lambda a: a.user)
-        return jinja2_template(
-            "resolve.html.jinja",
-            actions=actions,
+
+        query = bottle.request.query
+        filters = dict(
+            type=query.get("type") or None,
+            group=query.get("group") or None,
+            user=query.get("user") or None,
+        )
+        actions = self.action_index.filter(**filters)
+
+        page_size = self.config.page_size
+        page_count = max(1, math.ceil(len(actions) / page_size))
+        try:
+            page = min(max(1, int(query.get("page", 1))), page_count)
+        except ValueError:
+            page = 1
+
+        return self.template.render(
+            actions=actions[(page - 1) * page_size : page * page_size],
+            action_count=len(self.action_index),
+            filtered_action_count=len(actions),
+            action_types=self.action_index.types,
+            action_groups=self.action_index.groups,
+            bulk_options=self.action_index.bulk_options,
+            filters=filters,
+            page_query=dict(tag=self.tag, **{k: v for k, v in filters.items() if v is not None}),
+            page=page,
+            page_count=page_count,
+            first_action_id=(page - 1) * page_size,
             password_count=len(self.set_passwords),
-            password_word_count=self.config.password_word_count,
-            password_suffix=self.config.password_suffix,
             tag=self.tag,
             tab_id=self.last_tab_id,
             error=self.error,
-            wordlist=json.dumps(self.wordlist),
         )
 
     def start(self) -> ImportResult:
-        # start the bottle thread
-        bottle_thread = KillableThread(
-            target=bottle.run,
-            kwargs=dict(
-                host="localhost",
-                port=self.port,
-                quiet=True,
-            ),
-        )
-        bottle_thread.start()
+        # start the server thread
+        server_thread = ServerThread(app=bottle.default_app(), host="localhost", port=self.port)
+        server_thread.start()
 
         self.logger.info(f"Session started: {self.url}")
         webbrowser.open(self.url)
 
         # watch out for terminating events in the main thread
-        self._wait_for_terminating_events(bottle_thread)
-        bottle_thread.terminate()
-        bottle_thread.join(timeout=5)
+        self._wait_for_terminating_events(server_thread)
+        server_thread.shutdown(timeout=5)
         self.logger.info("Session ended")
         return self.result
 
     def _wait_for_terminating_events(
         self,
-        bottle_thread: KillableThread,
+        server_thread: ServerThread,
         terminated_once_while_unexported: bool = False,
         tabs_closed_detected: bool = False,
     ) -> None:
         try:
             while 1:
-                if not bottle_thread.is_alive():
+                if not server_thread.is_alive():
                     # the server thread should not end by itself. This is just for good measure
-                    self.logger.error("bottle server was stopped somehow")
+                    self.logger.error("server was stopped somehow")
                     return
 
-                if self.has_open_browser_tabs():  # has_open_browser_tabs() blocks while there are pending requests
+                if self.has_open_browser_tabs():
                     tabs_closed_detected = False
                 else:
                     if not tabs_closed_detected:
@@ -281,7 +480,7 @@ class InteractiveSession:
 
                 if not self.has_unexported_passwords:
                     terminated_once_while_unexported = False
-                time.sleep(0.5)
+                self.wait_for_state_change()
         except KeyboardInterrupt:
             self.logger.debug("Received keyboard interrupt")
             if self.has_unexported_passwords and not terminated_once_while_unexported:
@@ -290,7 +489,7 @@ class InteractiveSession:
                     f"Open {self.url} to export passwords or ctrl-c again to terminate."
                 )
                 self._wait_for_terminating_events(
-                    bottle_thread=bottle_thread,
+                    server_thread=server_thread,
                     terminated_once_while_unexported=True,
                     tabs_closed_detected=tabs_closed_detected,
                 )
@@ -1,5 +1,87 @@
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from typing import Any, Dict, List, Tuple
+
+
+class DeferredQueueHandler(QueueHandler):
+    # Hands records to the listener thread as they are, so messages are only formatted (`msg % args`) by the
+    # listener and the logging thread never waits for file or event log I/O.
+    # Records never leave the process, so unlike `QueueHandler.prepare` nothing has to be made picklable.
+    # The arguments are formatted later on another thread, so only plain values (str, numbers) should be passed,
+    # never pyad (COM) objects.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    # Lets at most `max_records` records of the same kind (logger, level and message template) pass per `interval`
+    # seconds. The number of dropped records is added to the first record passing in the next interval.
+    def __init__(self, max_records: int, interval: float):
+        super().__init__()
+        self.max_records = max_records
+        self.interval = interval
+        self.windows: Dict[Tuple[str, int, str], List[float | int]] = {}  # key -> [start, passed, dropped]
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        with self.lock:
+            window = self.windows.get(key)
+            if window is not None and record.created - window[0] < self.interval:
+                if window[1] >= self.max_records:
+                    window[2] += 1
+                    return False
+                window[1] += 1
+                return True
+            dropped = window[2] if window is not None else 0
+            self.windows[key] = [record.created, 1, 0]
+            if len(self.windows) > 10000:
+                self._prune(record.created)
+        if dropped > 0:
+            self._annotate(record, dropped)
+        return True
+
+    def _prune(self, now: float) -> None:
+        # forget expired windows (e.g. of messages that were formatted before logging) unless they dropped records
+        for key, window in list(self.windows.items()):
+            if now - window[0] >= self.interval and window[2] == 0:
+                del self.windows[key]
+
+    @staticmethod
+    def _annotate(record: logging.LogRecord, dropped: int) -> None:
+        record.suppressed = dropped
+        if not record.args:
+            record.msg = f"{record.msg} ({dropped} similar message(s) suppressed)"
+        elif isinstance(record.args, tuple):
+            record.msg = f"{record.msg} (%d similar message(s) suppressed)"
+            record.args = (*record.args, dropped)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    # One JSON object per record, including the structured fields passed as `extra` (see `STRUCTURED_FIELDS`).
+    STRUCTURED_FIELDS = ("user", "group", "phase", "operation", "duration", "suppressed")
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = dict(
+            time=datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            level=record.levelname,
+            logger=record.name,
+            message=record.getMessage(),
+        )
+        for field in self.STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
 
 
 class Logger:
@@ -11,6 +93,9 @@ class Logger:
         fmt="%(name)s: %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
+    log_json_format = JsonLinesFormatter()
+
+    listener: QueueListener | None = None
 
     @classmethod
     def init(cls, name):
@@ -35,20 +120,54 @@ class Logger:
         level = logging.getLevelNamesMapping()[config.log_level]
         logger.setLevel(level)
 
-        if config.log_file is not None or config.log_windows:
-            # Remove stdio handler if any other is specified
-            for handler in logger.handlers:
-                logger.removeHandler(handler)
+        log_format = cls.log_json_format if config.log_format == "JSON" else cls.log_file_format
+
+        # detach the current handlers, writing all records queued so far with the previous settings
+        current = list(cls.listener.handlers) if cls.listener is not None else list(logger.handlers)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        cls.stop()
+
+        # the handlers doing the actual I/O, run by the listener thread
+        handlers = []
+        if config.log_file is None and not config.log_windows:
+            # keep writing to stderr if no other handler is specified
+            handlers = [handler for handler in current if type(handler) is logging.StreamHandler]
+            for handler in handlers:
+                handler.setFormatter(log_format)
 
         if config.log_file is not None:
             log_handler = RotatingFileHandler(config.log_file, maxBytes=config.log_max_bytes, backupCount=config.log_backup_count)
-            log_handler.setFormatter(cls.log_file_format)
-            logger.addHandler(log_handler)
+            log_handler.setFormatter(log_format)
+            handlers.append(log_handler)
 
         if config.log_windows:
             log_handler = logging.handlers.NTEventLogHandler("AD User Sync")
             log_handler.setFormatter(cls.log_windows_format)
-            logger.addHandler(log_handler)
+            handlers.append(log_handler)
+
+        for handler in current:
+            if handler not in handlers:
+                handler.close()
+
+        # loggers only put records into the queue, formatting and writing happens on the listener thread
+        log_queue = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        if config.log_rate_limit is not None:
+            queue_handler.addFilter(RateLimitFilter(config.log_rate_limit, config.log_rate_limit_interval))
+        logger.addHandler(queue_handler)
+
+        cls.listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        cls.listener.start()
+        atexit.unregister(cls.stop)
+        atexit.register(cls.stop)
+
+    @classmethod
+    def stop(cls):
+        # writes all queued records, called at exit
+        if cls.listener is not None:
+            cls.listener.stop()
+            cls.listener = None
 
     @classmethod
     def get(cls):
@@ -0,0 +1,78 @@
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .model import ObjectRecord
+from .util import not_none
+
+
+# Desired group memberships of the imported users as a user × group bit matrix. Users are numbered in the order they
+# are added, each managed group holds an int with the bits of its desired members set, so the members to add or
+# remove are found with a few operations on these ints instead of sets of user objects. Users are plain records
+# and looked up by dn, so no COM objects are held.
+# Users with the same memberOf (a signature) are mapped to the managed groups once, the bits of all users of a
+# signature are set in one bitset which is then merged into each of its groups.
+class MembershipMatrix:
+    def __init__(self, group_map: Dict[str, Set[str]]):
+        self.group_map = group_map  # source group -> target group dns, "*" for all users
+        self.groups: List[str] = sorted(set().union(*group_map.values()))
+        self.group_indexes = {dn: i for i, dn in enumerate(self.groups)}
+        self.users: List[ObjectRecord] = []
+        self.user_indexes: Dict[str, int] = {}  # by lower case dn
+        self.signatures: Dict[Tuple[str, ...], Tuple[int, ...]] = {}  # memberOf -> indexes of the mapped groups
+        self.users_by_signature: Dict[Tuple[str, ...], List[int]] = {}
+        self.desired: List[int] | None = None  # bitset of each group, built on first use
+
+    def add(self, user: ObjectRecord, member_of: Tuple[str, ...]) -> None:
+        index = self.user_indexes.get(user.key)
+        if index is None:
+            index = len(self.users)
+            self.users.append(user)
+            self.user_indexes[user.key] = index
+        if member_of not in self.signatures:
+            self.signatures[member_of] = self._map_groups(member_of)
+        self.users_by_signature.setdefault(member_of, []).append(index)
+        self.desired = None
+
+    def _map_groups(self, member_of: Tuple[str, ...]) -> Tuple[int, ...]:
+        # "*" maps the catch-all group, groups without a mapping (None) are dropped
+        dns = set().union(*filter(not_none, map(self.group_map.get, (*member_of, "*"))))
+        return tuple(sorted(self.group_indexes[dn] for dn in dns))
+
+    def __contains__(self, dn: str) -> bool:
+        return dn.lower() in self.user_indexes
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def get_desired(self, group: int) -> int:
+        # bitset of the users that should be members of the group (by index in `groups`)
+        if self.desired is None:
+            desired = [0] * len(self.groups)
+            for signature, indexes in self.users_by_signature.items():
+                groups = self.signatures[signature]
+                if len(groups) > 0:
+                    bits = self._to_bits(indexes)
+                    for g in groups:
+                        desired[g] |= bits
+            self.desired = desired
+        return self.desired[group]
+
+    def get_bits(self, dns: Iterable[str]) -> int:
+        # bitset of the given users, users that were not added (e.g. unmanaged members of a group) are left out
+        return self._to_bits(filter(not_none, map(lambda dn: self.user_indexes.get(dn.lower()), dns)))
+
+    def get_users(self, bits: int) -> List[ObjectRecord]:
+        # users of a bitset, in the order they were added
+        users = []
+        for offset, byte in enumerate(bits.to_bytes((bits.bit_length() + 7) // 8, "little")):
+            if byte:
+                for bit in range(8):
+                    if byte >> bit & 1:
+                        users.append(self.users[offset * 8 + bit])
+        return users
+
+    def _to_bits(self, indexes: Iterable[int]) -> int:
+        # the bits are set in a bytearray, setting them one by one in an int would copy it for every bit
+        data = bytearray((len(self.users) + 7) // 8)
+        for index in indexes:
+            data[index >> 3] |= 1 << (index & 7)
+        return int.from_bytes(data, "little")
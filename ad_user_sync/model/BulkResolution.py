@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Annotated, List, Literal, Iterable
+
+from pydantic import BaseModel, Field, model_validator
+
+from .Action import Action
+from .Resolution import Resolution, ResolutionParser
+
+
+class ResolutionSelector(BaseModel):
+    """
+    Resolves every pending action matching the given criteria at once,
+    e.g. "accept all joins for CN=p-Operators" or "reject all disables of deleted users".
+    """
+
+    type: Literal["enable", "disable", "join", "leave", "name"]
+    accept: bool
+    user: Annotated[str | None, Field(default=None)]
+    group: Annotated[str | None, Field(default=None)]
+    deleted: Annotated[bool | None, Field(default=None)]
+
+    @model_validator(mode="after")
+    def check_acceptable(self) -> ResolutionSelector:
+        # accepting these types requires individual input (password or new account name)
+        if self.accept and self.type in ("enable", "name"):
+            raise ValueError(f"{self.type} actions can not be accepted in bulk")
+        return self
+
+    def matches(self, action: Action) -> bool:
+        if action.type != self.type:
+            return False
+        if self.user is not None and action.user != self.user:
+            return False
+        if self.group is not None and getattr(action, "group", None) != self.group:
+            return False
+        if self.deleted is not None and getattr(action, "deleted", None) != self.deleted:
+            return False
+        return True
+
+    def resolve(self, action: Action) -> Resolution:
+        return ResolutionParser.validate_python(
+            action.model_dump(include={"type", "user", "group", "name"}) | dict(accept=self.accept)
+        )
+
+
+class BulkResolution(BaseModel):
+    resolutions: Annotated[List[Resolution], Field(default_factory=list)]
+    selectors: Annotated[List[ResolutionSelector], Field(default_factory=list)]
+
+    def expand(self, actions: Iterable[Action]) -> List[Resolution]:
+        # explicit resolutions first, then one resolution per pending action matched by any selector
+        resolutions = list(self.resolutions)
+        for action in actions:
+            selector = next(filter(lambda s: s.matches(action), self.selectors), None)
+            if selector is not None and not any(map(lambda r: r.matches(action), resolutions)):
+                resolutions.append(selector.resolve(action))
+        return resolutions
@@ -0,0 +1,47 @@
+from textwrap import dedent
+from typing import Annotated
+
+from pydantic import BaseModel, Field
+
+
+class CacheConfig(BaseModel):
+    max_entries: Annotated[
+        int,
+        Field(
+            default=10000,
+            gt=0,
+            title="Maximum Entries",
+            description="Number of cached lookups (users, groups, containers, memberships). The least recently used ones are dropped first.",
+        ),
+    ]
+
+    ttl: Annotated[
+        float,
+        Field(
+            default=900,
+            gt=0,
+            title="Time to Live",
+            description=dedent("""
+                Seconds a lookup result is cached. Changes made by the import itself are applied to the cache directly,
+                so this only limits how long changes made by others go unnoticed by a long running session.
+            """),
+        ),
+    ]
+
+    negative_ttl: Annotated[
+        float,
+        Field(
+            default=60,
+            ge=0,
+            title="Negative Time to Live",
+            description="Seconds a lookup that found nothing (e.g. no user with a name) is cached.",
+        ),
+    ]
+
+
+class CacheStats(BaseModel):
+    hits: Annotated[int, Field(default=0)]
+    misses: Annotated[int, Field(default=0)]
+    evictions: Annotated[int, Field(default=0)]  # dropped because of `max_entries`
+    expirations: Annotated[int, Field(default=0)]  # dropped because of `ttl` or `negative_ttl`
+    size: Annotated[int, Field(default=0)]
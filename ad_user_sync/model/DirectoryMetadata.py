@@ -0,0 +1,26 @@
+from typing import Annotated, Dict
+
+from pydantic import BaseModel, Field
+
+from .FileBaseModel import FileBaseModel
+
+
+class GroupMetadata(BaseModel):
+    dn: str
+    cn: str
+    guid: str
+    sid: str
+    usn_changed: int
+
+
+class DomainMetadata(BaseModel):
+    dn: str
+    default_upn: str
+    usn_changed: int
+
+
+# Directory objects referenced by the config, persisted between runs.
+# Entries are revalidated against uSNChanged of the directory objects before they are used.
+class DirectoryMetadata(FileBaseModel):
+    groups: Annotated[Dict[str, GroupMetadata], Field(default_factory=dict)]  # by lower case configured dn
+    domains: Annotated[Dict[str, DomainMetadata], Field(default_factory=dict)]  # by lower case domain dn
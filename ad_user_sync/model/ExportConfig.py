@@ -1,10 +1,11 @@
 from pathlib import Path
 from textwrap import dedent
-from typing import Annotated, List, Set
+from typing import Annotated, List, Literal, Set
 
 from pydantic import Field
 
 from .FileBaseModel import FileBaseModel
+from .ThrottleConfig import ThrottleConfig
 
 
 class ExportConfig(FileBaseModel):
@@ -56,6 +57,83 @@ class ExportConfig(FileBaseModel):
         ),
     ]
 
+    nested_groups: Annotated[
+        bool,
+        Field(
+            default=False,
+            title="Nested Group Membership",
+            description=dedent("""
+                If enabled, users that are members of a search group through nested groups are exported as well.
+                Their `memberOf` lists all search groups they are a direct or indirect member of.
+                Membership is resolved by the domain controller (`LDAP_MATCHING_RULE_IN_CHAIN`), which can be slow for deeply nested groups.
+                If disabled, only direct memberships are considered.
+            """),
+        ),
+    ]
+
+    query_strategy: Annotated[
+        Literal["auto", "filter", "members"],
+        Field(
+            default="auto",
+            title="Query Strategy",
+            description=dedent("""
+                How the users of the search groups are found.
+                `filter`: A single query for users with a `memberOf` value of any search group. Works best for few search groups.
+                `members`: The member lists of all search groups are read and the attributes of these users are fetched in batches. Works best for many search groups.
+                `auto`: Uses `members` if there are more than `query_strategy_group_threshold` search groups, `filter` otherwise.
+                If the search groups have more members than `query_strategy_max_members`, `auto` reads all users in `user_path` instead of fetching them in batches.
+            """),
+        ),
+    ]
+
+    query_strategy_group_threshold: Annotated[
+        int,
+        Field(
+            default=20,
+            gt=0,
+            title="Query Strategy Group Threshold",
+            description="Number of search groups above which the `auto` query strategy reads the member lists of the groups.",
+        ),
+    ]
+
+    query_strategy_max_members: Annotated[
+        int,
+        Field(
+            default=50000,
+            gt=0,
+            title="Query Strategy Maximum Members",
+            description=dedent("""
+                Number of search group members above which the `auto` query strategy reads all users in `user_path` at once
+                instead of fetching the members in batches.
+            """),
+        ),
+    ]
+
+    shard_by: Annotated[
+        Literal["none", "ou", "group"],
+        Field(
+            default="none",
+            title="Shard By",
+            description=dedent("""
+                Splits the export into several smaller queries (shards) that are run concurrently.
+                `ou`: One shard per organizational unit or container directly below `user_path`, plus one for the users directly in `user_path`.
+                `group`: One shard per search group.
+                `none`: A single query.
+                Users found by several shards are exported once, the output is sorted by distinguished name.
+            """),
+        ),
+    ]
+
+    max_parallel_queries: Annotated[
+        int,
+        Field(
+            default=4,
+            gt=0,
+            title="Maximum Parallel Queries",
+            description="Number of shards that are queried at the same time. Each one keeps a connection to the domain controller busy.",
+        ),
+    ]
+
     attributes: Annotated[
         Set[str],
         Field(
@@ -69,6 +147,49 @@ class ExportConfig(FileBaseModel):
         ),
     ]
 
+    sub_paths: Annotated[
+        bool,
+        Field(
+            default=False,
+            title="Export Sub Paths",
+            description=dedent("""
+                If enabled, the location of each user relative to `user_path` is exported as `subPath` (e.g. `OU=Sales,OU=Europe`, empty for users directly in `user_path`).
+                An import with `sub_paths` enabled recreates this structure below its `managed_user_path`.
+            """),
+        ),
+    ]
+
+    ranged_attributes: Annotated[
+        Set[str],
+        Field(
+            title="Ranged Attributes",
+            default_factory=set,
+            description=dedent("""
+                Multi valued attributes of `attributes` that may have more values than the domain controller returns
+                at once (its MaxValRange, 1500 by default), e.g. `proxyAddresses`. Such values may be returned empty
+                by the export query, so users with an empty value are read again range by range.
+                Values returned as a range (truncated) and empty `memberOf` values of users found by a search
+                group filter are always read again.
+            """),
+            examples=[["proxyAddresses"]],
+        ),
+    ]
+
+    throttle: Annotated[
+        ThrottleConfig,
+        Field(
+            default_factory=ThrottleConfig,
+            title="Throttling",
+            description=dedent("""
+                Limits the load put on the domain controller and retries operations failing with transient errors.
+                `reads_per_second`, `writes_per_second`: rate limits (unlimited if not set).
+                `max_retries`, `retry_base_delay`, `retry_max_delay`: exponential backoff for busy, unavailable or timeout errors.
+                `max_concurrency`, `target_latency`: concurrent operations, reduced while the domain controller is slow.
+            """),
+            examples=[{"reads_per_second": 50, "writes_per_second": 10, "max_retries": 5}],
+        ),
+    ]
+
     hmac: Annotated[
         str | None,
         Field(
@@ -7,6 +7,9 @@ from typing import Annotated, Dict, List
 from pydantic import Field, BeforeValidator
 
 from .FileBaseModel import FileBaseModel
+from .ThrottleConfig import ThrottleConfig
+from .CacheConfig import CacheConfig
+from .NameIndexConfig import NameIndexConfig
 from ..util import ensure_list_values
 
 
@@ -19,6 +22,11 @@ class LogLevel(StrEnum):
     DEBUG = "DEBUG"
 
 
+class LogFormat(StrEnum):
+    TEXT = "TEXT"
+    JSON = "JSON"
+
+
 class ImportConfig(FileBaseModel):
     input_file: Annotated[
         Path,
@@ -107,6 +115,33 @@ class ImportConfig(FileBaseModel):
         ),
     ]
 
+    sub_paths: Annotated[
+        bool,
+        Field(
+            default=False,
+            title="Use Sub Paths",
+            description=dedent("""
+                If enabled, users are placed into organizational units below `managed_user_path` according to their exported `subPath` (see `sub_paths` of the export).
+                Missing organizational units are created, containers (`CN=`) of the source domain become organizational units as well.
+                Each organizational unit is a partition of its own: it is synced and checked for orphaned accounts separately, up to `max_parallel_partitions` at a time.
+                If disabled, all users are placed directly into `managed_user_path` and `subPath` is ignored.
+            """),
+        ),
+    ]
+
+    max_parallel_partitions: Annotated[
+        int,
+        Field(
+            default=1,
+            gt=0,
+            title="Maximum Parallel Partitions",
+            description=dedent("""
+                Number of partitions (see `sub_paths`) that are synced at the same time.
+                Each one keeps a connection to the domain controller busy, the throttle limits apply to all of them together.
+            """),
+        ),
+    ]
+
     expiration_time: Annotated[
         timedelta,
         Field(
@@ -159,6 +194,79 @@ class ImportConfig(FileBaseModel):
         ),
     ]
 
+    metadata_cache_file: Annotated[
+        Path | None,
+        Field(
+            default=None,
+            title="Directory Metadata Cache",
+            description=dedent("""
+                A file to persist metadata of the configured groups (GUID, SID) and the domain UPN suffix between runs.
+                Cached entries are revalidated using `uSNChanged`. It allows to report renamed groups by their new name.
+                If not set, metadata is only cached for the duration of a run.
+            """),
+            examples=["directory_metadata.json"],
+        ),
+    ]
+
+    ldap_server: Annotated[
+        str | None,
+        Field(
+            default=None,
+            title="LDAP Server",
+            description=dedent("""
+                Host name of the domain controller to connect to.
+                If not set, a domain controller of the domain in `managed_user_path` is located automatically.
+                Useful to import into domains the computer running the import is not a member of.
+            """),
+            examples=["dc01.ad.company.com"],
+        ),
+    ]
+
+    throttle: Annotated[
+        ThrottleConfig,
+        Field(
+            default_factory=ThrottleConfig,
+            title="Throttling",
+            description=dedent("""
+                Limits the load put on the domain controller and retries operations failing with transient errors.
+                `reads_per_second`, `writes_per_second`: rate limits (unlimited if not set).
+                `max_retries`, `retry_base_delay`, `retry_max_delay`: exponential backoff for busy, unavailable or timeout errors.
+                `max_concurrency`, `target_latency`: concurrent operations, reduced while the domain controller is slow.
+            """),
+            examples=[{"reads_per_second": 50, "writes_per_second": 10, "max_retries": 5}],
+        ),
+    ]
+
+    cache: Annotated[
+        CacheConfig,
+        Field(
+            default_factory=CacheConfig,
+            title="Directory Cache",
+            description=dedent("""
+                Limits the lookups of users, groups and memberships cached during a session.
+                `max_entries`: number of cached lookups.
+                `ttl`, `negative_ttl`: seconds found and not found results are kept.
+            """),
+            examples=[{"max_entries": 10000, "ttl": 900, "negative_ttl": 60}],
+        ),
+    ]
+
+    name_index: Annotated[
+        NameIndexConfig,
+        Field(
+            default_factory=NameIndexConfig,
+            title="Name Index",
+            description=dedent("""
+                Index of the account names, user principal names and names in the domain, used to detect name
+                conflicts of new users before creating them.
+                `enabled`: set to false to only find conflicts after a create failed.
+                `global_catalog`: read the index from the Global Catalog.
+                `max_age`: seconds after which the index is rebuilt instead of refreshed.
+            """),
+            examples=[{"enabled": True, "global_catalog": False, "max_age": 3600}],
+        ),
+    ]
+
     hmac: Annotated[
         str | None,
         Field(
@@ -228,6 +336,41 @@ class ImportConfig(FileBaseModel):
             examples=[10],
         ),
     ]
+    log_format: Annotated[
+        LogFormat,
+        Field(
+            default=LogFormat.TEXT,
+            title="Log Format",
+            description=dedent("""
+                Format of the messages written to `stderr` or the log file. `JSON` writes one JSON object per line
+                with the structured fields of a message (e.g. `user`, `group`, `phase`, `operation`, `duration`).
+            """),
+            examples=["JSON"],
+        ),
+    ]
+    log_rate_limit: Annotated[
+        int | None,
+        Field(
+            default=None,
+            gt=0,
+            title="Log Rate Limit",
+            description=dedent("""
+                Maximum number of messages of the same kind (same logger, level and message template) written per
+                `log_rate_limit_interval`. Further ones are dropped and counted in the next message of that kind
+                that is written. Errors are never dropped. Unlimited if not set.
+            """),
+            examples=[100],
+        ),
+    ]
+    log_rate_limit_interval: Annotated[
+        float,
+        Field(
+            default=60,
+            gt=0,
+            title="Log Rate Limit Interval",
+            description="Length in seconds of the interval `log_rate_limit` applies to.",
+        ),
+    ]
 
 class InteractiveImportConfig(ImportConfig):
     port: Annotated[
@@ -266,6 +409,17 @@ class InteractiveImportConfig(ImportConfig):
         ),
     ]
 
+    page_size: Annotated[
+        int,
+        Field(
+            default=50,
+            title="Page Size",
+            description="Number of required interactions shown per page of the interactive session.",
+            examples=[50],
+            gt=0,
+        ),
+    ]
+
     password_wordlist: Annotated[
         Path,
         Field(
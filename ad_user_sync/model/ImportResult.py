@@ -1,31 +1,80 @@
 from __future__ import annotations
 
+import sys
 from logging import Logger
-from typing import List, Set, Tuple, Dict, Annotated
+from typing import List, Set, Tuple, Dict, Annotated, Any, Callable, TYPE_CHECKING
 
-from pyad import ADUser, ADGroup
 from pydantic import BaseModel, Field, field_serializer, ConfigDict
 
 from .Action import Action
+from .ThrottleConfig import ThrottleStats
+from .CacheConfig import CacheStats
+from .UserRecord import InvalidUserRecord
+
+if TYPE_CHECKING:
+    from pyad import ADObject
+
+
+class ObjectRecord:
+    # Compact stand-in for a user or group in a result. Unlike the pyad objects it holds no COM object,
+    # its strings are interned, so the same group recorded for thousands of joins is stored once.
+    __slots__ = ("dn", "cn", "key")
+
+    def __init__(self, dn: str, cn: str):
+        self.dn = sys.intern(dn)
+        self.cn = sys.intern(cn)
+        self.key = sys.intern(dn.lower())
+
+    @classmethod
+    def of(cls, o: ADObject | ObjectRecord) -> ObjectRecord:
+        return o if isinstance(o, ObjectRecord) else cls(o.dn, o.cn)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ObjectRecord) and self.key == other.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __repr__(self) -> str:
+        return f"<ObjectRecord {self.dn}>"
+
+
+class ImportSummary(BaseModel):
+    created: Annotated[int, Field(default=0)]
+    updated: Annotated[int, Field(default=0)]
+    enabled: Annotated[int, Field(default=0)]
+    disabled: Annotated[int, Field(default=0)]
+    joined: Annotated[int, Field(default=0)]
+    left: Annotated[int, Field(default=0)]
+    required_interactions: Annotated[int, Field(default=0)]
+    invalid_records: Annotated[int, Field(default=0)]
+    directory_stats: Annotated[ThrottleStats | None, Field(default=None)]
+    cache_stats: Annotated[CacheStats | None, Field(default=None)]
 
 
 class ImportResult(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
-    enabled: Annotated[Set[ADUser], Field(default_factory=set)]
-    created: Annotated[Set[ADUser], Field(default_factory=set)]
-    updated: Annotated[Set[ADUser], Field(default_factory=set)]
-    disabled: Annotated[Set[ADUser], Field(default_factory=set)]
-    joined: Annotated[Set[Tuple[ADUser, ADGroup]], Field(default_factory=set)]
-    left: Annotated[Set[Tuple[ADUser, ADGroup]], Field(default_factory=set)]
+    enabled: Annotated[Set[ObjectRecord], Field(default_factory=set)]
+    created: Annotated[Set[ObjectRecord], Field(default_factory=set)]
+    updated: Annotated[Set[ObjectRecord], Field(default_factory=set)]
+    disabled: Annotated[Set[ObjectRecord], Field(default_factory=set)]
+    joined: Annotated[Set[Tuple[ObjectRecord, ObjectRecord]], Field(default_factory=set)]
+    left: Annotated[Set[Tuple[ObjectRecord, ObjectRecord]], Field(default_factory=set)]
     required_interactions: Annotated[List[Action], Field(default_factory=list)]
+    invalid_records: Annotated[List[InvalidUserRecord], Field(default_factory=list)]  # skipped users of the last run
+    directory_stats: Annotated[ThrottleStats | None, Field(default=None)]  # throttling and retries of the last run
+    cache_stats: Annotated[CacheStats | None, Field(default=None)]  # cached lookups of the session of the last run
+
+    # called with every change as it is recorded (e.g. to write an NDJSON event stream), not part of the output
+    on_event: Annotated[Callable[[Dict[str, Any]], None] | None, Field(default=None, exclude=True)]
 
     @field_serializer("enabled", "created", "updated", "disabled")
-    def serialize_user_set(self, users: Set[ADUser]) -> List[str]:
+    def serialize_user_set(self, users: Set[ObjectRecord]) -> List[str]:
         return sorted(map(lambda u: u.cn, users))
 
     @field_serializer("joined", "left")
-    def serialize_user_group_set(self, user_groups: Set[Tuple[ADUser, ADGroup]]) -> List[Dict[str, str]]:
+    def serialize_user_group_set(self, user_groups: Set[Tuple[ObjectRecord, ObjectRecord]]) -> List[Dict[str, str]]:
         return list(
             map(
                 lambda ug: dict(user=ug[0], group=ug[1]),
@@ -35,29 +84,64 @@ class ImportResult(BaseModel):
 
     def require_interaction(self, action: Action) -> Action:
         self.required_interactions.append(action)
+        self._emit("required_interaction", action=action.model_dump(mode="json"))
         return action
 
-    def add_created(self, user: ADUser) -> None:
-        self.created.add(user)
-
-    def add_updated(self, user: ADUser) -> None:
-        self.updated.add(user)
-
-    def add_enabled(self, user: ADUser) -> None:
-        self.enabled.add(user)
-        self.disabled.discard(user)
-
-    def add_disabled(self, user: ADUser) -> None:
-        self.disabled.add(user)
-        self.enabled.discard(user)
-
-    def add_joined(self, user: ADUser, group: ADGroup) -> None:
-        self.joined.add((user, group))
-        self.left.discard((user, group))
-
-    def add_left(self, user: ADUser, group: ADGroup) -> None:
-        self.left.add((user, group))
-        self.joined.discard((user, group))
+    def add_invalid(self, record: InvalidUserRecord) -> None:
+        self.invalid_records.append(record)
+        self._emit("invalid_record", **record.model_dump())
+
+    def add_created(self, user: ADObject) -> None:
+        record = ObjectRecord.of(user)
+        self.created.add(record)
+        self._emit("created", user=record.cn, dn=record.dn)
+
+    def add_updated(self, user: ADObject) -> None:
+        record = ObjectRecord.of(user)
+        self.updated.add(record)
+        self._emit("updated", user=record.cn, dn=record.dn)
+
+    def add_enabled(self, user: ADObject) -> None:
+        record = ObjectRecord.of(user)
+        self.enabled.add(record)
+        self.disabled.discard(record)
+        self._emit("enabled", user=record.cn, dn=record.dn)
+
+    def add_disabled(self, user: ADObject) -> None:
+        record = ObjectRecord.of(user)
+        self.disabled.add(record)
+        self.enabled.discard(record)
+        self._emit("disabled", user=record.cn, dn=record.dn)
+
+    def add_joined(self, user: ADObject, group: ADObject) -> None:
+        user_group = (ObjectRecord.of(user), ObjectRecord.of(group))
+        self.joined.add(user_group)
+        self.left.discard(user_group)
+        self._emit("joined", user=user_group[0].cn, group=user_group[1].cn)
+
+    def add_left(self, user: ADObject, group: ADObject) -> None:
+        user_group = (ObjectRecord.of(user), ObjectRecord.of(group))
+        self.left.add(user_group)
+        self.joined.discard(user_group)
+        self._emit("left", user=user_group[0].cn, group=user_group[1].cn)
+
+    def _emit(self, event: str, **data: Any) -> None:
+        if self.on_event is not None:
+            self.on_event(dict(event=event, **data))
+
+    def get_summary(self) -> ImportSummary:
+        return ImportSummary(
+            created=len(self.created),
+            updated=len(self.updated),
+            enabled=len(self.enabled),
+            disabled=len(self.disabled),
+            joined=len(self.joined),
+            left=len(self.left),
+            required_interactions=len(self.required_interactions),
+            invalid_records=len(self.invalid_records),
+            directory_stats=self.directory_stats,
+            cache_stats=self.cache_stats,
+        )
 
     def update(self, other: ImportResult):
         self.enabled.difference_update(other.disabled)
@@ -73,6 +157,9 @@ class ImportResult(BaseModel):
         self.created.update(other.created)
         self.updated.update(other.updated)
         self.required_interactions = list(other.required_interactions)
+        self.invalid_records = list(other.invalid_records)
+        self.directory_stats = other.directory_stats
+        self.cache_stats = other.cache_stats
 
     def log_required_interactions(self, logger: Logger):
         for action in self.required_interactions:
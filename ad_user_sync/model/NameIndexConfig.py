@@ -0,0 +1,42 @@
+from textwrap import dedent
+from typing import Annotated
+
+from pydantic import BaseModel, Field
+
+
+class NameIndexConfig(BaseModel):
+    enabled: Annotated[
+        bool,
+        Field(
+            default=True,
+            title="Enabled",
+            description=dedent("""
+                Check new users against an index of all account names, user principal names and names in the domain
+                before creating them. Known conflicts become a name action right away, without a failing create
+                and the queries needed to find out why it failed. The index is built with a single query when the
+                first user is created.
+            """),
+        ),
+    ]
+
+    global_catalog: Annotated[
+        bool,
+        Field(
+            default=False,
+            title="Use Global Catalog",
+            description="Read the index from the Global Catalog (port 3268) instead of the domain controller.",
+        ),
+    ]
+
+    max_age: Annotated[
+        float,
+        Field(
+            default=3600,
+            gt=0,
+            title="Maximum Age",
+            description=dedent("""
+                Seconds after which the index is rebuilt. Before that, a long running session (see `serve`) only
+                reads the objects changed since the last import. Deleted objects are only dropped by a rebuild.
+            """),
+        ),
+    ]
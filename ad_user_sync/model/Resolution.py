@@ -6,6 +6,7 @@ from typing import TypeVar, Annotated, Literal, List, Iterable, Type
 
 from pydantic import BaseModel, Field, TypeAdapter
 
+from .Action import Action
 from .FileBaseModel import FileBaseModel
 
 
@@ -27,6 +28,10 @@ class BaseResolution(BaseModel, ABC):
     def is_rejected(self) -> bool:
         return self.accept is False
 
+    def matches(self, action: Action) -> bool:
+        # whether this resolution resolves the given action
+        return self.type == action.type and self.user == action.user
+
 
 class EnableResolution(BaseResolution):
     type: Literal["enable"] = "enable"
@@ -41,11 +46,17 @@ class JoinResolution(BaseResolution):
     type: Literal["join"] = "join"
     group: str
 
+    def matches(self, action: Action) -> bool:
+        return super().matches(action) and self.group == action.group
+
 
 class LeaveResolution(BaseResolution):
     type: Literal["leave"] = "leave"
     group: str
 
+    def matches(self, action: Action) -> bool:
+        return super().matches(action) and self.group == action.group
+
 
 class NameResolution(BaseResolution):
     type: Literal["name"] = "name"
@@ -53,6 +64,9 @@ class NameResolution(BaseResolution):
     new_name: Annotated[str | None, Field(default="", exclude=True)]
     take_over_account: Annotated[bool, Field(default=False, exclude=True)]
 
+    def matches(self, action: Action) -> bool:
+        return super().matches(action) and self.name == action.name
+
 
 Resolution = Annotated[
     EnableResolution | DisableResolution | LeaveResolution | JoinResolution | NameResolution,
@@ -0,0 +1,82 @@
+from pathlib import Path
+from textwrap import dedent
+from typing import Annotated
+
+from pydantic import Field
+
+from .ImportConfig import ImportConfig
+
+
+class ServeConfig(ImportConfig):
+    input_file: Annotated[
+        Path | None,
+        Field(
+            default=None,
+            title="Input File",
+            description="Not used by `serve`. The newest file in `watch_directory` is imported instead.",
+        ),
+    ]
+
+    watch_directory: Annotated[
+        Path,
+        Field(
+            title="Watch Directory",
+            description=dedent("""
+                Directory the transferred user files are dropped into.
+                Whenever a new file matching `watch_pattern` appears, it is imported.
+            """),
+            examples=["incoming"],
+        ),
+    ]
+
+    watch_pattern: Annotated[
+        str,
+        Field(
+            default="*.json",
+            title="Watch Pattern",
+            description="Glob pattern of the user files in `watch_directory`.",
+            examples=["users*.json"],
+        ),
+    ]
+
+    debounce: Annotated[
+        float,
+        Field(
+            default=5,
+            title="Debounce",
+            description=dedent("""
+                Seconds a new file must stay unchanged before it is imported, so partially transferred files are not read.
+                Files arriving meanwhile are coalesced: only the newest one is imported.
+            """),
+            examples=[5],
+            ge=0,
+        ),
+    ]
+
+    poll_interval: Annotated[
+        float,
+        Field(
+            default=10,
+            title="Poll Interval",
+            description=dedent("""
+                Seconds between checks of `watch_directory` if the operating system does not support change notifications.
+                Also the longest time between two checks if it does.
+            """),
+            examples=[10],
+            gt=0,
+        ),
+    ]
+
+    archive_directory: Annotated[
+        Path | None,
+        Field(
+            default=None,
+            title="Archive Directory",
+            description=dedent("""
+                If set, imported and superseded files are moved here. 
+                Otherwise they are left in place and the newest file is imported again after a restart.
+                Files of a failed import are never moved, they are imported again every `poll_interval`.
+            """),
+            examples=["archive"],
+        ),
+    ]
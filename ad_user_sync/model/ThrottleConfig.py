@@ -0,0 +1,95 @@
+from textwrap import dedent
+from typing import Annotated
+
+from pydantic import BaseModel, Field
+
+
+class ThrottleConfig(BaseModel):
+    reads_per_second: Annotated[
+        float | None,
+        Field(
+            default=None,
+            gt=0,
+            title="Reads per Second",
+            description="Maximum number of read operations (queries, reading objects) per second. Unlimited if not set.",
+            examples=[50],
+        ),
+    ]
+
+    writes_per_second: Annotated[
+        float | None,
+        Field(
+            default=None,
+            gt=0,
+            title="Writes per Second",
+            description="Maximum number of write operations (creating, updating, moving objects) per second. Unlimited if not set.",
+            examples=[10],
+        ),
+    ]
+
+    max_retries: Annotated[
+        int,
+        Field(
+            default=5,
+            ge=0,
+            title="Maximum Retries",
+            description=dedent("""
+                How often an operation is retried if the domain controller reports a transient error (busy, unavailable, timeout).
+                Other errors are never retried.
+            """),
+        ),
+    ]
+
+    retry_base_delay: Annotated[
+        float,
+        Field(
+            default=0.5,
+            gt=0,
+            title="Retry Base Delay",
+            description="Delay in seconds before the first retry. It doubles with every further retry, randomized by up to 100%.",
+        ),
+    ]
+
+    retry_max_delay: Annotated[
+        float,
+        Field(
+            default=30,
+            gt=0,
+            title="Retry Maximum Delay",
+            description="Upper bound of the delay in seconds between two retries.",
+        ),
+    ]
+
+    max_concurrency: Annotated[
+        int,
+        Field(
+            default=4,
+            gt=0,
+            title="Maximum Concurrency",
+            description=dedent("""
+                Maximum number of operations sent to the domain controller at the same time (e.g. by concurrent export shards).
+                The actual limit is halved whenever an operation is slower than `target_latency` or fails transiently
+                and grows back by one while operations are fast.
+            """),
+        ),
+    ]
+
+    target_latency: Annotated[
+        float,
+        Field(
+            default=2.0,
+            gt=0,
+            title="Target Latency",
+            description="Operations taking longer than this many seconds are considered a sign of an overloaded domain controller.",
+        ),
+    ]
+
+
+class ThrottleStats(BaseModel):
+    reads: Annotated[int, Field(default=0)]
+    writes: Annotated[int, Field(default=0)]
+    throttled_seconds: Annotated[float, Field(default=0)]  # time spent waiting for the rate limit or a free slot
+    retries: Annotated[int, Field(default=0)]
+    failures: Annotated[int, Field(default=0)]  # operations that failed after all retries or with a permanent error
+    concurrency_limit: Annotated[float, Field(default=0)]  # at the end of the run
+    concurrency_decreases: Annotated[int, Field(default=0)]
@@ -0,0 +1,117 @@
+import sys
+from typing import Annotated, Any, Dict, Iterable, List, Tuple
+
+from pydantic import BaseModel, Field
+
+# Keys of an input user that are not applied as attributes of the user object
+RECORD_KEYS = {"cn", "sAMAccountName", "memberOf", "accountExpires", "disabled", "subPath", "distinguishedName"}
+
+# Types of attribute values (and of the items of multi valued attributes) a user file can hold
+ATTRIBUTE_VALUE_TYPES = (str, int, float, bool)
+
+
+class UserRecord:
+    # A validated user of the input file. Group paths are interned and users with the same groups share one tuple,
+    # so thousands of users in the same groups hold their memberships once.
+    __slots__ = ("cn", "account_name", "member_of", "disabled", "sub_path", "attributes")
+
+    def __init__(
+        self,
+        cn: str,
+        account_name: str,
+        member_of: Tuple[str, ...],
+        disabled: bool,
+        sub_path: str | None,
+        attributes: Dict[str, Any],
+    ):
+        self.cn = cn
+        self.account_name = account_name
+        self.member_of = member_of
+        self.disabled = disabled  # we only disable, never enable because of the input
+        self.sub_path = sub_path
+        self.attributes = attributes  # applied with ADUser.update_attributes()
+
+    def __repr__(self) -> str:
+        return f"<UserRecord {self.cn}>"
+
+
+class InvalidUserRecord(BaseModel):
+    index: int  # position in the input file
+    cn: Annotated[str | None, Field(default=None)]  # None if the record has no usable cn
+    error: str
+
+
+def validate_user_records(users: Iterable[Any]) -> Tuple[List[UserRecord], List[InvalidUserRecord]]:
+    # Validates all users of an input file at once, before anything is imported. Invalid records and all records
+    # sharing a cn (compared case-insensitively, like AD) are returned as invalid instead of raising.
+    records: List[UserRecord] = []
+    record_indexes: List[int] = []  # position of each record in the input file
+    invalid: List[InvalidUserRecord] = []
+    member_of_tuples: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+    indexes_by_cn: Dict[str, List[int]] = {}
+
+    for index, user in enumerate(users):
+        if not isinstance(user, dict):
+            invalid.append(InvalidUserRecord(index=index, error=f"Not an object: {type(user).__name__}"))
+            continue
+        cn = user.get("cn")
+        if not isinstance(cn, str) or cn.strip() == "":
+            invalid.append(InvalidUserRecord(index=index, error="Missing or empty cn"))
+            continue
+        error = get_record_error(user)
+        if error is not None:
+            invalid.append(InvalidUserRecord(index=index, cn=cn, error=error))
+            continue
+
+        member_of = tuple(sys.intern(g) for g in user["memberOf"] or ())
+        member_of = member_of_tuples.setdefault(member_of, member_of)
+        records.append(
+            UserRecord(
+                cn=cn,
+                account_name=user["sAMAccountName"],
+                member_of=member_of,
+                disabled=user.get("disabled") or False,
+                sub_path=sys.intern(user["subPath"]) if user.get("subPath") is not None else None,
+                attributes={k: v for k, v in user.items() if k not in RECORD_KEYS},
+            )
+        )
+        record_indexes.append(index)
+        indexes_by_cn.setdefault(cn.lower(), []).append(index)
+
+    # none of the records of a duplicate cn is imported, it is unclear which one is right
+    duplicates = {cn: indexes for cn, indexes in indexes_by_cn.items() if len(indexes) > 1}
+    if len(duplicates) > 0:
+        valid = []
+        for record, index in zip(records, record_indexes):
+            indexes = duplicates.get(record.cn.lower())
+            if indexes is None:
+                valid.append(record)
+            else:
+                error = f"Duplicate cn (records {', '.join(map(str, indexes))})"
+                invalid.append(InvalidUserRecord(index=index, cn=record.cn, error=error))
+        records = valid
+        invalid.sort(key=lambda r: r.index)
+
+    return records, invalid
+
+
+def get_record_error(user: Dict[str, Any]) -> str | None:
+    account_name = user.get("sAMAccountName")
+    if not isinstance(account_name, str) or account_name.strip() == "":
+        return "Missing or empty sAMAccountName"
+    if "memberOf" not in user:
+        return "Missing memberOf"
+    member_of = user["memberOf"]
+    if member_of is not None and (not isinstance(member_of, list) or not all(isinstance(g, str) for g in member_of)):
+        return "memberOf is not a list of group paths"
+    if not isinstance(user.get("disabled", False), bool | None):
+        return "disabled is not a boolean"
+    if not isinstance(user.get("subPath"), str | None):
+        return "subPath is not a string"
+    for key, value in user.items():
+        if key in RECORD_KEYS or value is None or isinstance(value, ATTRIBUTE_VALUE_TYPES):
+            continue
+        if isinstance(value, list) and all(isinstance(v, ATTRIBUTE_VALUE_TYPES) for v in value):
+            continue
+        return f"Unsupported value of {key}: {type(value).__name__}"
+    return None
@@ -1,5 +1,12 @@
 from .ExportConfig import ExportConfig
 from .ImportConfig import ImportConfig, InteractiveImportConfig
-from .ImportResult import ImportResult
+from .ImportResult import ImportResult, ImportSummary, ObjectRecord
 from .Action import Action, NameAction, EnableAction, JoinAction
 from .Resolution import ResolutionList, Resolution, NameResolution, EnableResolution, JoinResolution, ResolutionParser
+from .BulkResolution import BulkResolution, ResolutionSelector
+from .ServeConfig import ServeConfig
+from .DirectoryMetadata import DirectoryMetadata, GroupMetadata, DomainMetadata
+from .ThrottleConfig import ThrottleConfig, ThrottleStats
+from .CacheConfig import CacheConfig, CacheStats
+from .NameIndexConfig import NameIndexConfig
+from .UserRecord import UserRecord, InvalidUserRecord, validate_user_records
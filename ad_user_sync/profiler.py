@@ -0,0 +1,136 @@
+import cProfile
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+
+# Times the phases of an import or export and optionally profiles them with cProfile and tracemalloc.
+# Phases follow each other on the calling thread, starting one ends the previous one. Work running alongside a phase
+# (e.g. the conversion of an export on a worker thread) is timed as a section with `measure()`.
+# Without a directory only the wall-clock timings are kept, which is cheap enough to do on every run.
+class Profiler:
+    def __init__(
+        self,
+        directory: Path | None = None,
+        name: str = "profile",
+        cpu: bool = False,
+        memory: bool = False,
+        top_allocations: int = 20,
+    ):
+        self.directory = directory
+        self.name = name
+        self.cpu = cpu and directory is not None
+        self.memory = memory and directory is not None
+        self.top_allocations = top_allocations
+        self.started = datetime.now()
+        self.start = time.perf_counter()
+        self.phases: List[Dict[str, Any]] = []
+        self.sections: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+        self.current: Dict[str, Any] | None = None
+        self.current_start = 0.0
+        self.current_profile: cProfile.Profile | None = None
+        self.current_snapshot: tracemalloc.Snapshot | None = None
+
+        # tracing is left alone if someone else started it already
+        self.tracing = self.memory and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+
+    def phase(self, name: str) -> None:
+        self.end()
+        self.current = dict(name=name)
+        if self.memory:
+            tracemalloc.reset_peak()
+            self.current_snapshot = tracemalloc.take_snapshot()
+        if self.cpu:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.current_profile = profile
+            except ValueError:
+                # another profiler (e.g. a debugger or coverage) is active, the phase is only timed
+                self.current_profile = None
+        self.current_start = time.perf_counter()
+
+    def end(self) -> None:
+        if self.current is None:
+            return
+        phase, self.current = self.current, None
+        phase["duration"] = time.perf_counter() - self.current_start
+
+        if self.current_profile is not None:
+            self.current_profile.disable()
+            phase["cpu_profile"] = f"{self.name}-{phase['name']}.pstats"
+            self.current_profile.dump_stats(self.directory / phase["cpu_profile"])
+            self.current_profile = None
+
+        if self.current_snapshot is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            phase["memory_current"] = current
+            phase["memory_peak"] = peak
+            phase["top_allocations"] = self.get_top_allocations(self.current_snapshot)
+            self.current_snapshot = None
+
+        self.phases.append(phase)
+
+    def get_top_allocations(self, start: tracemalloc.Snapshot) -> List[Dict[str, Any]]:
+        # allocations made during the phase and still alive at its end, by line
+        ignored = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ]
+        end = tracemalloc.take_snapshot().filter_traces(ignored)
+        differences = end.compare_to(start.filter_traces(ignored), "lineno")
+        return [
+            dict(location=str(difference.traceback), size=difference.size_diff, count=difference.count_diff)
+            for difference in differences[: self.top_allocations]
+            if difference.size_diff > 0
+        ]
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        # times a section, sections of the same name (also from other threads) are added up
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                section = self.sections.setdefault(name, dict(calls=0, duration=0.0))
+                section["calls"] += 1
+                section["duration"] += duration
+
+    def get_summary(self) -> Dict[str, Any]:
+        summary = dict(
+            name=self.name,
+            started=self.started.isoformat(),
+            duration=time.perf_counter() - self.start,
+            phases=self.phases,
+            sections=self.sections,
+        )
+        if self.memory:
+            summary["memory_peak"] = max((p.get("memory_peak", 0) for p in self.phases), default=0)
+        return summary
+
+    def close(self) -> Path | None:
+        # ends the last phase and writes the summary, returns its path
+        self.end()
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+        if self.directory is None:
+            return None
+        path = self.directory / f"{self.name}-summary.json"
+        with open(path, "w") as f:
+            json.dump(self.get_summary(), f, indent=4)
+        return path
@@ -0,0 +1,146 @@
+import os
+import shutil
+import time
+from datetime import datetime
+from logging import Logger
+from pathlib import Path
+from typing import Dict, Iterable, List, Annotated
+
+from pydantic import BaseModel, Field
+
+from .active_directory import CachedActiveDirectory
+from .directory_watcher import DirectoryWatcher
+from .import_users import import_users
+from .model import ServeConfig, ResolutionList
+
+
+class CycleStats(BaseModel):
+    cycle: int
+    input_file: Path
+    coalesced_files: Annotated[int, Field(default=0)]  # older files superseded by `input_file`
+    started: datetime
+    duration: Annotated[float, Field(default=0)]
+    created: Annotated[int, Field(default=0)]
+    updated: Annotated[int, Field(default=0)]
+    enabled: Annotated[int, Field(default=0)]
+    disabled: Annotated[int, Field(default=0)]
+    joined: Annotated[int, Field(default=0)]
+    left: Annotated[int, Field(default=0)]
+    required_interactions: Annotated[int, Field(default=0)]
+    error: Annotated[str | None, Field(default=None)]
+
+
+def serve(config: ServeConfig, logger: Logger) -> None:
+    # The active directory instance is kept across cycles, so groups and containers stay bound and cached.
+    active_directory = CachedActiveDirectory(
+        logger,
+        ldap_server=config.ldap_server,
+        throttle=config.throttle,
+        cache=config.cache,
+        name_index=config.name_index,
+    )
+
+    # files already imported or superseded (name -> modification time)
+    handled: Dict[str, int] = {}
+    cycle = 0
+
+    with DirectoryWatcher(config.watch_directory, logger, poll_interval=config.poll_interval) as watcher:
+        logger.info(f"Serving imports of {config.watch_directory / config.watch_pattern}")
+        try:
+            while True:
+                pending = wait_until_settled(config, watcher, handled)
+                if len(pending) > 0:
+                    cycle += 1
+                    stats = run_cycle(config, logger, active_directory, cycle, pending)
+                    # files of a failed cycle stay pending and are imported again in the next cycle
+                    if stats.error is None:
+                        for file, file_stat in stat_files(pending).items():
+                            handled[file.name] = file_stat.st_mtime_ns
+                            if config.archive_directory is not None:
+                                config.archive_directory.mkdir(parents=True, exist_ok=True)
+                                shutil.move(file, config.archive_directory / file.name)
+                    # one JSON line per cycle on stdout
+                    print(stats.model_dump_json(), flush=True)
+                watcher.wait(config.poll_interval)
+        except KeyboardInterrupt:
+            logger.debug("Received keyboard interrupt")
+    logger.info(f"Stopped serving after {cycle} cycle(s)")
+
+
+def find_pending_files(config: ServeConfig, handled: Dict[str, int]) -> List[Path]:
+    # not yet handled files, oldest first
+    files = filter(lambda f: f.is_file(), config.watch_directory.glob(config.watch_pattern))
+    stats = stat_files(files)
+    pending = filter(lambda f: handled.get(f.name) != stats[f].st_mtime_ns, stats)
+    return sorted(pending, key=lambda f: (stats[f].st_mtime_ns, f.name))
+
+
+def wait_until_settled(config: ServeConfig, watcher: DirectoryWatcher, handled: Dict[str, int]) -> List[Path]:
+    # Wait until the pending files did not change for `debounce` seconds, so files still being written are not read.
+    pending = find_pending_files(config, handled)
+    while len(pending) > 0:
+        before = stat_files(pending)
+        changed = watcher.wait(config.debounce)
+        pending = find_pending_files(config, handled)
+        after = stat_files(pending)
+        if (
+            not changed
+            and before.keys() == after.keys()
+            and all(
+                (before[f].st_size, before[f].st_mtime_ns) == (after[f].st_size, after[f].st_mtime_ns) for f in after
+            )
+        ):
+            return list(after)
+    return pending
+
+
+def stat_files(files: Iterable[Path]) -> Dict[Path, os.stat_result]:
+    # files removed (or not accessible) since they were listed are skipped
+    stats = {}
+    for file in files:
+        try:
+            stats[file] = file.stat()
+        except OSError:
+            continue
+    return stats
+
+
+def run_cycle(
+    config: ServeConfig,
+    logger: Logger,
+    active_directory: CachedActiveDirectory,
+    cycle: int,
+    pending: List[Path],
+) -> CycleStats:
+    # coalesce: only the newest file is imported, it supersedes all older ones
+    *superseded, input_file = pending
+    stats = CycleStats(cycle=cycle, input_file=input_file, coalesced_files=len(superseded), started=datetime.now())
+    logger.info(f"Cycle {cycle}: importing {input_file.name} ({len(superseded)} older file(s) skipped)")
+
+    start = time.perf_counter()
+    try:
+        result = import_users(
+            config=config.model_copy(update=dict(input_file=input_file)),
+            logger=logger,
+            resolutions=ResolutionList.load(file=config.resolutions_file, logger=logger, save_default=True),
+            active_directory=active_directory,
+        )
+        stats.created = len(result.created)
+        stats.updated = len(result.updated)
+        stats.enabled = len(result.enabled)
+        stats.disabled = len(result.disabled)
+        stats.joined = len(result.joined)
+        stats.left = len(result.left)
+        stats.required_interactions = len(result.required_interactions)
+    except Exception as e:
+        # a failing cycle must not stop the service
+        logger.exception(f"Cycle {cycle}: import of {input_file.name} failed")
+        stats.error = str(e)
+    stats.duration = time.perf_counter() - start
+
+    logger.info(
+        f"Cycle {cycle}: finished in {stats.duration:.1f}s: {stats.created} created, {stats.updated} updated, "
+        f"{stats.enabled} enabled, {stats.disabled} disabled, {stats.joined} joined, {stats.left} left, "
+        f"{stats.required_interactions} interaction(s) required"
+    )
+    return stats
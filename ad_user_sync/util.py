@@ -1,15 +1,17 @@
 import json
+import re
 import random
 import string
 import textwrap
-from typing import Any, Type
+from datetime import datetime
+from typing import Any, Type, Tuple, Iterable, List, Dict, TextIO
 import threading
-import ctypes
 import socket
-from contextlib import closing
+from contextlib import closing, contextmanager
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
 from textwrap import dedent, indent
 
-from pyad import pyadutils
 from pydantic import ValidationError, BaseModel
 from typing_extensions import MutableMapping
 
@@ -59,27 +61,75 @@ def format_validation_error(e: ValidationError, source: str = None, indentation:
     return "\n".join(error_messages)
 
 
-class KillableThread(threading.Thread):
-    def get_id(self):
-        # returns id of the respective thread
-        if hasattr(self, "_thread_id"):
-            return self._thread_id
-        for id, thread in threading._active.items():
-            if thread is self:
-                return id
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    # handle every request in its own thread, so long-running requests do not block others
+    daemon_threads = True
+    block_on_close = False
 
-    def terminate(self):
-        thread_id = self.get_id()
-        res = ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, ctypes.py_object(KeyboardInterrupt))
-        if res > 1:
-            ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, 0)
-            print("Exception raise failure")
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ServerThread(threading.Thread):
+    # serves a WSGI application until shutdown() is called
+    def __init__(self, app: Any, host: str, port: int):
+        super().__init__(name="wsgi-server", daemon=True)
+        self.server = make_server(
+            host,
+            port,
+            app,
+            server_class=ThreadingWSGIServer,
+            handler_class=QuietWSGIRequestHandler,
+        )
+
+    def run(self):
+        self.server.serve_forever()
+
+    def shutdown(self, timeout: float | None = None):
+        self.server.shutdown()
+        self.server.server_close()
+        self.join(timeout=timeout)
+
+
+# 100-nanosecond intervals between January 1, 1601 (AD time) and January 1, 1970 (unix time)
+AD_EPOCH_OFFSET = 116444736000000000
+
+
+def split_ad_bigint(value: Any) -> Tuple[int, int] | None:
+    # Read both 32-bit parts of a COM large integer into python ints.
+    # COM objects may only be accessed from the thread that queried them, plain ints can be converted anywhere.
+    return (int(value.HighPart), int(value.LowPart)) if value is not None else None
+
+
+def convert_ad_datetime_column(values: Iterable[Tuple[int, int] | None]) -> List[str | None]:
+    # Converts a whole column of split large integers like convert_ad_datetime().
+    # Most users share very few expiration dates (or none), so every distinct value is only converted once.
+    converted: Dict[Tuple[int, int] | None, str | None] = {None: None}
+    column = []
+    for value in values:
+        result = converted.get(value, converted)
+        if result is converted:
+            high, low = value
+            ts = ((high + 1 if low < 0 else high) << 32) + low  # like pyadutils.convert_bigint()
+            if ts == 0 or ts == 0x7FFFFFFFFFFFFFFF:
+                result = None
+            else:
+                # like pyadutils.convert_datetime(), which does not correct a negative low part and replaces
+                # dates before 1970 with the timestamp 18000
+                seconds = ((high << 32) + low - AD_EPOCH_OFFSET) // 10000000
+                result = datetime.fromtimestamp(seconds if seconds >= 0 else 18000).isoformat()
+            converted[value] = result
+        column.append(result)
+    return column
 
 
 def convert_ad_datetime(date: Any):
     # https://web.archive.org/web/20171214045055/http://docs.activestate.com/activepython/2.6/pywin32/html/com/help/active_directory.html#time
     # "Time in active directory is stored in a 64-bit integer that keeps track of the number of 100-nanosecond
     # intervals which have passed since January 1, 1601. The 64-bit value uses 2 32 bit parts to store the time."
+    from pyad import pyadutils
 
     ts = pyadutils.convert_bigint(date)
     if ts == 0:  # If no expire date is set, the date object will convert to 0
@@ -103,6 +153,49 @@ def sub_path(base_path: str, dn: str) -> str:
     return dn[0 : -len(base_path) - 1] if dn.endswith(base_path) else dn
 
 
+# Splits a distinguished name into its first relative name and the parent dn.
+# Escaped commas ("CN=Doe\\, John") are kept.
+def split_dn(dn: str) -> Tuple[str, str]:
+    parts = re.split(r"(?<!\\),", dn, maxsplit=1)
+    return (parts[0], parts[1]) if len(parts) == 2 else (parts[0], "")
+
+
+# Escapes a value for use in an LDAP filter (RFC 4515), e.g. a distinguished name containing parentheses
+def escape_ldap_filter_value(value: str) -> str:
+    return "".join(f"\\{ord(c):02x}" if c in "\\*()\0" else c for c in value)
+
+
+# COM has to be initialized on every thread using it (e.g. ADQuery). The main thread is initialized by pywin32 itself.
+@contextmanager
+def com_initialized():
+    try:
+        import pythoncom
+    except ImportError:
+        # not on windows (development), there is nothing to initialize
+        pythoncom = None
+    if pythoncom is None:
+        yield
+        return
+    pythoncom.CoInitialize()
+    try:
+        yield
+    finally:
+        pythoncom.CoUninitialize()
+
+
+class JsonLinesWriter:
+    # Writes every object passed to it as one line of JSON (NDJSON), safe to use from several threads.
+    def __init__(self, file: TextIO):
+        self.file = file
+        self.lock = threading.Lock()
+
+    def __call__(self, o: Dict[str, Any]) -> None:
+        line = json.dumps(o, ensure_ascii=False, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+
 def find_free_port() -> int:
     with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
         s.bind(("", 0))
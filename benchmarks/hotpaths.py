@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the pure-Python hot paths, none of them needs a directory.
+
+Every case is run at each size with data generated from a fixed seed. The throughput (operations per second, median
+of several runs) and the peak memory allocated by one run (traced separately with tracemalloc) are compared to a
+baseline file written by an earlier run with --save-baseline on the same machine.
+
+    python benchmarks/hotpaths.py [--sizes 1000 10000 100000] [--cases user_file_read ...] [--runs 3]
+                                  [--baseline benchmarks/hotpaths-baseline.json] [--save-baseline] [--threshold 0.2]
+
+Exits with 1 if a case got slower or allocates more than the threshold (a fraction of the baseline) allows.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from itertools import batched
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+root_path = Path(__file__).parent.parent.absolute()
+sys.path.insert(0, str(root_path))
+
+from ad_user_sync.export_users import AttributeParser, BATCH_SIZE  # noqa: E402
+from ad_user_sync.membership import MembershipMatrix  # noqa: E402
+from ad_user_sync.model import (  # noqa: E402
+    ImportConfig,
+    ImportResult,
+    ObjectRecord,
+    ResolutionList,
+    validate_user_records,
+)
+from ad_user_sync.model.Resolution import (  # noqa: E402
+    DisableResolution,
+    EnableResolution,
+    JoinResolution,
+    LeaveResolution,
+    NameResolution,
+)
+from ad_user_sync.user_file import UserFile  # noqa: E402
+from ad_user_sync.util import AD_EPOCH_OFFSET, convert_ad_datetime_column, full_path, sub_path  # noqa: E402
+
+SEED = 1337
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_BASELINE = root_path / "benchmarks" / "hotpaths-baseline.json"
+
+# Lookups scan the whole list, so their number is fixed instead of growing with the number of resolutions.
+RESOLUTION_LOOKUPS = 100
+
+# growth of the peak allocations in bytes that is never reported, regardless of the threshold
+MEMORY_TOLERANCE = 64 * 1024
+
+GROUP_PATH = "CN=Users,DC=ad,DC=company,DC=com"
+USER_PATH = "OU=Staff,DC=ad,DC=company,DC=com"
+HMAC_KEY = "00112233445566778899aabbccddeeff00112233445566778899aabbccddeeff"
+
+logger = logging.getLogger("benchmark")
+
+# A case prepares its data for a size and returns the number of operations one run performs and the run itself.
+Case = Callable[[int, random.Random, Path], Tuple[int, Callable[[], Any]]]
+
+
+def make_groups(rng: random.Random, count: int) -> List[str]:
+    return [f"CN=Group {i:05d} {rng.choice('ABCDEFGH')}" for i in range(count)]
+
+
+def make_users(size: int, rng: random.Random) -> List[Dict[str, Any]]:
+    groups = make_groups(rng, max(size // 100, 10))
+    users = []
+    for i in range(size):
+        given_name, surname = f"Given{rng.randrange(1000)}", f"Surname{i}"
+        users.append(
+            dict(
+                sAMAccountName=f"user{i:06d}",
+                cn=f"{given_name} {surname}",
+                givenName=given_name,
+                sn=surname,
+                mail=f"{given_name.lower()}.{surname.lower()}@company.com",
+                disabled=rng.random() < 0.1,
+                accountExpires=None if rng.random() < 0.8 else datetime(2030, 1, 1 + rng.randrange(28)).isoformat(),
+                memberOf=rng.sample(groups, rng.randrange(4)),
+            )
+        )
+    return users
+
+
+def user_file_write(hmac: str | None) -> Case:
+    def setup(size: int, rng: random.Random, workdir: Path):
+        users = make_users(size, rng)
+        user_file = UserFile(workdir / "users.json", hmac)
+        return size, lambda: user_file.write(users)
+
+    return setup
+
+
+def user_file_read(hmac: str | None) -> Case:
+    def setup(size: int, rng: random.Random, workdir: Path):
+        user_file = UserFile(workdir / "users.json", hmac)
+        user_file.write(make_users(size, rng))
+        return size, user_file.read
+
+    return setup
+
+
+def make_resolutions(size: int, rng: random.Random) -> List[Any]:
+    groups = [full_path(GROUP_PATH, g) for g in make_groups(rng, 50)]
+    resolutions = []
+    for i in range(size):
+        user = f"user{rng.randrange(size):06d}"
+        accept = rng.choice([True, False, None])
+        kind = i % 5
+        if kind == 0:
+            resolutions.append(EnableResolution(user=user, accept=accept))
+        elif kind == 1:
+            resolutions.append(DisableResolution(user=user, accept=accept))
+        elif kind == 2:
+            resolutions.append(JoinResolution(user=user, accept=accept, group=rng.choice(groups)))
+        elif kind == 3:
+            resolutions.append(LeaveResolution(user=user, accept=accept, group=rng.choice(groups)))
+        else:
+            resolutions.append(NameResolution(user=user, accept=accept, name=f"{user}-{rng.randrange(3)}"))
+    return resolutions
+
+
+def validate_records(size: int, rng: random.Random, workdir: Path):
+    users = make_users(size, rng)
+    return size, lambda: validate_user_records(users)
+
+
+def resolution_lookup(size: int, rng: random.Random, workdir: Path):
+    resolutions = ResolutionList(resolutions=make_resolutions(size, rng))
+    groups = [full_path(GROUP_PATH, g) for g in make_groups(rng, 50)]
+    # half of the users looked up have resolutions, like in an import where most users need none
+    lookups = []
+    for i in range(RESOLUTION_LOOKUPS):
+        user = f"user{rng.randrange(size * 2):06d}"
+        lookups.append(
+            [
+                (resolutions.get_enable, (user,)),
+                (resolutions.get_disable, (user,)),
+                (resolutions.get_join, (user, rng.choice(groups))),
+                (resolutions.get_leave, (user, rng.choice(groups))),
+                (resolutions.get_name, (user, f"{user}-{rng.randrange(3)}")),
+            ][i % 5]
+        )
+
+    def run():
+        for lookup, args in lookups:
+            lookup(*args)
+
+    return len(lookups), run
+
+
+def import_result_update(size: int, rng: random.Random, workdir: Path):
+    # merges the results of two runs into the persisted one, like `serve` does after every import
+    users = [ObjectRecord(full_path(USER_PATH, f"CN=User {i}"), f"User {i}") for i in range(size)]
+    groups = [ObjectRecord(full_path(GROUP_PATH, g), g[3:]) for g in make_groups(rng, max(size // 100, 10))]
+    runs = []
+    for _ in range(2):
+        result = ImportResult()
+        for user in users:
+            action = rng.random()
+            if action < 0.1:
+                result.add_created(user)
+            elif action < 0.3:
+                result.add_updated(user)
+            if rng.random() < 0.05:
+                result.add_disabled(user)
+            else:
+                result.add_enabled(user)
+            for group in rng.sample(groups, rng.randrange(3)):
+                (result.add_joined if rng.random() < 0.8 else result.add_left)(user, group)
+        runs.append(result)
+
+    def run():
+        merged = ImportResult()
+        for result in runs:
+            merged.update(result)
+
+    return 2 * size, run
+
+
+def membership_deltas(size: int, rng: random.Random, workdir: Path):
+    # desired memberships of all imported users in 50 managed groups and the members to add and remove per group
+    source_groups = make_groups(rng, 200)
+    group_map = {g: {full_path(GROUP_PATH, f"CN=p-{i % 50}")} for i, g in enumerate(source_groups)}
+    group_map["*"] = {full_path(GROUP_PATH, "CN=p-Managed")}
+    users = [ObjectRecord(full_path(USER_PATH, f"CN=User {i}"), f"User {i}") for i in range(size)]
+    signatures = [tuple(rng.sample(source_groups, rng.randrange(4))) for _ in range(max(size // 20, 10))]
+    member_of = [rng.choice(signatures) for _ in users]
+    current_members = [[u.dn for u in rng.sample(users, min(size, 100 * rng.randrange(1, 10)))] for _ in range(51)]
+
+    def run():
+        memberships = MembershipMatrix(group_map)
+        for user, groups in zip(users, member_of):
+            memberships.add(user, groups)
+        for index in range(len(memberships.groups)):
+            old_members = memberships.get_bits(current_members[index])
+            desired = memberships.get_desired(index)
+            memberships.get_users(old_members & ~desired)
+            memberships.get_users(desired & ~old_members)
+
+    return size, run
+
+
+def attribute_pipeline(size: int, rng: random.Random, workdir: Path):
+    # the column-wise conversion of export_users() with its special attribute parsers, on prepared values
+    groups = [full_path(GROUP_PATH, g) for g in make_groups(rng, max(size // 100, 10))]
+    relative_group_paths = {g: sub_path(GROUP_PATH, g) for g in groups[: len(groups) // 2]}
+    attribute_parsers = [
+        AttributeParser("sAMAccountName"),
+        AttributeParser("cn"),
+        AttributeParser("givenName"),
+        AttributeParser("mail"),
+        AttributeParser(
+            "disabled",
+            "userAccountControl",
+            parse_column=lambda column: [(v & 0x02) != 0 if v is not None else None for v in column],
+        ),
+        AttributeParser("accountExpires", parse_column=convert_ad_datetime_column),
+        AttributeParser(
+            "memberOf",
+            parse_column=lambda column: [
+                [relative_group_paths[g] for g in v if g in relative_group_paths] if v is not None else None
+                for v in column
+            ],
+        ),
+    ]
+    target_keys = [p.target_key for p in attribute_parsers]
+
+    expiration_dates = [(AD_EPOCH_OFFSET + rng.randrange(10**17)).to_bytes(8, signed=True) for _ in range(20)]
+    expiration_dates = [
+        (int.from_bytes(d[:4], signed=True), int.from_bytes(d[4:], signed=True)) for d in expiration_dates
+    ]
+    rows = [
+        dict(
+            sAMAccountName=f"user{i:06d}",
+            cn=f"User {i}",
+            givenName=f"Given{i}",
+            mail=f"user{i}@company.com",
+            userAccountControl=rng.choice([0x200, 0x202]),
+            accountExpires=(0, 0) if rng.random() < 0.8 else rng.choice(expiration_dates),
+            memberOf=rng.sample(groups, min(len(groups), rng.randrange(6))),
+        )
+        for i in range(size)
+    ]
+
+    def run():
+        users = []
+        for batch in batched(rows, BATCH_SIZE):
+            columns = [parser.extract_column(batch) for parser in attribute_parsers]
+            converted = [parser.parse_column(column) for parser, column in zip(attribute_parsers, columns)]
+            users.extend(dict(zip(target_keys, values)) for values in zip(*converted))
+        return users
+
+    return size, run
+
+
+def path_helpers(size: int, rng: random.Random, workdir: Path):
+    relative_paths = [f"CN=Group {i},OU=Unit {rng.randrange(20)}" for i in range(size)]
+
+    def run():
+        for path in relative_paths:
+            sub_path(GROUP_PATH, full_path(GROUP_PATH, path))
+
+    return size, run
+
+
+def config_load(size: int, rng: random.Random, workdir: Path):
+    groups = make_groups(rng, size)
+    config_file = workdir / "import.json"
+    config_file.write_text(
+        json.dumps(
+            dict(
+                input_file="users.json",
+                group_path=GROUP_PATH,
+                managed_user_path=USER_PATH,
+                group_map={g: [f"CN=p-{g[3:]}", "CN=p-Managed"] for g in groups},
+                restricted_groups=rng.sample([f"CN=p-{g[3:]}" for g in groups], size // 10),
+            ),
+            indent=4,
+        )
+    )
+    return size, lambda: ImportConfig.load(config_file, logger, fallback_default=False)
+
+
+def resolutions_load(size: int, rng: random.Random, workdir: Path):
+    resolutions_file = workdir / "resolutions.json"
+    ResolutionList(resolutions=make_resolutions(size, rng)).save(resolutions_file)
+    return size, lambda: ResolutionList.load(resolutions_file, logger, fallback_default=False)
+
+
+CASES: Dict[str, Case] = {
+    "user_file_write": user_file_write(None),
+    "user_file_write_hmac": user_file_write(HMAC_KEY),
+    "user_file_read": user_file_read(None),
+    "user_file_read_hmac": user_file_read(HMAC_KEY),
+    "validate_records": validate_records,
+    "resolution_lookup": resolution_lookup,
+    "import_result_update": import_result_update,
+    "membership_deltas": membership_deltas,
+    "attribute_pipeline": attribute_pipeline,
+    "path_helpers": path_helpers,
+    "config_load": config_load,
+    "resolutions_load": resolutions_load,
+}
+
+
+def measure(ops: int, run: Callable[[], Any], runs: int) -> Dict[str, float]:
+    run()  # warm up
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    # allocations are traced in a run of their own, tracing slows down the timed runs considerably
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return dict(ops_per_sec=ops / statistics.median(timings), peak_bytes=peak)
+
+
+def compare(result: Dict[str, float], baseline: Dict[str, float] | None, threshold: float) -> Tuple[str, bool]:
+    if baseline is None:
+        return "", False
+    notes = []
+    regressed = False
+    speed = result["ops_per_sec"] / baseline["ops_per_sec"] - 1
+    notes.append(f"{speed:+7.1%} speed")
+    if speed < -threshold:
+        regressed = True
+        notes[-1] += " SLOWER"
+    if baseline["peak_bytes"] > 0:
+        memory = result["peak_bytes"] / baseline["peak_bytes"] - 1
+        notes.append(f"{memory:+7.1%} memory")
+        # a few more bytes for cases that hardly allocate anything are not a regression
+        if memory > threshold and result["peak_bytes"] - baseline["peak_bytes"] > MEMORY_TOLERANCE:
+            regressed = True
+            notes[-1] += " MORE"
+    return "  ".join(notes), regressed
+
+
+def main() -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Sizes to run every case at")
+    arg_parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=list(CASES), help="Cases to run")
+    arg_parser.add_argument("--runs", type=int, default=3, help="Timed runs per case and size")
+    arg_parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Baseline file")
+    arg_parser.add_argument("--save-baseline", action="store_true", help="Write the results to the baseline file")
+    arg_parser.add_argument(
+        "--threshold", type=float, default=0.2, help="Allowed regression as a fraction of the baseline"
+    )
+    args = arg_parser.parse_args()
+
+    baseline: Dict[str, Dict[str, float]] = {}
+    if args.baseline.is_file() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+    elif not args.save_baseline:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+
+    results: Dict[str, Dict[str, float]] = {}
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.cases:
+            for size in args.sizes:
+                key = f"{name}@{size}"
+                # every case gets its own generator, so its data does not depend on which cases ran before
+                ops, run = CASES[name](size, random.Random(f"{SEED}:{key}"), Path(workdir))
+                results[key] = measure(ops, run, args.runs)
+                note, regressed = compare(results[key], baseline.get(key), args.threshold)
+                failed |= regressed
+                print(
+                    f"{name:<22} {size:>7}  {results[key]['ops_per_sec']:>12,.0f} ops/s"
+                    f"  {results[key]['peak_bytes'] / 1024:>10,.0f} KiB peak  {note}"
+                )
+
+    if args.save_baseline:
+        args.baseline.write_text(
+            json.dumps(
+                dict(
+                    python=sys.version.split()[0],
+                    platform=platform.platform(),
+                    timestamp=datetime.now().isoformat(),
+                    results=results,
+                ),
+                indent=4,
+            )
+        )
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Startup time benchmark of the command line tool.
+
+Every command is run repeatedly in a fresh interpreter and the median wall-clock time is compared to a budget.
+`export` and `import` are started with a config file that does not exist, so they exit right after loading all
+modules their subcommand needs and no directory is contacted.
+
+    python benchmarks/startup.py [--runs 10] [--version-budget 0.25] [--export-budget 1.0] [--import-budget 1.0]
+
+Exits with 1 if any median exceeds its budget.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+root_path = Path(__file__).parent.parent.absolute()
+main_script = root_path / "ad_user_sync" / "__main__.py"
+
+
+def measure(arguments: list[str], runs: int, cwd: str) -> float:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(root_path), os.environ.get("PYTHONPATH")])))
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(main_script), *arguments],
+            cwd=cwd,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main() -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--runs", type=int, default=10, help="Runs per command")
+    arg_parser.add_argument("--version-budget", type=float, default=0.25, help="Budget for --version in seconds")
+    arg_parser.add_argument("--export-budget", type=float, default=1.0, help="Budget for export in seconds")
+    arg_parser.add_argument("--import-budget", type=float, default=1.0, help="Budget for import in seconds")
+    args = arg_parser.parse_args()
+
+    missing_config = "does-not-exist.json"
+    commands = [
+        ("--version", ["--version"], args.version_budget),
+        ("export", ["export", "--config", missing_config], args.export_budget),
+        ("import", ["import", "--config", missing_config], args.import_budget),
+    ]
+
+    failed = False
+    with tempfile.TemporaryDirectory() as cwd:
+        # warm up the file system cache and bytecode
+        measure(["--version"], 1, cwd)
+        for name, arguments, budget in commands:
+            median = measure(arguments, args.runs, cwd)
+            over_budget = median > budget
+            failed |= over_budget
+            status = "  OVER BUDGET" if over_budget else ""
+            print(f"{name:<10} {median * 1000:8.1f} ms  (budget {budget * 1000:.0f} ms){status}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import pytest
+from pydantic import ValidationError
+
+from ad_user_sync.model import BulkResolution, JoinResolution, NameResolution, ResolutionSelector
+from ad_user_sync.model.Action import DisableAction, EnableAction, JoinAction, LeaveAction, NameAction
+from ad_user_sync.model.Resolution import DisableResolution, LeaveResolution
+
+OPERATORS = "CN=p-Operators,OU=Groups,DC=target"
+ADMINS = "CN=p-Admins,OU=Groups,DC=target"
+
+ACTIONS = [
+    JoinAction(user="alice", group=OPERATORS),
+    JoinAction(user="bob", group=OPERATORS),
+    JoinAction(user="alice", group=ADMINS),
+    LeaveAction(user="carol", group=OPERATORS),
+    DisableAction(user="dave", deleted=True),
+    DisableAction(user="erin", deleted=False),
+    EnableAction(user="frank"),
+    NameAction(user="grace", name="grace", conflict_user="CN=Grace", input_name="grace", attributes={}),
+]
+
+
+def get_keys(resolutions):
+    return [(type(r).__name__, r.user, getattr(r, "group", None), r.accept) for r in resolutions]
+
+
+def test_selectors():
+    bulk = BulkResolution(
+        selectors=[
+            ResolutionSelector(type="join", group=OPERATORS, accept=True),
+            ResolutionSelector(type="disable", deleted=True, accept=False),
+            ResolutionSelector(type="leave", user="carol", accept=True),
+            ResolutionSelector(type="name", accept=False),
+        ]
+    )
+
+    assert get_keys(bulk.expand(ACTIONS)) == [
+        ("JoinResolution", "alice", OPERATORS, True),
+        ("JoinResolution", "bob", OPERATORS, True),
+        ("LeaveResolution", "carol", OPERATORS, True),
+        ("DisableResolution", "dave", None, False),
+        ("NameResolution", "grace", None, False),
+    ]
+    assert bulk.expand(ACTIONS)[-1].name == "grace"
+
+
+def test_explicit_resolutions_first():
+    explicit = [
+        JoinResolution(user="bob", group=OPERATORS, accept=False),
+        NameResolution(user="grace", name="grace", accept=True, new_name="grace2"),
+    ]
+    bulk = BulkResolution(
+        resolutions=explicit,
+        selectors=[
+            ResolutionSelector(type="join", accept=True),
+            ResolutionSelector(type="join", accept=False),
+            ResolutionSelector(type="name", accept=False),
+        ],
+    )
+    resolutions = bulk.expand(ACTIONS)
+
+    # actions resolved explicitly are skipped, the first matching selector wins
+    assert resolutions[:2] == explicit
+    assert get_keys(resolutions[2:]) == [
+        ("JoinResolution", "alice", OPERATORS, True),
+        ("JoinResolution", "alice", ADMINS, True),
+    ]
+
+
+def test_no_match():
+    bulk = BulkResolution(
+        resolutions=[DisableResolution(user="erin", accept=False), LeaveResolution(user="carol", group=ADMINS)],
+        selectors=[ResolutionSelector(type="enable", accept=False, user="nobody")],
+    )
+
+    assert bulk.expand(ACTIONS) == bulk.resolutions
+    assert BulkResolution().expand(ACTIONS) == []
+
+
+@pytest.mark.parametrize("type", ["enable", "name"])
+def test_accept_requires_input(type):
+    with pytest.raises(ValidationError):
+        ResolutionSelector(type=type, accept=True)
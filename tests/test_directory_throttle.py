@@ -0,0 +1,168 @@
+import logging
+import time
+
+import pytest
+
+from ad_user_sync.active_directory import ReplayedDirectoryError
+from ad_user_sync.active_directory.DirectoryThrottle import (
+    ConcurrencyLimiter,
+    DirectoryThrottle,
+    TokenBucket,
+    get_error_code,
+    is_retryable_error,
+    is_transient_error,
+)
+from ad_user_sync.model import ThrottleConfig
+
+ERROR_DS_BUSY = "0x8007200e"
+ERROR_DS_UNAVAILABLE = "0x8007200f"
+ERROR_DS_SERVER_DOWN = "0x8007203a"
+ERROR_DS_TIMELIMIT_EXCEEDED = "0x80072022"
+ERROR_TIMEOUT = "0x800705b4"
+ERROR_ACCESS_DENIED = "0x80070005"
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # backoff delays are recorded instead of slept
+    delays = []
+    monkeypatch.setattr(time, "sleep", delays.append)
+    return delays
+
+
+def make_error(code):
+    return ReplayedDirectoryError("failed", code)
+
+
+def make_throttle(**config):
+    return DirectoryThrottle(ThrottleConfig(**config), logging.getLogger(__name__))
+
+
+def fail_with(*codes, result="done"):
+    # operation failing with the given errors, one per call, then returning `result`
+    errors = iter(codes)
+
+    def operation():
+        code = next(errors, None)
+        if code is not None:
+            raise make_error(code)
+        return result
+
+    return operation
+
+
+def test_error_codes():
+    assert get_error_code(make_error(ERROR_DS_BUSY)) == 0x8007200E
+    assert get_error_code(make_error("-0x7ff8dff2")) == 0x8007200E
+    assert get_error_code(make_error(None)) is None
+    assert get_error_code(RuntimeError("failed")) is None
+
+
+@pytest.mark.parametrize(
+    "code, read, write",
+    [
+        (ERROR_DS_BUSY, True, True),
+        (ERROR_DS_UNAVAILABLE, True, True),
+        (ERROR_DS_SERVER_DOWN, True, True),
+        (ERROR_DS_TIMELIMIT_EXCEEDED, True, False),
+        (ERROR_TIMEOUT, True, False),
+        (ERROR_ACCESS_DENIED, False, False),
+        (None, False, False),
+    ],
+)
+def test_retryable_errors(code, read, write):
+    error = make_error(code)
+
+    assert is_transient_error(error) is read
+    assert is_retryable_error(error, "read") is read
+    assert is_retryable_error(error, "write") is write
+
+
+def test_only_directory_errors_are_retried():
+    error = RuntimeError("failed")
+    error.error_info = dict(error_code=ERROR_DS_BUSY)
+
+    assert not is_retryable_error(error, "read")
+    assert not is_retryable_error(error, "write")
+
+
+def test_retry(sleeps):
+    throttle = make_throttle(max_retries=5)
+
+    assert throttle.call("read", "Reading", fail_with(ERROR_TIMEOUT, ERROR_DS_BUSY)) == "done"
+    assert throttle.call("write", "Writing", fail_with(ERROR_DS_SERVER_DOWN)) == "done"
+    stats = throttle.get_stats()
+    assert (stats.reads, stats.writes, stats.retries, stats.failures) == (3, 2, 3, 0)
+    assert len(sleeps) == 3
+
+
+def test_write_timeout_is_not_retried(sleeps):
+    throttle = make_throttle(max_retries=5)
+
+    # the write may have been applied, retrying it could apply it twice
+    with pytest.raises(ReplayedDirectoryError):
+        throttle.call("write", "Writing", fail_with(ERROR_TIMEOUT))
+    with pytest.raises(ReplayedDirectoryError):
+        throttle.call("read", "Reading", fail_with(ERROR_ACCESS_DENIED))
+    stats = throttle.get_stats()
+    assert (stats.retries, stats.failures) == (0, 2)
+    assert sleeps == []
+
+
+def test_backoff_bounds(sleeps):
+    throttle = make_throttle(max_retries=8, retry_base_delay=0.5, retry_max_delay=4)
+
+    with pytest.raises(ReplayedDirectoryError):
+        throttle.call("read", "Reading", fail_with(*[ERROR_DS_BUSY] * 9))
+    assert len(sleeps) == 8
+    # full jitter: each delay is between 0 and the exponential backoff, which is capped at retry_max_delay
+    for attempt, delay in enumerate(sleeps, start=1):
+        assert 0 <= delay <= min(4, 0.5 * 2 ** (attempt - 1))
+    assert throttle.get_stats().failures == 1
+
+
+def test_limit_halves_when_overloaded():
+    limiter = ConcurrencyLimiter(max_concurrency=8, target_latency=1.0)
+    limits = []
+    for overloaded, latency in [(True, 0.1), (False, 2.0), (True, 0.1), (True, 0.1), (True, 0.1)]:
+        limiter.acquire()
+        limiter.release(latency, overloaded=overloaded)
+        limits.append(limiter.limit)
+
+    # slow operations count as overloaded, the limit never drops below one
+    assert limits == [4, 2, 1, 1, 1]
+    assert limiter.decreases == 5
+    assert limiter.running == 0
+
+
+def test_limit_recovers():
+    limiter = ConcurrencyLimiter(max_concurrency=4, target_latency=1.0)
+    limiter.limit = 1.0
+    limits = []
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(0.1, overloaded=False)
+        limits.append(limiter.limit)
+
+    # grows by about one per `limit` fast operations, up to max_concurrency
+    assert limits[:3] == pytest.approx([2, 2.5, 2.9])
+    assert limits == sorted(limits)
+    assert limits[-1] == 4
+    assert limiter.decreases == 0
+
+
+def test_token_bucket(sleeps):
+    bucket = TokenBucket(rate=10)
+
+    # a burst of `rate` operations passes at once, the next one waits for a token
+    assert [bucket.acquire() for _ in range(10)] == [0.0] * 10
+    wait = bucket.acquire()
+    assert 0 < wait <= 0.1
+    assert sleeps == [wait]
+
+
+def test_token_bucket_without_rate(sleeps):
+    bucket = TokenBucket(rate=None)
+
+    assert [bucket.acquire() for _ in range(100)] == [0.0] * 100
+    assert sleeps == []
@@ -0,0 +1,160 @@
+import json
+import logging
+from datetime import datetime
+
+import pytest
+
+from ad_user_sync.active_directory import (
+    DirectoryLookupError,
+    NameEntry,
+    NameIndex,
+    RecordingDirectory,
+    ReplayDirectory,
+    ReplayedDirectoryError,
+    TraceMismatchError,
+)
+from ad_user_sync.active_directory.DirectoryTrace import LargeInteger, ReplayObject, decode, encode
+from ad_user_sync.model import ThrottleConfig, ThrottleStats
+
+logger = logging.getLogger(__name__)
+
+ALICE = "CN=Alice,OU=Users,DC=target"
+BOB = "CN=Bob,OU=Users,DC=target"
+STAFF = "CN=Staff,OU=Groups,DC=target"
+
+
+class ADUser:
+    # like a pyad user, only its names are recorded
+    def __init__(self, dn, cn):
+        self.dn = dn
+        self.cn = cn
+
+
+class FakeDirectory:
+    def __init__(self):
+        self.metadata = None
+        self.passwords = {}
+        self.expirations = []
+
+    def find_single_user(self, base_dn, where_clause):
+        if where_clause == "cn = 'Alice'":
+            return ADUser(ALICE, "Alice")
+        raise DirectoryLookupError(f"No user matches {where_clause}")
+
+    def get_group_members(self, group):
+        return frozenset([ALICE, BOB])
+
+    def iter_users_attributes(self, attributes, base_dn):
+        yield dict(distinguishedName=ALICE, accountExpires=LargeInteger(30000000, 0))
+        yield dict(distinguishedName=BOB, accountExpires=None)
+
+    def set_password(self, user, password):
+        self.passwords[user.dn] = password
+
+    def set_expiration(self, user, expiration):
+        self.expirations.append(expiration)
+
+    def disable_user(self, user):
+        raise ReplayedDirectoryError("Access is denied.", "0x80070005")
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        None,
+        "text",
+        [1, 2.5, True],
+        {"a": {"b": None}},
+        ("x", 1),
+        {ALICE, BOB},
+        frozenset([STAFF]),
+        datetime(2026, 1, 2, 3, 4, 5),
+        b"\x00\xff",
+        LargeInteger(30000000, 12),
+        ThrottleStats(reads=3, retries=1),
+    ],
+)
+def test_encode_decode(value):
+    encoded = json.loads(json.dumps(encode(value)))
+
+    assert decode(encoded) == value
+    assert type(decode(encoded)) is type(value)
+
+
+def test_encode_decode_objects():
+    user = decode(encode(ADUser(ALICE, "Alice")))
+    assert isinstance(user, ReplayObject)
+    assert (user.dn, user.cn) == (ALICE, "Alice")
+    assert user.parent_container.dn == "OU=Users,DC=target"
+
+    index = NameIndex("DC=target")
+    index.add(NameEntry(ALICE, "Alice", "alice", "alice@target"), usn_changed=42)
+    decoded = decode(json.loads(json.dumps(encode(index))))
+    assert decoded.entries == index.entries
+    assert decoded.highest_usn == 42
+    assert decoded.by_account_name == index.by_account_name
+
+
+def record_session(file):
+    directory = FakeDirectory()
+    recording = RecordingDirectory(directory, file)
+    alice = recording.find_single_user("DC=target", "cn = 'Alice'")
+    with pytest.raises(DirectoryLookupError):
+        recording.find_single_user("DC=target", "cn = 'Carol'")
+    recording.get_group_members(STAFF)
+    rows = list(recording.iter_users_attributes(iter(["distinguishedName", "accountExpires"]), "DC=target"))
+    recording.set_password(alice, "secret")
+    recording.set_expiration(alice, datetime(2026, 1, 1))
+    with pytest.raises(ReplayedDirectoryError):
+        recording.disable_user(alice)
+    recording.close()
+    return directory, rows
+
+
+def test_record_and_replay(tmp_path):
+    file = tmp_path / "trace.jsonl"
+    directory, rows = record_session(file)
+    assert directory.passwords == {ALICE: "secret"}
+    assert "secret" not in file.read_text()
+
+    replay = ReplayDirectory(file, logger)
+    alice = replay.find_single_user("DC=target", "cn = 'Alice'")
+    assert alice == ReplayObject("ADUser", ALICE, "Alice")
+    with pytest.raises(DirectoryLookupError):
+        replay.find_single_user("DC=target", "cn = 'Carol'")
+    assert replay.get_group_members(STAFF) == frozenset([ALICE, BOB])
+    assert list(replay.iter_users_attributes(["distinguishedName", "accountExpires"], "DC=target")) == rows
+    # passwords are matched redacted and points in time are ignored
+    replay.set_password(alice, "other")
+    replay.set_expiration(alice, datetime(2027, 6, 1))
+    with pytest.raises(ReplayedDirectoryError) as error:
+        replay.disable_user(alice)
+    assert error.value.error_info["error_code"] == "0x80070005"
+    assert replay.replayed == 7
+
+
+def test_replay_mismatch(tmp_path):
+    file = tmp_path / "trace.jsonl"
+    record_session(file)
+    replay = ReplayDirectory(file, logger)
+
+    with pytest.raises(TraceMismatchError):
+        replay.get_group_members("CN=Other,OU=Groups,DC=target")
+    with pytest.raises(AttributeError):
+        replay.delete_everything()
+
+
+def test_replay_retries_injected_errors(tmp_path):
+    file = tmp_path / "trace.jsonl"
+    record_session(file)
+    throttle = ThrottleConfig(max_retries=100, retry_base_delay=0.001, retry_max_delay=0.001)
+    replay = ReplayDirectory(file, logger, throttle=throttle, busy_rate=0.3, timeout_rate=0.3, seed=1)
+
+    for _ in range(20):
+        assert replay.get_group_members(STAFF) == frozenset([ALICE, BOB])
+        replay.set_password(ReplayObject("ADUser", ALICE, "Alice"), "other")
+    stats = replay.throttle.get_stats()
+    assert replay.injected_busy > 0
+    assert replay.injected_timeouts > 0
+    assert stats.retries == replay.injected_busy + replay.injected_timeouts
+    assert stats.failures == 0
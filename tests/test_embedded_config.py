@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from ad_user_sync.embedded_config import EmbeddedConfig
+
+EXPORT_CONFIG = '{"output_file": "export.json"}'
+IMPORT_CONFIG = '{"input_file": "users.json", "group_path": "OU=Gruppen ä"}'
+
+ROOT_PATH = Path(__file__).parent.parent
+MAIN_SCRIPT = ROOT_PATH / "ad_user_sync" / "__main__.py"
+
+
+@pytest.fixture
+def executable(tmp_path):
+    file = tmp_path / "ad-user-sync.exe"
+    file.write_bytes(b"MZ" + bytes(range(256)) * 64)
+    return file
+
+
+@pytest.mark.parametrize(
+    "export_config, import_config",
+    [(EXPORT_CONFIG, IMPORT_CONFIG), (EXPORT_CONFIG, None), (None, IMPORT_CONFIG), (None, None)],
+)
+def test_embed_and_read(executable, export_config, import_config):
+    content = executable.read_bytes()
+    EmbeddedConfig.embed(executable, export_config=export_config, import_config=import_config)
+
+    assert executable.read_bytes().startswith(content)
+    assert EmbeddedConfig.read_sections(executable) == (export_config, import_config)
+    trailer = EmbeddedConfig.TRAILER.unpack(executable.read_bytes()[-EmbeddedConfig.TRAILER.size :])
+    assert trailer[0] == EmbeddedConfig.TRAILER_MAGIC
+
+
+def test_read_without_trailer(executable):
+    # binaries of older versions only contain the markers
+    with open(executable, "ab") as f:
+        f.write(EmbeddedConfig.HEADER_EXPORT_START + EXPORT_CONFIG.encode() + EmbeddedConfig.HEADER_EXPORT_END)
+        f.write(EmbeddedConfig.HEADER_IMPORT_START + IMPORT_CONFIG.encode() + EmbeddedConfig.HEADER_IMPORT_END)
+        f.write(b"\x00" * 16)
+
+    assert EmbeddedConfig.read_sections(executable) == (EXPORT_CONFIG, IMPORT_CONFIG)
+
+
+def test_read_markers_of_embedded_config(executable):
+    # the markers are kept next to the trailer, so older versions find the configs too
+    EmbeddedConfig.embed(executable, export_config=EXPORT_CONFIG, import_config=IMPORT_CONFIG)
+    buffer = executable.read_bytes()
+    config = EmbeddedConfig
+
+    assert config.get_section(buffer, config.HEADER_EXPORT_START, config.HEADER_EXPORT_END) == EXPORT_CONFIG
+    assert config.get_section(buffer, config.HEADER_IMPORT_START, config.HEADER_IMPORT_END) == IMPORT_CONFIG
+
+
+def test_read_without_config(executable, tmp_path):
+    assert EmbeddedConfig.read_sections(executable) == (None, None)
+
+    small = tmp_path / "small.exe"
+    small.write_bytes(b"MZ")
+    assert EmbeddedConfig.read_sections(small) == (None, None)
+
+
+def run_embed(*args):
+    env = dict(os.environ, PYTHONPATH=str(ROOT_PATH))
+    return subprocess.run([sys.executable, MAIN_SCRIPT, "embed", *args], env=env, capture_output=True, text=True)
+
+
+def test_embed_command(executable, tmp_path):
+    export_file = ROOT_PATH / "export_config.json"
+    import_file = ROOT_PATH / "import_config.json"
+    content = executable.read_bytes()
+    output = tmp_path / "ad-user-sync-site.exe"
+
+    result = run_embed(executable, "--export-config", export_file, "--import-config", import_file, "--output", output)
+
+    assert result.returncode == 0, result.stderr
+    assert executable.read_bytes() == content
+    assert EmbeddedConfig.read_sections(output) == (
+        export_file.read_text(encoding="utf-8"),
+        import_file.read_text(encoding="utf-8"),
+    )
+    # configs are embedded once, a second run would leave the first ones visible to older versions
+    assert run_embed(output, "--export-config", export_file).returncode != 0
+
+
+def test_embed_command_rejects_invalid_config(executable, tmp_path):
+    import_file = tmp_path / "import_config.json"
+    import_file.write_text('{"max_parallel_partitions": 0}', encoding="utf-8")
+    content = executable.read_bytes()
+
+    assert run_embed(executable, "--import-config", import_file).returncode != 0
+    assert run_embed(executable).returncode != 0
+    assert executable.read_bytes() == content
@@ -0,0 +1,77 @@
+import random
+
+from ad_user_sync.membership import MembershipMatrix
+from ad_user_sync.model import ObjectRecord
+
+STAFF = "CN=Staff,OU=Groups,DC=target"
+SALES = "CN=Sales,OU=Groups,DC=target"
+ALL = "CN=All,OU=Groups,DC=target"
+
+GROUP_MAP = {
+    "CN=Staff,DC=source": {STAFF},
+    "CN=Sales,DC=source": {SALES, STAFF},
+    "*": {ALL},
+}
+
+
+def make_user(cn):
+    return ObjectRecord(f"CN={cn},OU=Users,DC=target", cn)
+
+
+def get_cns(users):
+    return [u.cn for u in users]
+
+
+def test_desired_members():
+    matrix = MembershipMatrix(GROUP_MAP)
+    matrix.add(make_user("Alice"), ("CN=Staff,DC=source",))
+    matrix.add(make_user("Bob"), ("CN=Sales,DC=source", "CN=Unmapped,DC=source"))
+    matrix.add(make_user("Carol"), ())
+
+    assert matrix.groups == sorted([STAFF, SALES, ALL])
+    desired = {dn: get_cns(matrix.get_users(matrix.get_desired(i))) for i, dn in enumerate(matrix.groups)}
+    assert desired == {STAFF: ["Alice", "Bob"], SALES: ["Bob"], ALL: ["Alice", "Bob", "Carol"]}
+
+
+def test_lookup_by_dn():
+    matrix = MembershipMatrix(GROUP_MAP)
+    alice = make_user("Alice")
+    matrix.add(alice, ())
+
+    assert alice.dn.upper() in matrix
+    assert "CN=Bob,OU=Users,DC=target" not in matrix
+    assert len(matrix) == 1
+    # members that were not added (e.g. managed by someone else) are left out
+    assert matrix.get_users(matrix.get_bits([alice.dn.lower(), "CN=Bob,OU=Users,DC=target"])) == [alice]
+
+
+def test_added_twice():
+    matrix = MembershipMatrix(GROUP_MAP)
+    matrix.add(make_user("Alice"), ())
+    matrix.get_desired(0)
+    matrix.add(make_user("Alice"), ("CN=Staff,DC=source",))
+
+    assert len(matrix) == 1
+    assert get_cns(matrix.get_users(matrix.get_desired(matrix.groups.index(STAFF)))) == ["Alice"]
+
+
+def test_changes_match_sets():
+    rng = random.Random(0)
+    sources = [f"CN=Source{i},DC=source" for i in range(6)]
+    group_map = {source: {f"CN=Target{rng.randrange(4)},DC=target"} for source in sources} | {"*": set()}
+    matrix = MembershipMatrix(group_map)
+    users = [make_user(f"User{i}") for i in range(100)]
+    member_of = {}
+    for user in users:
+        member_of[user] = tuple(rng.sample(sources, rng.randrange(3)))
+        matrix.add(user, member_of[user])
+
+    for index, group in enumerate(matrix.groups):
+        desired = {u for u in users if any(group in group_map[s] for s in member_of[u])}
+        current = set(rng.sample(users, 30))
+        current_dns = [u.dn for u in current] + ["CN=Unmanaged,DC=target"]
+
+        old_members = matrix.get_bits(current_dns)
+        desired_members = matrix.get_desired(index)
+        assert set(matrix.get_users(desired_members & ~old_members)) == desired - current
+        assert set(matrix.get_users(old_members & ~desired_members)) == current - desired
@@ -0,0 +1,35 @@
+import subprocess
+import sys
+from importlib import import_module
+from pathlib import Path
+from types import ModuleType
+
+import ad_user_sync
+from ad_user_sync import model
+
+ROOT_PATH = Path(__file__).parent.parent
+
+
+def test_exports():
+    assert set(ad_user_sync.__all__) <= set(dir(ad_user_sync))
+    # the subcommand modules need their own dependencies (pyminizip, ...), only the shared exports are resolved
+    for name, module in ad_user_sync._lazy_attributes.items():
+        if module in (".model", ".active_directory"):
+            assert getattr(ad_user_sync, name) is getattr(import_module(module, "ad_user_sync"), name)
+    # everything the model package exports is exported by the package too
+    model_exports = {name for name, value in vars(model).items() if not isinstance(value, ModuleType)}
+    assert {name for name in model_exports if not name.startswith("_")} <= set(ad_user_sync.__all__)
+
+
+def test_unknown_attribute_imports_nothing():
+    # run in a fresh interpreter, the submodules are already imported into this one
+    code = "\n".join(
+        [
+            "import sys, ad_user_sync",
+            "assert not hasattr(ad_user_sync, 'ImportConfigg')",
+            "assert not hasattr(ad_user_sync, '__path_hooks__')",
+            "assert not [m for m in sys.modules if m.startswith(('ad_user_sync.', 'pydantic'))], sys.modules",
+        ]
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT_PATH, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
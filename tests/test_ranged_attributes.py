@@ -0,0 +1,84 @@
+import logging
+import re
+
+from ad_user_sync.active_directory import CachedActiveDirectory
+from ad_user_sync.active_directory.CachedActiveDirectory import get_range_values
+
+GROUP = "CN=Staff,OU=Groups,DC=target"
+SMALL_GROUP = "CN=Sales,OU=Groups,DC=target"
+EMPTY_GROUP = "CN=Empty,OU=Groups,DC=target"
+
+
+class FakeQuery:
+    # Answers ranged reads like a domain controller with a MaxValRange of 1000, below the default of 1500.
+    MAX_VALUES = 1000
+
+    def __init__(self, objects, requests):
+        self.objects = {dn.lower(): (dn, values) for dn, values in objects.items()}  # found case-insensitively
+        self.requests = requests
+        self.rows = []
+
+    def execute_query(self, attributes, where_clause, base_dn, search_scope="subtree", ldap_dialect=False):
+        self.requests.append(attributes)
+        attribute, value_range = attributes[-1].split(";range=")
+        start = int(value_range.removesuffix("-*"))
+        if search_scope == "base":
+            dns = [base_dn]
+        else:
+            dns = re.findall(r"\(distinguishedName=([^)]*)\)", where_clause)
+        for dn, values in map(lambda dn: self.objects[dn.lower()], dns):
+            row = dict(distinguishedName=dn)
+            if start < len(values):
+                end = min(start + self.MAX_VALUES, len(values))
+                upper = "*" if end == len(values) else end - 1
+                row[f"{attribute};range={start}-{upper}"] = tuple(values[start:end])
+            self.rows.append(row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_results(self):
+        return iter(self.rows)
+
+    def get_single_result(self):
+        return self.rows[0]
+
+
+def make_directory(objects):
+    directory = CachedActiveDirectory(logging.getLogger(__name__))
+    requests = []
+    directory._query = lambda: FakeQuery(objects, requests)
+    return directory, requests
+
+
+def make_members(count):
+    return [f"CN=User{i},OU=Users,DC=target" for i in range(count)]
+
+
+def test_get_range_values():
+    row = {"distinguishedName": GROUP, "member;range=0-999": ("a", "b")}
+    assert get_range_values(row, "member") == (["a", "b"], 999)
+    assert get_range_values({"Member;Range=1000-*": ("c",)}, "member") == (["c"], None)
+    assert get_range_values({"distinguishedName": GROUP}, "member") == ([], None)
+    assert get_range_values({"memberOf;range=0-*": ("d",)}, "member") == ([], None)
+
+
+def test_read_ranged_attribute():
+    members = make_members(2500)
+    directory, requests = make_directory({GROUP: members, EMPTY_GROUP: []})
+
+    # the delivered ranges are shorter than 1500 values, reading continues after the last value delivered
+    assert directory.read_ranged_attribute(GROUP, "member") == (members, 3)
+    assert [r[-1] for r in requests] == ["member;range=0-*", "member;range=1000-*", "member;range=2000-*"]
+    assert directory.read_ranged_attribute(EMPTY_GROUP, "member") == ([], 1)
+
+
+def test_read_ranged_attributes():
+    objects = {GROUP: make_members(2500), SMALL_GROUP: make_members(999), EMPTY_GROUP: []}
+    directory, requests = make_directory(objects)
+
+    values, count = directory.read_ranged_attributes(objects, "member", "DC=target")
+
+    assert values == {dn.lower(): members for dn, members in objects.items()}
+    # the first range of all groups is read at once, only the large group needs more
+    assert count == len(requests) == 3
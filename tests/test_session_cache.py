@@ -0,0 +1,174 @@
+import logging
+import time
+
+import pytest
+
+from ad_user_sync.active_directory import CachedActiveDirectory, SessionCache
+from ad_user_sync.active_directory.SessionCache import MISSING, session_cached
+from ad_user_sync.model import CacheConfig
+
+STAFF = "CN=Staff,OU=Groups,DC=target"
+ALICE = "CN=Alice,OU=Users,DC=target"
+BOB = "CN=Bob,OU=Users,DC=target"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # entries expire by this clock instead of the real one
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_cache(**config):
+    return SessionCache(CacheConfig(**config))
+
+
+def test_hit_and_miss(clock):
+    cache = make_cache()
+    cache.put(("get_group", STAFF), "group")
+
+    assert cache.get(("get_group", STAFF)) == "group"
+    assert cache.get(("get_group", "CN=Other")) is MISSING
+    stats = cache.get_stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 1, 1)
+
+
+def test_expiry(clock):
+    cache = make_cache(ttl=10, negative_ttl=2)
+    cache.put(("find_single_user", None, "cn = 'Alice'"), "alice")
+    # a lookup that found nothing is cached too, but expires sooner
+    cache.put(("find_single_user", None, "cn = 'Bob'"), None)
+
+    clock[0] += 2
+    assert cache.get(("find_single_user", None, "cn = 'Bob'")) is None
+    clock[0] += 0.1
+    assert cache.get(("find_single_user", None, "cn = 'Bob'")) is MISSING
+    assert cache.peek(("find_single_user", None, "cn = 'Alice'")) == "alice"
+    clock[0] += 8
+    assert cache.peek(("find_single_user", None, "cn = 'Alice'")) is MISSING
+    assert cache.get(("find_single_user", None, "cn = 'Alice'")) is MISSING
+    stats = cache.get_stats()
+    assert (stats.expirations, stats.size) == (2, 0)
+
+
+def test_eviction_order(clock):
+    cache = make_cache(max_entries=3)
+    for name in ["a", "b", "c"]:
+        cache.put(("get_group", name), name)
+    # reading an entry makes it the most recently used one, peeking does not
+    cache.get(("get_group", "a"))
+    cache.peek(("get_group", "b"))
+    cache.put(("get_group", "d"), "d")
+    cache.put(("get_group", "e"), "e")
+
+    assert list(cache.entries) == [("get_group", "a"), ("get_group", "d"), ("get_group", "e")]
+    assert cache.get_stats().evictions == 2
+
+
+def test_invalidation(clock):
+    cache = make_cache()
+    cache.put(("find_users", None, True), {"alice"})
+    cache.put(("find_single_user", None, "cn = 'Alice'"), "alice")
+    cache.put(("get_group", STAFF), "group")
+    cache.invalidate(("get_group", STAFF))
+    cache.invalidate(("get_group", "CN=Other"))
+
+    cache.invalidate_namespaces("find_users", "find_single_user")
+    assert cache.entries == {}
+
+
+class Directory:
+    def __init__(self):
+        self.cache = make_cache()
+        self.calls = []
+
+    @session_cached
+    def find_single_user(self, parent, where, recursive=True):
+        self.calls.append(where)
+        return None if where == "missing" else where.upper()
+
+
+def test_session_cached(clock):
+    directory = Directory()
+
+    assert directory.find_single_user(None, "alice") == "ALICE"
+    # keyed by the bound arguments with defaults, however they are passed
+    assert directory.find_single_user(None, where="alice", recursive=True) == "ALICE"
+    assert directory.find_single_user(None, "missing") is None
+    assert directory.find_single_user(None, "missing") is None
+    assert directory.calls == ["alice", "missing"]
+    assert ("find_single_user", None, "alice", True) in directory.cache.entries
+
+
+class FakeObject:
+    def __init__(self, dn, cn):
+        self.dn = dn
+        self.cn = cn
+        self.changes = []
+
+    def append_to_attribute(self, attribute, values):
+        self.changes.append(("append", attribute, values))
+
+    def remove_from_attribute(self, attribute, values):
+        self.changes.append(("remove", attribute, values))
+
+    def move(self, container):
+        self.dn = f"CN={self.cn},{container.dn}"
+
+
+@pytest.fixture
+def directory(clock):
+    return CachedActiveDirectory(logging.getLogger(__name__))
+
+
+def test_members_write_through(directory):
+    group = FakeObject(STAFF, "Staff")
+    directory.cache.put(("_get_user_members", STAFF), {ALICE.lower()})
+
+    directory.add_members(group, [BOB])
+    members = directory.get_user_members(group)
+    assert members == {ALICE.lower(), BOB.lower()}
+    # a copy is returned, changing it does not change the cached members
+    members.clear()
+    directory.remove_members(group, [ALICE])
+    assert directory.get_user_members(group) == {BOB.lower()}
+    assert group.changes == [("append", "member", [BOB]), ("remove", "member", [ALICE])]
+
+
+def test_moved_user_lookups(directory):
+    users = FakeObject("OU=Users,DC=target", "Users")
+    archive = FakeObject("OU=Archive,DC=target", "Archive")
+    alice = FakeObject(ALICE, "Alice")
+    directory.cache.put(("find_single_user", users, "cn = 'Alice'"), alice)
+    directory.cache.put(("find_single_user", users, "sAMAccountName = 'alice'"), alice)
+    directory.cache.put(("find_single_user", None, "sAMAccountName = 'alice'"), alice)
+    directory.cache.put(("find_users", users, True), {alice})
+    directory.cache.put(("find_users", archive, False), set())
+
+    directory.move_user(alice, archive)
+
+    # lookups below the old container do not find the user anymore, lookups in the whole directory still do
+    assert directory.cache.peek(("find_single_user", users, "cn = 'Alice'")) is MISSING
+    assert directory.cache.peek(("find_single_user", users, "sAMAccountName = 'alice'")) is MISSING
+    assert directory.cache.peek(("find_single_user", None, "sAMAccountName = 'alice'")) is alice
+    assert directory.cache.peek(("find_users", users, True)) == set()
+    assert directory.cache.peek(("find_users", archive, False)) == {alice}
+
+
+def test_invalidate_users(directory):
+    group = FakeObject(STAFF, "Staff")
+    for key in [
+        ("find_single_user", None, "cn = 'Alice'"),
+        ("find_users", None, True),
+        ("get_group_members", STAFF),
+        ("_get_user_members", STAFF),
+    ]:
+        directory.cache.put(key, set())
+    directory.cache.put(("get_group", STAFF), group)
+    directory.cache.put(("get_container", "OU=Users,DC=target"), "container")
+
+    directory.invalidate_users()
+
+    # groups and containers stay cached, all user lookups and group members are read again
+    assert sorted(key[0] for key in directory.cache.entries) == ["get_container", "get_group"]
@@ -0,0 +1,73 @@
+from ad_user_sync.model import validate_user_records
+
+
+def make_user(cn, **values):
+    return dict(cn=cn, sAMAccountName=cn.lower(), memberOf=["CN=Staff,DC=source"]) | values
+
+
+def test_valid_records():
+    users = [
+        make_user("Alice", disabled=True, subPath="OU=Sales", mail="alice@example.com", otherMobile=["1", "2"]),
+        make_user("Bob", memberOf=None),
+    ]
+    records, invalid = validate_user_records(users)
+
+    assert invalid == []
+    assert [r.cn for r in records] == ["Alice", "Bob"]
+    alice, bob = records
+    assert alice.account_name == "alice"
+    assert alice.member_of == ("CN=Staff,DC=source",)
+    assert alice.disabled is True
+    assert alice.sub_path == "OU=Sales"
+    assert alice.attributes == dict(mail="alice@example.com", otherMobile=["1", "2"])
+    assert bob.member_of == ()
+    assert bob.disabled is False
+    assert bob.sub_path is None
+
+
+def test_shared_member_of():
+    records, _ = validate_user_records([make_user("Alice"), make_user("Bob")])
+
+    assert records[0].member_of is records[1].member_of
+
+
+def test_invalid_records():
+    users = [
+        "Alice",
+        dict(sAMAccountName="nocn", memberOf=[]),
+        make_user(" "),
+        make_user("Bob", sAMAccountName=""),
+        dict(cn="Carol", sAMAccountName="carol"),
+        make_user("Dave", memberOf="CN=Staff,DC=source"),
+        make_user("Eve", disabled="yes"),
+        make_user("Frank", subPath=1),
+        make_user("Grace", manager=dict(cn="Alice")),
+        make_user("Heidi"),
+    ]
+    records, invalid = validate_user_records(users)
+
+    assert [r.cn for r in records] == ["Heidi"]
+    assert [(r.index, r.cn, r.error) for r in invalid] == [
+        (0, None, "Not an object: str"),
+        (1, None, "Missing or empty cn"),
+        (2, None, "Missing or empty cn"),
+        (3, "Bob", "Missing or empty sAMAccountName"),
+        (4, "Carol", "Missing memberOf"),
+        (5, "Dave", "memberOf is not a list of group paths"),
+        (6, "Eve", "disabled is not a boolean"),
+        (7, "Frank", "subPath is not a string"),
+        (8, "Grace", "Unsupported value of manager: dict"),
+    ]
+
+
+def test_duplicate_cns():
+    users = [make_user("Alice"), "invalid", make_user("Bob"), make_user("ALICE", sAMAccountName="alice2")]
+    records, invalid = validate_user_records(users)
+
+    # none of the duplicates is imported, the invalid records are in input order
+    assert [r.cn for r in records] == ["Bob"]
+    assert [(r.index, r.cn, r.error) for r in invalid] == [
+        (0, "Alice", "Duplicate cn (records 0, 3)"),
+        (1, None, "Not an object: str"),
+        (3, "ALICE", "Duplicate cn (records 0, 3)"),
+    ]